@@ -2,7 +2,7 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Author, Genre, Book, BookInstance, Language
+from .models import Author, Genre, Book, BookInstance, Language, OverdueLoan
 
 # admin.site.register(Book)
 # admin.site.register(Author)
@@ -52,3 +52,8 @@ class BookInstanceAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(OverdueLoan)
+class OverdueLoanAdmin(admin.ModelAdmin):
+    list_display = ('book_instance', 'borrower', 'due_back', 'detected_at', 'notified_at')
+    list_select_related = ('book_instance__book', 'borrower')
+    date_hierarchy = 'due_back'
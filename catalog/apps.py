@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class CatalogConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "catalog"
+
+    def ready(self):
+        # Connect the signal receivers defined in catalog/signals.py
+        from . import signals  # noqa: F401
+        from .visits import check_shared_cache
+        checks.register(check_shared_cache, checks.Tags.caches)
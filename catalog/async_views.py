@@ -0,0 +1,114 @@
+"""Async versions of the catalog's read pages, for ASGI deployments.
+
+Under ASGI a sync view is run in a worker thread for the whole request.
+These views make their reads with the async ORM and cache API instead.
+They are routed in place of the sync views in views.py when
+CATALOG_ASYNC_VIEWS is on, which local_library/asgi.py makes the default
+(see catalog/urls.py).
+
+The pages are the same as the sync ones: same validators, page cache,
+templates and context. They are returned as TemplateResponses, which
+Django renders in a worker thread, so the {% cache %} fragments still
+load their rows lazily and only when they are stale.
+"""
+
+from django.http import Http404
+from django.shortcuts import aget_object_or_404
+from django.template.response import TemplateResponse
+
+from .conditional import aconditional_get, adetail_validators, alist_validators
+from .models import Author, Book
+from .pagecache import acached_page, fragment_context
+from .pagination import AUTHOR_ORDERING, BOOK_ORDERING, CursorPaginator, InvalidCursor
+from .stats import aget_dashboard_stats
+from .visits import acount_visit
+
+# Same page size as the sync list views
+PAGE_SIZE = 10
+
+
+async def load_user(request):
+    """Load request.user up front; reading it lazily would query the database from async code."""
+    request.user = await request.auser()
+    return request.user
+
+
+def list_context(paginator, page, name):
+    """The pagination context a ListView gives its template."""
+    return {
+        'paginator': paginator,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'object_list': page.object_list,
+        name: page.object_list,
+    }
+
+
+async def index(request):
+    """Async version of views.index."""
+    await load_user(request)
+    stats = await aget_dashboard_stats()
+
+    context = {
+        **stats,
+        'num_visits': await acount_visit(request),
+    }
+    return TemplateResponse(request, 'index.html', context)
+
+
+async def book_list(request):
+    """Async version of views.BookListView."""
+    await load_user(request)
+
+    async def page():
+        paginator = CursorPaginator(Book.objects.select_related('author'), BOOK_ORDERING, PAGE_SIZE)
+        try:
+            page = await paginator.apage(request.GET.get('cursor'))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return TemplateResponse(request, 'catalog/book_list.html', list_context(paginator, page, 'book_list'))
+
+    return await aconditional_get(request, await alist_validators('book', Book.objects.all(), 'author'), page)
+
+
+async def book_detail(request, pk):
+    """Async version of views.BookDetailView."""
+    await load_user(request)
+
+    async def page(version):
+        book = await aget_object_or_404(Book.objects.select_related('author'), pk=pk)
+        context = {'object': book, 'book': book, **fragment_context(version)}
+        return TemplateResponse(request, 'catalog/book_detail.html', context)
+
+    return await aconditional_get(
+        request, await adetail_validators('book', pk), lambda: acached_page(request, 'book', pk, page),
+    )
+
+
+async def author_list(request):
+    """Async version of views.AuthorListView."""
+    await load_user(request)
+
+    async def page():
+        paginator = CursorPaginator(Author.objects.all(), AUTHOR_ORDERING, PAGE_SIZE)
+        try:
+            page = await paginator.apage(request.GET.get('cursor'))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return TemplateResponse(request, 'catalog/author_list.html', list_context(paginator, page, 'author_list'))
+
+    return await aconditional_get(request, await alist_validators('author', Author.objects.all()), page)
+
+
+async def author_detail(request, pk):
+    """Async version of views.AuthorDetailView."""
+    await load_user(request)
+
+    async def page(version):
+        author = await aget_object_or_404(Author, pk=pk)
+        context = {'object': author, 'author': author, **fragment_context(version)}
+        return TemplateResponse(request, 'catalog/author_detail.html', context)
+
+    return await aconditional_get(
+        request, await adetail_validators('author', pk), lambda: acached_page(request, 'author', pk, page),
+    )
@@ -0,0 +1,517 @@
+"""Request benchmark for the catalog pages and the API.
+
+run_benchmark() drives the Django test client against a list of
+targets (a name, the URLs to cycle through and the user to log in as)
+and records, per target, latency percentiles, the number of queries per
+request and throughput. The report is a plain dict that can be dumped as
+JSON and compared with an earlier run by compare_reports().
+
+load_test() measures a running server over HTTP instead, with many
+requests in flight at once; the benchmark_servers command uses it to
+compare the WSGI and ASGI deployments.
+
+run_session_benchmark() requests the home page as returning anonymous
+visitors under each SESSION_CONFIGURATIONS entry, to compare the session
+backends and visit counters (see catalog/visits.py).
+
+run_connection_benchmark() compares database connection reuse settings.
+The test client keeps its connection open between requests, so it passes
+requests to the WSGI handler the way a server does instead, which opens
+and closes connections as configured.
+
+run_serialization_benchmark() fetches rows with the API's querysets and
+turns them into response data with its Out schemas, without HTTP, and
+reports rows per second and queries per batch.
+
+run_renderer_benchmark() times encoding lists of BookOut and
+BookInstanceOut records with the stdlib JSON renderer Ninja uses by
+default and with the encoders of catalog/renderers.py.
+"""
+
+import asyncio
+import copy
+import datetime
+import itertools
+import statistics
+import time
+import uuid
+from wsgiref.util import setup_testing_defaults
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections, reset_queries
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .models import Author, Book, BookInstance
+from .percentiles import percentile
+
+# Report fields compared between runs; lower is better for all of them
+# except throughput
+COMPARED_FIELDS = ['p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request', 'throughput_rps']
+
+# Objects sampled for the detail pages
+SAMPLE_SIZE = 50
+
+# Session backend and visit counter of each configuration run_session_benchmark() compares
+SESSION_CONFIGURATIONS = {
+    'db': ('django.contrib.sessions.backends.db', 'session'),
+    'db+coalesced': ('django.contrib.sessions.backends.db', 'cache'),
+    'cached_db': ('django.contrib.sessions.backends.cached_db', 'session'),
+    'cached_db+coalesced': ('django.contrib.sessions.backends.cached_db', 'cache'),
+    'cache': ('django.contrib.sessions.backends.cache', 'session'),
+    'signed_cookies': ('django.contrib.sessions.backends.signed_cookies', 'session'),
+}
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Default database settings of each configuration run_connection_benchmark() compares
+CONNECTION_CONFIGURATIONS = {
+    'per-request': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+    # PostgreSQL with psycopg 3 and psycopg_pool only
+    'pool': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {'pool': True}},
+}
+
+
+def sample_ids(queryset, size=SAMPLE_SIZE):
+    """Primary keys spread evenly over queryset."""
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    step = max(1, len(ids) // size)
+    return ids[::step][:size]
+
+
+def benchmark_users():
+    """Return (librarian, borrower): a staff user allowed to see every loan and the busiest borrower."""
+    User = get_user_model()
+    librarian, created = User.objects.get_or_create(username='benchmark-librarian', defaults={'is_staff': True})
+    if created:
+        librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+    borrower_id = (
+        BookInstance.objects.filter(status='o', borrower__isnull=False)
+        .values('borrower').annotate(loans=Count('pk'))
+        .order_by('-loans').values_list('borrower', flat=True).first()
+    )
+    borrower = User.objects.get(pk=borrower_id) if borrower_id else librarian
+    return librarian, borrower
+
+
+def default_targets():
+    """The catalog views and the Ninja read endpoints, with the user each is requested as."""
+    librarian, borrower = benchmark_users()
+    book_ids = sample_ids(Book.objects.all())
+    author_ids = sample_ids(Author.objects.filter(book__isnull=False).distinct())
+    copy_ids = sample_ids(BookInstance.objects.all())
+    words = list(Book.objects.filter(pk__in=book_ids).values_list('title', flat=True))
+    targets = [
+        ('index', [reverse('index')], None),
+        ('book-list', [reverse('books')], None),
+        ('book-detail', [reverse('book-detail', args=[pk]) for pk in book_ids], None),
+        ('author-list', [reverse('authors')], None),
+        ('author-detail', [reverse('author-detail', args=[pk]) for pk in author_ids], None),
+        ('my-borrowed', [reverse('my-borrowed')], borrower),
+        ('all-borrowed', [reverse('all-borrowed')], librarian),
+        ('api-authors', ['/api/authors?limit=100'], None),
+        ('api-books', ['/api/books?limit=100'], None),
+        ('api-book', [f'/api/book/{pk}' for pk in book_ids], None),
+        ('api-book-instance', [f'/api/book_instance/{pk}' for pk in copy_ids], None),
+        ('api-book-instances', ['/api/book_instances?status=o&limit=100'], None),
+        ('api-search', [f'/api/search?q={title.split()[0]}' for title in words], None),
+    ]
+    # Detail targets have nothing to request on an empty catalog
+    return [target for target in targets if target[1]]
+
+
+def count_writes(queries):
+    return sum(1 for query in queries if query['sql'].lstrip().upper().startswith(WRITE_STATEMENTS))
+
+
+def run_target(urls, user, iterations, warmup):
+    """Request urls in turn iterations times and return the measurements."""
+    # Failing requests are counted as errors rather than aborting the run
+    client = Client(raise_request_exception=False)
+    if user is not None:
+        client.force_login(user)
+    urls = itertools.cycle(urls)
+    for _ in range(warmup):
+        client.get(next(urls))
+
+    latencies = []
+    queries = []
+    writes = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            request_start = time.perf_counter()
+            response = client.get(next(urls))
+            latencies.append(time.perf_counter() - request_start)
+        queries.append(len(captured))
+        writes.append(count_writes(captured.captured_queries))
+        if response.status_code != 200:
+            errors += 1
+        if hasattr(response, 'streaming_content'):
+            b''.join(response.streaming_content)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': iterations,
+        'errors': errors,
+        **latency_summary(latencies),
+        'queries_per_request': round(statistics.mean(queries), 2),
+        'max_queries': max(queries),
+        'writes_per_request': round(statistics.mean(writes), 2),
+        'throughput_rps': round(iterations / elapsed, 1),
+    }
+
+
+def latency_summary(latencies):
+    """Percentiles and mean of latencies (in seconds), in milliseconds."""
+    return {
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+    }
+
+
+def run_benchmark(targets=None, iterations=200, warmup=10, log=None):
+    """Benchmark targets (default_targets() by default) and return the report."""
+    log = log or (lambda message: None)
+    if targets is None:
+        targets = default_targets()
+    cache.clear()
+    results = {}
+    for name, urls, user in targets:
+        log(name)
+        results[name] = run_target(urls, user, iterations, warmup)
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'iterations': iterations,
+        'dataset': {
+            'authors': Author.objects.count(),
+            'books': Book.objects.count(),
+            'book_instances': BookInstance.objects.count(),
+        },
+        'results': results,
+    }
+
+
+def run_session_benchmark(configurations=None, iterations=500, visits=20, log=None):
+    """Request the home page under each session configuration and return the report.
+
+    A new anonymous visitor (test client) starts every visits requests, so
+    both new sessions and the visits of returning visitors are measured.
+    """
+    log = log or (lambda message: None)
+    results = {}
+    for name in configurations or SESSION_CONFIGURATIONS:
+        engine, counter = SESSION_CONFIGURATIONS[name]
+        log(name)
+        with override_settings(SESSION_ENGINE=engine, CATALOG_VISIT_COUNTER=counter):
+            cache.clear()
+            client = None
+            latencies = []
+            writes = []
+            start = time.perf_counter()
+            for i in range(iterations):
+                if i % visits == 0:
+                    client = Client()
+                with CaptureQueriesContext(connection) as captured:
+                    request_start = time.perf_counter()
+                    client.get(reverse('index'))
+                    latencies.append(time.perf_counter() - request_start)
+                writes.append(count_writes(captured.captured_queries))
+            elapsed = time.perf_counter() - start
+        results[name] = {
+            'session_engine': engine,
+            'visit_counter': counter,
+            'requests': iterations,
+            **latency_summary(latencies),
+            'writes_per_request': round(statistics.mean(writes), 2),
+            'throughput_rps': round(iterations / elapsed, 1),
+        }
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'visits_per_visitor': visits,
+        'results': results,
+    }
+
+
+def wsgi_get(handler, path):
+    """GET path through a WSGI handler and return the status code, closing the response as servers do."""
+    path, _, query = path.partition('?')
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query}
+    setup_testing_defaults(environ)
+    statuses = []
+    response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(response)
+    finally:
+        # Sends request_finished, which closes the connections due to be closed
+        response.close()
+    return int(statuses[0].split()[0])
+
+
+def connect_time(alias, connects):
+    """Median seconds to open a new connection to alias and run a first query."""
+    timings = []
+    for _ in range(connects):
+        conn = connections.create_connection(alias)
+        start = time.perf_counter()
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        timings.append(time.perf_counter() - start)
+        conn.close()
+    return statistics.median(timings)
+
+
+def run_connection_benchmark(urls, configurations=None, iterations=500, connects=50, log=None):
+    """Request urls with each connection configuration of the default database and return the report."""
+    log = log or (lambda message: None)
+    db = connections['default']
+    original = copy.deepcopy(db.settings_dict)
+    connect_s = connect_time('default', connects)
+    handler = WSGIHandler()
+    opened = 0
+
+    def count_connection(sender, connection, **kwargs):
+        nonlocal opened
+        if connection.alias == 'default':
+            opened += 1
+
+    results = {}
+    connection_created.connect(count_connection)
+    try:
+        for name in configurations or CONNECTION_CONFIGURATIONS:
+            log(name)
+            db.close()
+            config = copy.deepcopy(CONNECTION_CONFIGURATIONS[name])
+            db.settings_dict.update(config, OPTIONS={**original['OPTIONS'], **config.get('OPTIONS', {})})
+            urls_cycle = itertools.cycle(urls)
+            latencies = []
+            errors = 0
+            opened = 0
+            start = time.perf_counter()
+            try:
+                for _ in range(iterations):
+                    request_start = time.perf_counter()
+                    if wsgi_get(handler, next(urls_cycle)) != 200:
+                        errors += 1
+                    latencies.append(time.perf_counter() - request_start)
+                elapsed = time.perf_counter() - start
+            finally:
+                db.close()
+                if 'pool' in db.settings_dict['OPTIONS']:
+                    db.close_pool()
+                db.settings_dict.clear()
+                db.settings_dict.update(copy.deepcopy(original))
+            results[name] = {
+                'requests': iterations,
+                'errors': errors,
+                **latency_summary(latencies),
+                'connections_per_request': round(opened / iterations, 3),
+                'connect_ms_per_request': round(opened / iterations * connect_s * 1000, 3),
+                'throughput_rps': round(iterations / elapsed, 1),
+            }
+    finally:
+        connection_created.disconnect(count_connection)
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'connect_ms': round(connect_s * 1000, 3),
+        'results': results,
+    }
+
+
+def serialization_targets():
+    """(Out schema, queryset factory) pairs: the API's own querysets, and books without their related rows."""
+    from local_library.api import BookInstanceOut, BookOut, book_queryset
+    return {
+        'book': (BookOut, book_queryset),
+        'book-unbatched': (BookOut, Book.objects.all),
+        'book-instance': (BookInstanceOut, BookInstance.objects.all),
+    }
+
+
+def run_serialization_benchmark(rows=1000, iterations=5, targets=None, log=None):
+    """Fetch and serialize batches of up to rows rows of each target and return the report.
+
+    Queries that the schemas trigger while serializing (related rows that
+    were not loaded with the batch) count towards the serialization time.
+    """
+    log = log or (lambda message: None)
+    all_targets = serialization_targets()
+    results = {}
+    for name in targets or all_targets:
+        schema, queryset = all_targets[name]
+        log(name)
+        fetch_s = serialize_s = 0
+        count = 0
+        for _ in range(iterations):
+            # The query log is capped, and the unbatched target would overflow it
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                objects = list(queryset().order_by('pk')[:rows])
+                fetched = time.perf_counter()
+                data = [schema.from_orm(obj).model_dump() for obj in objects]
+                fetch_s += fetched - start
+                serialize_s += time.perf_counter() - fetched
+            count += len(data)
+        results[name] = {
+            'rows': count // iterations,
+            'queries': len(captured),
+            'fetch_rows_per_s': round(count / fetch_s, 1) if count else None,
+            'serialize_rows_per_s': round(count / serialize_s, 1) if count else None,
+            'rows_per_s': round(count / (fetch_s + serialize_s), 1) if count else None,
+        }
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'iterations': iterations,
+        'results': results,
+    }
+
+
+def renderer_payloads(records):
+    """records BookOut and BookInstanceOut records, as the API's renderer receives them."""
+    from local_library.api import BookInstanceOut
+    # BookOut resolves author and genre from a Book, so its records are built as dicts
+    books = [
+        {
+            'id': i, 'title': f'Book {i}', 'author': f'Last {i}, First {i}', 'summary': 'Summary ' * 20,
+            'isbn': f'{i:013d}', 'genre': ['Fantasy', 'Science Fiction'], 'copies_total': 3,
+            'copies_available': 1, 'copies_on_loan': 2, 'copies_reserved': 0, 'copies_maintenance': 0,
+        }
+        for i in range(records)
+    ]
+    due_back = datetime.date.today()
+    copies = [
+        BookInstanceOut(
+            id=uuid.uuid4(), book_id=i, imprint='Imprint', due_back=due_back, borrower_id=i, status='o',
+            is_overdue=False,
+        ).model_dump()
+        for i in range(records)
+    ]
+    return {'books': books, 'book-instances': copies}
+
+
+def renderer_encoders():
+    """The available encoders by name: the stdlib (Ninja's default), orjson and msgpack if installed."""
+    from ninja.renderers import JSONRenderer
+    from . import renderers
+
+    stdlib = JSONRenderer()
+    encoders = {'stdlib-json': lambda data: stdlib.render(None, data, response_status=200)}
+    if renderers.orjson is not None:
+        encoders['orjson'] = renderers.dumps_json
+    if renderers.msgpack is not None:
+        encoders['msgpack'] = renderers.dumps_msgpack
+    return encoders
+
+
+def run_renderer_benchmark(records=10000, iterations=10, log=None):
+    """Encode records BookOut and BookInstanceOut records with each encoder and return the report."""
+    log = log or (lambda message: None)
+    payloads = renderer_payloads(records)
+    results = {}
+    for name, encode in renderer_encoders().items():
+        log(name)
+        results[name] = {}
+        for payload_name, payload in payloads.items():
+            timings = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                content = encode(payload)
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            results[name][payload_name] = {
+                'best_ms': round(best * 1000, 3),
+                'median_ms': round(statistics.median(timings) * 1000, 3),
+                'records_per_s': round(records / best, 1),
+                'bytes': len(content),
+            }
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'records': records,
+        'iterations': iterations,
+        'results': results,
+    }
+
+
+def compare_reports(before, after):
+    """Yield (target, field, before, after, change in percent) for the targets both reports share."""
+    for name, result in after['results'].items():
+        previous = before['results'].get(name)
+        if previous is None:
+            continue
+        for field in COMPARED_FIELDS:
+            old, new = previous.get(field), result.get(field)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else None
+            yield name, field, old, new, change
+
+
+async def fetch(host, port, path, timeout):
+    """GET path on a new connection and return the response status."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n'.encode())
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def run_load(host, port, urls, concurrency, duration, timeout):
+    """Keep concurrency clients requesting urls in turn until duration seconds have passed."""
+    urls = itertools.cycle(urls)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            request_start = time.perf_counter()
+            try:
+                status = await fetch(host, port, next(urls), timeout)
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                status = None
+            latencies.append(time.perf_counter() - request_start)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def load_test(host, port, urls, concurrency=100, duration=10, timeout=30):
+    """Load a running server with concurrency requests in flight and return the measurements.
+
+    The clients share one event loop in this process, so at very high
+    throughput the client itself can become the bottleneck.
+    """
+    latencies, errors, elapsed = asyncio.run(run_load(host, port, urls, concurrency, duration, timeout))
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        **latency_summary(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+    }
@@ -0,0 +1,219 @@
+"""Conditional GET (ETag / Last-Modified) for catalog pages and API reads.
+
+Validators are computed without rendering anything:
+
+* books, authors and their lists use their page cache version (see
+  catalog/pagecache.py) as the ETag, and the newest updated_at of the
+  rows they show as Last-Modified; that time is looked up once per
+  version (on the primary database) and cached, so repeat requests make
+  no queries;
+* single rows (genres, languages, copies) use their own updated_at;
+* other lists use their row count and newest updated_at in one
+  aggregate query, which the updated_at indexes keep cheap.
+
+HTML pages differ between users (sidebar, permissions), so their ETags
+include the user's id and the response varies on Cookie. A 304 is only
+returned for GET and HEAD; a failed If-Match gives a 412.
+
+The a-prefixed functions are the same for the async views and endpoints.
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+
+from .models import Author, Book, BookInstance, Genre
+from .pagecache import acache_version, cache_version, page_cache_timeout
+from .replicas import primary_reads
+
+
+def newest(queryset):
+    """Subquery for the newest updated_at in queryset."""
+    return Subquery(queryset.order_by('-updated_at').values('updated_at')[:1])
+
+
+def book_last_modified(pk):
+    """Newest change to a book, its author, genres or copies (a one-value queryset)."""
+    return Book.objects.filter(pk=pk).values_list(
+        Greatest(
+            'updated_at',
+            Coalesce('author__updated_at', 'updated_at'),
+            Coalesce(newest(Genre.objects.filter(book=OuterRef('pk'))), 'updated_at'),
+            Coalesce(newest(BookInstance.objects.filter(book=OuterRef('pk'))), 'updated_at'),
+        ),
+        flat=True,
+    )
+
+
+def author_last_modified(pk):
+    """Newest change to an author or their books, whose copy counts the page shows (a one-value queryset)."""
+    return Author.objects.filter(pk=pk).values_list(
+        Greatest('updated_at', Coalesce(newest(Book.objects.filter(author=OuterRef('pk'))), 'updated_at')),
+        flat=True,
+    )
+
+
+LAST_MODIFIED = {
+    'book': book_last_modified,
+    'author': author_last_modified,
+}
+
+
+def versioned_validators(kind, pk, get_last_modified):
+    """(ETag, Last-Modified) from the kind pk cache version; get_last_modified() runs once per version."""
+    version = cache_version(kind, pk)
+    key = last_modified_key(kind, pk, version)
+    last_modified = cache.get(key)
+    if last_modified is None:
+        with primary_reads():
+            last_modified = get_last_modified()
+        cache.set(key, last_modified, page_cache_timeout())
+    return f'{kind}-{pk}-{version}', last_modified
+
+
+async def aversioned_validators(kind, pk, get_last_modified):
+    """Async version of versioned_validators(); get_last_modified() returns an awaitable."""
+    version = await acache_version(kind, pk)
+    key = last_modified_key(kind, pk, version)
+    last_modified = await cache.aget(key)
+    if last_modified is None:
+        with primary_reads():
+            last_modified = await get_last_modified()
+        await cache.aset(key, last_modified, page_cache_timeout())
+    return f'{kind}-{pk}-{version}', last_modified
+
+
+def last_modified_key(kind, pk, version):
+    return f'catalog:last-modified:{kind}:{pk}:{version}'
+
+
+def detail_validators(kind, pk):
+    """(ETag, Last-Modified) of a book or author, or (None, None) if it does not exist."""
+    etag, last_modified = versioned_validators(kind, pk, lambda: LAST_MODIFIED[kind](pk).first())
+    return (etag, last_modified) if last_modified else (None, None)
+
+
+async def adetail_validators(kind, pk):
+    etag, last_modified = await aversioned_validators(kind, pk, lambda: LAST_MODIFIED[kind](pk).afirst())
+    return (etag, last_modified) if last_modified else (None, None)
+
+
+def list_validators(kind, queryset, *related):
+    """(ETag, Last-Modified) of the book or author list showing queryset (and the related rows)."""
+    return versioned_validators(kind, 'list', lambda: newest_of(queryset, *related))
+
+
+async def alist_validators(kind, queryset, *related):
+    return await aversioned_validators(kind, 'list', lambda: anewest_of(queryset, *related))
+
+
+def row_validators(model, pk, *extra):
+    """(ETag, Last-Modified) of one row; extra values (e.g. today's date) are part of the ETag."""
+    last_modified = model.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    return row_etag(model, pk, last_modified, extra), last_modified
+
+
+async def arow_validators(model, pk, *extra):
+    last_modified = await model.objects.filter(pk=pk).values_list('updated_at', flat=True).afirst()
+    return row_etag(model, pk, last_modified, extra), last_modified
+
+
+def row_etag(model, pk, last_modified, extra):
+    if last_modified is None:
+        return None
+    return digest(model._meta.model_name, pk, last_modified.isoformat(), *extra)
+
+
+def table_validators(queryset, *extra):
+    """(ETag, Last-Modified) of any list, from its row count and newest updated_at in one query.
+
+    As for row_validators(), extra values are part of the ETag.
+    """
+    values = queryset.order_by().aggregate(count=Count('pk'), newest=Max('updated_at'))
+    return digest(queryset.model._meta.model_name, values['count'], values['newest'], *extra), values['newest']
+
+
+async def atable_validators(queryset, *extra):
+    values = await queryset.order_by().aaggregate(count=Count('pk'), newest=Max('updated_at'))
+    return digest(queryset.model._meta.model_name, values['count'], values['newest'], *extra), values['newest']
+
+
+def newest_of(queryset, *related):
+    """The newest updated_at of the rows of queryset and of their related rows, in one query."""
+    return max(filter(None, queryset.order_by().aggregate(**newest_aggregates(related)).values()), default=None)
+
+
+async def anewest_of(queryset, *related):
+    times = await queryset.order_by().aaggregate(**newest_aggregates(related))
+    return max(filter(None, times.values()), default=None)
+
+
+def newest_aggregates(related):
+    fields = ['updated_at'] + [f'{name}__updated_at' for name in related]
+    return {field: Max(field) for field in fields}
+
+
+def digest(*parts):
+    return hashlib.md5('|'.join(map(str, parts)).encode(), usedforsecurity=False).hexdigest()
+
+
+def for_user(request, etag):
+    """Qualify an HTML page's ETag with the requesting user."""
+    user = request.user
+    return etag and f'{etag}-u{user.pk if user.is_authenticated else 0}'
+
+
+def conditional_response(request, etag, last_modified):
+    """Return a 304 (or 412) response when the client's copy is current, else None."""
+    return get_conditional_response(
+        request,
+        etag=quote_etag(etag) if etag else None,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+def set_validators(response, etag, last_modified):
+    if etag:
+        response.headers.setdefault('ETag', quote_etag(etag))
+    if last_modified:
+        response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+    return response
+
+
+class ConditionalGetMixin:
+    """View mixin answering conditional GETs from get_validators() before the page is built."""
+
+    def get_validators(self):
+        """Return (ETag, Last-Modified) for this request; either may be None."""
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        etag = for_user(request, etag)
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code == 200:
+                set_validators(response, etag, last_modified)
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+
+async def aconditional_get(request, validators, view):
+    """Async version of ConditionalGetMixin.get(): await view() only when the client's copy is stale.
+
+    request.user must already be loaded (see catalog/async_views.py).
+    """
+    etag, last_modified = validators
+    etag = for_user(request, etag)
+    response = conditional_response(request, etag, last_modified)
+    if response is None:
+        response = await view()
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+    patch_vary_headers(response, ['Cookie'])
+    return response
@@ -1,6 +1,7 @@
-from django.contrib.auth.models import AnonymousUser
-
 def can_mark_returned(request):
-    if isinstance(request.user, AnonymousUser):
-        return {'can_mark_returned': False}
-    return {'can_mark_returned': request.user.has_perm('catalog.can_mark_returned')}
\ No newline at end of file
+    """Whether the user may mark books returned, checked only if a template reads it.
+
+    Templates call the callables in their context, so pages that never use
+    can_mark_returned skip the permission check (and loading the user).
+    """
+    return {'can_mark_returned': lambda: request.user.has_perm('catalog.can_mark_returned')}
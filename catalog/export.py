@@ -0,0 +1,132 @@
+"""Streaming export of the catalog as NDJSON or CSV.
+
+Rows are read with QuerySet.iterator(chunk_size=...), which uses a
+server-side cursor on PostgreSQL, and are encoded and (optionally) gzipped
+as they go, so memory use does not depend on the size of the catalog. The
+same generators back the export_catalog management command and the
+/api/export/{kind} endpoint.
+"""
+
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Author, Book, BookInstance
+
+# Rows fetched from the database per round trip
+EXPORT_CHUNK_SIZE = 2000
+
+# Encoded output is handed on in pieces of about this many bytes
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def book_rows(chunk_size=EXPORT_CHUNK_SIZE):
+    """Books with their author's name and genre names."""
+    books = (
+        Book.objects.select_related('author')
+        .prefetch_related('genre')
+        .order_by('pk')
+        .iterator(chunk_size=chunk_size)
+    )
+    for book in books:
+        yield {
+            'id': book.pk,
+            'title': book.title,
+            'author_id': book.author_id,
+            'author': str(book.author) if book.author else None,
+            'summary': book.summary,
+            'isbn': book.isbn,
+            'genres': [genre.name for genre in book.genre.all()],
+        }
+
+
+def author_rows(chunk_size=EXPORT_CHUNK_SIZE):
+    return (
+        Author.objects.order_by('pk')
+        .values('id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def book_instance_rows(chunk_size=EXPORT_CHUNK_SIZE):
+    return (
+        BookInstance.objects.order_by('pk')
+        .values('id', 'book_id', 'imprint', 'due_back', 'status', 'borrower_id')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+# Exportable kinds: (row generator, CSV columns)
+EXPORTS = {
+    'books': (book_rows, ['id', 'title', 'author_id', 'author', 'summary', 'isbn', 'genres']),
+    'authors': (author_rows, ['id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death']),
+    'book_instances': (book_instance_rows, ['id', 'book_id', 'imprint', 'due_back', 'status', 'borrower_id']),
+}
+
+
+class Echo:
+    """File-like object whose write() returns the value, for use with csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(rows, columns):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def csv_lines(rows, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(
+            '; '.join(value) if isinstance(value, list) else value
+            for value in (row[column] for column in columns)
+        )
+
+
+def buffered(lines, size=EXPORT_BUFFER_SIZE):
+    """Join encoded lines into byte chunks of roughly size bytes."""
+    buffer = []
+    length = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks):
+    """Compress a stream of byte chunks into a gzip stream on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(kind, fmt='ndjson', compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Return an iterator of bytes holding the whole export of kind in format fmt."""
+    rows, columns = EXPORTS[kind]
+    encode = csv_lines if fmt == 'csv' else ndjson_lines
+    chunks = buffered(encode(rows(chunk_size), columns))
+    return gzipped(chunks) if compress else chunks
+
+
+def export_filename(kind, fmt, compress=False):
+    return f'{kind}.{fmt}' + ('.gz' if compress else '')
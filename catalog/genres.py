@@ -0,0 +1,72 @@
+"""Genre assignment for many books at once.
+
+Book.genre.set() compares, inserts and deletes the genre links of one
+book and sends m2m_changed, whose receivers reindex the book, bump its
+page cache version and move its updated_at forward: several statements
+per book. The functions here change the links of any number of books
+with one SELECT of their current links, bulk INSERTs of the missing ones
+and batched DELETEs of the extra ones, then refresh updated_at, the
+search index and the page cache versions of the books that changed for
+all of them together.
+"""
+
+from django.db import transaction
+from django.db.models.functions import Now
+
+from .models import Book
+from .pagecache import invalidate
+from .search import index_books
+
+Through = Book.genre.through
+
+# Rows per INSERT/DELETE statement, small enough for SQLite's variable limit
+BATCH_SIZE = 500
+
+
+def sync_genre_links(links, target, refresh=True, batch_size=BATCH_SIZE):
+    """Make links (a queryset of Book.genre.through rows) equal to the target (book_id, genre_id) pairs.
+
+    Returns (links added, links removed). With refresh=False the caller
+    updates updated_at, the search index and the page cache of the books.
+    """
+    target = set(target)
+    with transaction.atomic():
+        existing = {
+            (book_id, genre_id): pk for pk, book_id, genre_id in links.values_list('pk', 'book_id', 'genre_id')
+        }
+        added = [pair for pair in target if pair not in existing]
+        removed = [pair for pair in existing if pair not in target]
+
+        Through.objects.bulk_create(
+            [Through(book_id=book_id, genre_id=genre_id) for book_id, genre_id in added],
+            batch_size=batch_size, ignore_conflicts=True,
+        )
+        removed_ids = [existing[pair] for pair in removed]
+        for start in range(0, len(removed_ids), batch_size):
+            Through.objects.filter(pk__in=removed_ids[start:start + batch_size]).delete()
+
+        changed = {book_id for book_id, genre_id in added + removed}
+        if refresh and changed:
+            Book.objects.filter(pk__in=changed).update(updated_at=Now())
+            index_books(changed)
+            invalidate('book', changed)
+    return len(added), len(removed)
+
+
+def assign_genres(book_ids, add=(), remove=(), refresh=True):
+    """Add the add genres to and remove the remove genres from every book; return (added, removed)."""
+    add, remove = set(add), set(remove)
+    if add & remove:
+        raise ValueError(f'Genre {min(add & remove)} cannot be both added and removed')
+    book_ids = set(book_ids)
+    links = Through.objects.filter(book_id__in=book_ids, genre_id__in=add | remove)
+    return sync_genre_links(links, [(book_id, genre_id) for book_id in book_ids for genre_id in add], refresh)
+
+
+def set_genres(genres_by_book, refresh=True):
+    """Replace the genres of each book id with the genre ids mapped to it; return (added, removed)."""
+    links = Through.objects.filter(book_id__in=set(genres_by_book))
+    return sync_genre_links(
+        links, [(book_id, genre_id) for book_id, genre_ids in genres_by_book.items() for genre_id in genre_ids],
+        refresh,
+    )
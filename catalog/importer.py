@@ -0,0 +1,434 @@
+"""Bulk import of catalog records from MARC 21, CSV or NDJSON files.
+
+Records are parsed and validated as a stream, optionally by a pool of worker
+processes, and written in batches by the parent process. For every batch the
+importer:
+
+* drops records whose ISBN is already in the catalog (one IN query) or
+  repeated earlier in the file,
+* resolves authors and genres through in-memory name -> id maps that are
+  loaded once and extended with bulk_create for names not seen before,
+* inserts the books, their Book.genre.through rows and their copies with
+  bulk_create, all inside one transaction.
+
+After each committed batch the number of records consumed can be written
+to a checkpoint file, so an interrupted import resumes where it stopped.
+"""
+
+import collections
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import django
+from django.db import transaction
+from ninja import Field, Schema
+from pydantic import ValidationError
+
+from .models import COPY_COUNT_FIELDS, Author, Book, BookInstance, Genre
+from .pagecache import invalidate
+from .search import index_books
+from .stats import invalidate_dashboard_stats
+
+# Records written per transaction
+IMPORT_BATCH_SIZE = 1000
+
+# Raw records handed to a worker process at a time
+IMPORT_CHUNK_SIZE = 500
+
+IMPORT_FORMATS = ('marc', 'csv', 'json')
+
+FORMAT_EXTENSIONS = {
+    '.mrc': 'marc',
+    '.marc': 'marc',
+    '.csv': 'csv',
+    '.json': 'json',
+    '.jsonl': 'json',
+    '.ndjson': 'json',
+}
+
+
+class ImportRecordError(ValueError):
+    """Raised for a record that cannot be imported."""
+    pass
+
+
+def guess_format(path):
+    """Return the import format implied by the file extension (ignoring .gz)."""
+    root, ext = os.path.splitext(path)
+    if ext == '.gz':
+        root, ext = os.path.splitext(root)
+    return FORMAT_EXTENSIONS.get(ext.lower())
+
+
+def open_source(path, binary=False):
+    """Open path for reading, decompressing .gz files on the fly."""
+    stream = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    return stream if binary else io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+
+# Reading is split in two steps so that the expensive one can run in worker
+# processes: read_units() cheaply cuts the file into one raw unit per record
+# (a MARC record's bytes, an NDJSON line, a CSV row) in the parent process,
+# and parse_unit() turns a unit into a plain dict with the keys title,
+# author, summary, isbn, genres (a list of names) and optionally
+# copies/imprint/status. A record too malformed to even cut out of the file
+# is read as the unit None, which is rejected like any unparsable record.
+
+def split_list(value):
+    """Split a '; ' separated CSV cell (the export format) into names."""
+    if isinstance(value, list):
+        return value
+    return [name.strip() for name in (value or '').split(';') if name.strip()]
+
+
+def csv_units(stream):
+    reader = csv.DictReader(stream)
+    while True:
+        try:
+            yield next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            # The reader carries on with the next row
+            yield None
+
+
+def json_units(stream):
+    """Newline-delimited JSON, one book per line."""
+    return (line for line in stream if line.strip())
+
+
+MARC_RECORD_TERMINATOR = b'\x1d'
+
+
+def marc_units(stream):
+    """Binary MARC 21 (ISO 2709) records, each prefixed with its length."""
+    while True:
+        leader = stream.read(24)
+        if not leader:
+            return
+        if len(leader) < 24:
+            # Truncated last record
+            yield None
+            return
+        if leader[:5].isdigit() and int(leader[:5]) > 24:
+            yield leader + stream.read(int(leader[:5]) - 24)
+        else:
+            # Unknown length: skip to the end of the record
+            while (byte := stream.read(1)) and byte != MARC_RECORD_TERMINATOR:
+                pass
+            yield None
+
+
+MARC_FIELD_TERMINATOR = b'\x1e'
+MARC_SUBFIELD_DELIMITER = b'\x1f'
+
+
+def marc_fields(record):
+    """Return {tag: [{code: value}, ...]} for the data fields of one ISO 2709 record."""
+    base = int(record[12:17])
+    directory = record[24:base - 1]
+    encoding = 'utf-8' if record[9:10] == b'a' else 'latin-1'
+    fields = {}
+    for i in range(0, len(directory), 12):
+        tag = directory[i:i + 3].decode()
+        length = int(directory[i + 3:i + 7])
+        start = base + int(directory[i + 7:i + 12])
+        if tag < '010':
+            continue
+        data = record[start:start + length].rstrip(MARC_FIELD_TERMINATOR)
+        subfields = {}
+        for subfield in data.split(MARC_SUBFIELD_DELIMITER)[1:]:
+            code = subfield[:1].decode()
+            subfields.setdefault(code, subfield[1:].decode(encoding, errors='replace'))
+        fields.setdefault(tag, []).append(subfields)
+    return fields
+
+
+def parse_marc(record):
+    fields = marc_fields(record)
+
+    def first(tag, code='a'):
+        return fields.get(tag, [{}])[0].get(code, '')
+
+    title = ' '.join(filter(None, [first('245'), first('245', 'b')]))
+    return {
+        'title': title.rstrip(' /:;,.'),
+        'author': first('100').rstrip(' ,'),
+        'summary': first('520'),
+        'isbn': first('020').split(' ')[0],
+        'genres': [field['a'].rstrip(' .') for field in fields.get('650', []) if field.get('a')],
+    }
+
+
+def parse_csv(row):
+    return dict(row, genres=split_list(row.get('genres')))
+
+
+# format: (unit reader, unit parser)
+PARSERS = {
+    'marc': (marc_units, parse_marc),
+    'csv': (csv_units, parse_csv),
+    'json': (json_units, json.loads),
+}
+
+
+def read_units(path, fmt):
+    """Yield the raw records of the file at path in the given format."""
+    with open_source(path, binary=(fmt == 'marc')) as stream:
+        yield from PARSERS[fmt][0](stream)
+
+
+def parse_unit(fmt, unit):
+    return PARSERS[fmt][1](unit)
+
+
+def read_records(path, fmt):
+    """Yield the parsed records of the file at path in the given format."""
+    for unit in read_units(path, fmt):
+        yield parse_unit(fmt, unit)
+
+
+class BookRecordIn(Schema):
+    """One import record.
+
+    The BookIn shape from the API, with the author and genres given by name
+    instead of id, plus the BookInstanceIn fields shared by its copies.
+    """
+    title: str = Field(..., min_length=1, max_length=200)
+    author: Optional[str] = None
+    summary: str = Field('', max_length=1000)
+    isbn: str
+    genres: List[str] = []
+    copies: int = Field(0, ge=0)
+    imprint: str = Field('', max_length=200)
+    status: str = 'm'
+
+
+def normalize_isbn(value):
+    return str(value or '').replace('-', '').replace(' ', '').upper()
+
+
+def is_valid_isbn(isbn):
+    """Check the check digit of a normalized ISBN-10 or ISBN-13."""
+    if len(isbn) == 13 and isbn.isdigit():
+        return sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(isbn)) % 10 == 0
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        digits = [10 if digit == 'X' else int(digit) for digit in isbn]
+        return sum((10 - i) * digit for i, digit in enumerate(digits)) % 11 == 0
+    return False
+
+
+def split_author(name):
+    """Split 'Last, First' (or 'First Last') into (last_name, first_name)."""
+    name = (name or '').strip()
+    if not name:
+        return None
+    if ',' in name:
+        last_name, first_name = name.split(',', 1)
+    else:
+        first_name, _, last_name = name.rpartition(' ')
+    return last_name.strip(), first_name.strip()
+
+
+def clean_record(record, default_copies=0):
+    """Return the validated, normalized form of one parsed record, or raise ImportRecordError."""
+    # Empty CSV cells mean "not given"
+    values = {key: value for key, value in record.items() if value not in ('', None)}
+    values.setdefault('copies', default_copies)
+    try:
+        item = BookRecordIn(**values)
+    except ValidationError as e:
+        error = e.errors()[0]
+        raise ImportRecordError(f"{'.'.join(map(str, error['loc']))}: {error['msg']}")
+
+    isbn = normalize_isbn(item.isbn)
+    if not is_valid_isbn(isbn):
+        raise ImportRecordError(f'Invalid ISBN {isbn!r}')
+    if item.status not in dict(BookInstance.LOAN_STATUS):
+        raise ImportRecordError(f'Invalid status {item.status!r}')
+    return {
+        'title': item.title.strip(),
+        'author': split_author(item.author),
+        'summary': item.summary,
+        'isbn': isbn,
+        'genres': [name.strip() for name in item.genres if name.strip()],
+        'copies': item.copies,
+        'imprint': item.imprint,
+        'status': item.status,
+    }
+
+
+def prepare_units(fmt, units, default_copies=0):
+    """Parse and clean a chunk of raw units, returning None for each rejected one.
+
+    This is the CPU-bound part of an import and is what worker processes run.
+    """
+    prepared = []
+    for unit in units:
+        if unit is None:
+            prepared.append(None)
+            continue
+        try:
+            prepared.append(clean_record(parse_unit(fmt, unit), default_copies))
+        except (ValueError, TypeError, AttributeError, KeyError, IndexError):
+            # ImportRecordError, or a unit too malformed to parse at all
+            prepared.append(None)
+    return prepared
+
+
+def prepare_records(path, fmt, default_copies=0, skip=0, workers=1, chunk_size=IMPORT_CHUNK_SIZE):
+    """Yield the cleaned records of a file (None for rejected ones) in file order.
+
+    With workers > 1 the parsing and validation of chunks of chunk_size raw
+    units is spread over a process pool. Results are still yielded in file
+    order, so the database writes (and the ids they assign) do not depend on
+    the number of workers. At most two chunks per worker are in flight.
+    """
+    units = itertools.islice(read_units(path, fmt), skip, None)
+    chunks = iter(lambda: list(itertools.islice(units, chunk_size)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            yield from prepare_units(fmt, chunk, default_copies)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.submit(prepare_units, fmt, chunk, default_copies))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+class CatalogImporter:
+    """Write cleaned records to the database in batches."""
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        # (last_name, first_name) -> Author id and lower-cased name -> Genre id
+        self.author_ids = {
+            (last_name, first_name): pk
+            for pk, last_name, first_name in Author.objects.values_list('pk', 'last_name', 'first_name')
+        }
+        self.genre_ids = {name.lower(): pk for pk, name in Genre.objects.values_list('pk', 'name')}
+        self.seen_isbns = set()
+        self.consumed = 0
+        self.books = 0
+        self.copies = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def resolve_authors(self, records):
+        """Create the authors not yet in the map with one bulk INSERT."""
+        # A dict rather than a set keeps file order, so ids are assigned deterministically
+        missing = dict.fromkeys(record['author'] for record in records
+                                if record['author'] and record['author'] not in self.author_ids)
+        authors = Author.objects.bulk_create(
+            [Author(last_name=last_name, first_name=first_name) for last_name, first_name in missing]
+        )
+        for author in authors:
+            self.author_ids[(author.last_name, author.first_name)] = author.pk
+
+    def resolve_genres(self, records):
+        """Create the genres not yet in the map with one bulk INSERT."""
+        missing = {}
+        for record in records:
+            for name in record['genres']:
+                if name.lower() not in self.genre_ids:
+                    missing.setdefault(name.lower(), name)
+        genres = Genre.objects.bulk_create([Genre(name=name) for name in missing.values()])
+        for genre in genres:
+            self.genre_ids[genre.name.lower()] = genre.pk
+
+    def write_batch(self, records):
+        """Insert one batch of cleaned records in a single transaction."""
+        existing = set(
+            Book.objects.filter(isbn__in=[record['isbn'] for record in records])
+            .values_list('isbn', flat=True)
+        )
+        new_records = []
+        for record in records:
+            if record['isbn'] in existing or record['isbn'] in self.seen_isbns:
+                self.duplicates += 1
+            else:
+                self.seen_isbns.add(record['isbn'])
+                new_records.append(record)
+
+        with transaction.atomic():
+            self.resolve_authors(new_records)
+            self.resolve_genres(new_records)
+            books = Book.objects.bulk_create([
+                Book(
+                    title=record['title'],
+                    author_id=self.author_ids.get(record['author']),
+                    summary=record['summary'],
+                    isbn=record['isbn'],
+                    # All copies of a new book start with the same status
+                    copies_total=record['copies'],
+                    **{COPY_COUNT_FIELDS[record['status']]: record['copies']},
+                )
+                for record in new_records
+            ])
+            Book.genre.through.objects.bulk_create([
+                Book.genre.through(book_id=book.pk, genre_id=genre_id)
+                for book, record in zip(books, new_records)
+                for genre_id in {self.genre_ids[name.lower()] for name in record['genres']}
+            ])
+            copies = BookInstance.objects.bulk_create([
+                BookInstance(book_id=book.pk, imprint=record['imprint'], status=record['status'])
+                for book, record in zip(books, new_records)
+                for _ in range(record['copies'])
+            ])
+            # bulk_create sends no signals, so index the new books and
+            # invalidate the book list, their authors' pages and the home page counts here
+            index_books([book.pk for book in books])
+            invalidate('book', [book.pk for book in books])
+            invalidate('author', [book.author_id for book in books])
+            invalidate_dashboard_stats()
+
+        self.books += len(books)
+        self.copies += len(copies)
+
+    def run(self, records, skip=0, on_batch=None):
+        """Import an iterable of cleaned records (None for rejected ones).
+
+        skip is the number of records of the file that records already
+        leaves out. on_batch(importer) is called after every committed batch;
+        at that point importer.consumed counts every record that is fully
+        handled.
+        """
+        self.consumed = self.skipped = skip
+        self.started = time.monotonic()
+        batch = []
+        position = skip
+        for position, record in enumerate(records, skip + 1):
+            if record is None:
+                self.errors += 1
+            else:
+                batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.flush(batch, position, on_batch)
+                batch = []
+        self.flush(batch, position, on_batch)
+        return self
+
+    def flush(self, batch, consumed, on_batch):
+        if batch:
+            self.write_batch(batch)
+        self.consumed = consumed
+        if on_batch:
+            on_batch(self)
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return (self.consumed - self.skipped) / elapsed if elapsed else 0.0
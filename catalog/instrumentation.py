@@ -0,0 +1,226 @@
+"""Per-request timing and query instrumentation.
+
+RequestInstrumentationMiddleware measures a sample of requests (see
+CATALOG_INSTRUMENTATION_SAMPLE_RATE) and, for each one:
+
+* counts the database queries and their time with a connection
+  execute_wrapper, and flags repeated queries: the same statement with
+  the same parameters (a duplicate) or the same statement run many times
+  with different parameters (an N+1 pattern);
+* times the rendering of TemplateResponses (class-based views);
+* logs one JSON record to the catalog.requests logger (WARNING when
+  repeated queries were found) and, with CATALOG_SERVER_TIMING or DEBUG
+  on, adds a Server-Timing header, which tells any client how long the
+  database took;
+* adds the measurements to per-URL-name totals kept in this process,
+  served to staff by /api/instrumentation.
+
+Unsampled requests pay for a single random() call. The middleware runs
+natively in both sync (WSGI) and async (ASGI) request handling.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .percentiles import percentile
+
+logger = logging.getLogger('catalog.requests')
+
+# Wall times kept per URL name for the percentiles of the stats endpoint
+RECENT_TIMINGS = 500
+
+# Repeated statements listed per request
+MAX_REPEATED = 5
+
+
+class QueryRecorder:
+    """Execute wrapper that counts and times queries and remembers their SQL."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = collections.Counter()
+        self.executions = collections.Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+            self.executions[sql, repr(params)] += 1
+
+    def repeated(self, threshold):
+        """Return (duplicates, n_plus_one): lists of {'sql', 'count'}, most repeated first."""
+        duplicates = [
+            {'sql': sql[:200], 'count': count}
+            for (sql, params), count in self.executions.most_common(MAX_REPEATED) if count > 1
+        ]
+        n_plus_one = [
+            {'sql': sql[:200], 'count': count}
+            for sql, count in self.statements.most_common(MAX_REPEATED) if count >= threshold
+        ]
+        return duplicates, n_plus_one
+
+
+class RequestStats:
+    """Thread-safe per-URL-name totals of the sampled requests."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def reset(self):
+        with self.lock:
+            self.totals = {}
+
+    def add(self, record):
+        with self.lock:
+            totals = self.totals.get(record['view'])
+            if totals is None:
+                totals = self.totals[record['view']] = {
+                    'requests': 0, 'errors': 0, 'wall_ms': 0.0, 'db_ms': 0.0, 'template_ms': 0.0,
+                    'queries': 0, 'max_queries': 0, 'bytes': 0, 'repeated_queries': 0,
+                    'recent_ms': collections.deque(maxlen=RECENT_TIMINGS),
+                }
+            totals['requests'] += 1
+            totals['errors'] += record['status'] >= 500
+            totals['wall_ms'] += record['wall_ms']
+            totals['db_ms'] += record['db_ms']
+            totals['template_ms'] += record['template_ms'] or 0
+            totals['queries'] += record['queries']
+            totals['max_queries'] = max(totals['max_queries'], record['queries'])
+            totals['bytes'] += record['bytes'] or 0
+            totals['repeated_queries'] += bool(record['duplicates'] or record['n_plus_one'])
+            totals['recent_ms'].append(record['wall_ms'])
+
+    def summary(self):
+        """Averages and recent percentiles per URL name, slowest on average first."""
+        with self.lock:
+            totals = {view: dict(values, recent_ms=list(values['recent_ms'])) for view, values in self.totals.items()}
+        summary = []
+        for view, values in totals.items():
+            requests = values['requests']
+            summary.append({
+                'view': view,
+                'requests': requests,
+                'errors': values['errors'],
+                'mean_ms': round(values['wall_ms'] / requests, 3),
+                'p50_ms': round(percentile(values['recent_ms'], 50), 3),
+                'p95_ms': round(percentile(values['recent_ms'], 95), 3),
+                'mean_db_ms': round(values['db_ms'] / requests, 3),
+                'mean_template_ms': round(values['template_ms'] / requests, 3),
+                'mean_queries': round(values['queries'] / requests, 2),
+                'max_queries': values['max_queries'],
+                'mean_bytes': round(values['bytes'] / requests),
+                'requests_with_repeated_queries': values['repeated_queries'],
+            })
+        return sorted(summary, key=lambda row: row['mean_ms'], reverse=True)
+
+
+stats = RequestStats()
+
+
+class RequestInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= settings.CATALOG_INSTRUMENTATION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        request._instrumentation = {'template_ms': None}
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            record_queries(stack, recorder)
+            response = self.get_response(request)
+        return self.finish(request, response, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.CATALOG_INSTRUMENTATION_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        request._instrumentation = {'template_ms': None}
+        start = time.perf_counter()
+        # The async ORM and sync views run their queries in the request's
+        # thread-sensitive worker thread, on that thread's connections
+        stack = contextlib.ExitStack()
+        await sync_to_async(record_queries)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, recorder, time.perf_counter() - start)
+
+    def finish(self, request, response, recorder, wall):
+        duplicates, n_plus_one = recorder.repeated(settings.CATALOG_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD)
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'wall_ms': round(wall * 1000, 3),
+            'db_ms': round(recorder.duration * 1000, 3),
+            'queries': recorder.count,
+            'template_ms': request._instrumentation['template_ms'],
+            'bytes': None if response.streaming else len(response.content),
+            'duplicates': duplicates,
+            'n_plus_one': n_plus_one,
+        }
+        stats.add(record)
+        logger.log(
+            logging.WARNING if duplicates or n_plus_one else logging.INFO,
+            json.dumps(record), extra={'request_stats': record},
+        )
+        if settings.CATALOG_SERVER_TIMING or settings.DEBUG:
+            response['Server-Timing'] = server_timing(record)
+        return response
+
+    def process_template_response(self, request, response):
+        # TemplateResponses are rendered right after the last of these hooks
+        timing = getattr(request, '_instrumentation', None)
+        if timing is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                timing['template_ms'] = round((time.perf_counter() - start) * 1000, 3)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def record_queries(stack, recorder):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(recorder))
+
+
+def server_timing(record):
+    metrics = [
+        f'total;dur={record["wall_ms"]}',
+        f'db;dur={record["db_ms"]};desc="{record["queries"]} queries"',
+    ]
+    if record['template_ms'] is not None:
+        metrics.append(f'tpl;dur={record["template_ms"]}')
+    return ', '.join(metrics)
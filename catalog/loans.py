@@ -0,0 +1,152 @@
+"""Loan desk operations: check out, return, renew and reserve copies.
+
+Each operation changes a copy with one conditional UPDATE that only
+matches while the copy is in a state the operation may start from:
+
+    UPDATE catalog_bookinstance SET status = 'o', borrower_id = 7, due_back = ...
+    WHERE id = ... AND status = 'a'
+
+Concurrent UPDATEs of one row run one after the other: PostgreSQL
+re-checks the WHERE clause against the row the first one committed and
+SQLite lets only one writer in at a time. So when two librarians lend
+the same copy at once exactly one of them succeeds and the other gets a
+LoanError, without SELECT ... FOR UPDATE (which SQLite does not have) or
+a lost update. The book's copy counters, the cached pages and the home
+page counts are updated in the same transaction.
+"""
+
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Now
+
+from .models import BookInstance, move_copy_count
+from .pagecache import invalidate_books
+from .stats import invalidate_dashboard_stats
+
+# Default loan period, and how far ahead a loan may be renewed
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+MAX_RENEWAL = datetime.timedelta(weeks=4)
+
+# Copies of a book tried per query by checkout_book()
+CHECKOUT_CANDIDATES = 20
+
+
+class LoanError(Exception):
+    """The copy's current state does not allow the operation."""
+    pass
+
+
+class CopyNotFound(LoanError):
+    pass
+
+
+def change_copy(copy_id, new_status, allowed, action, **changes):
+    """Move a copy to new_status from the first (status, condition) in allowed that matches it.
+
+    Returns the updated copy; raises LoanError if the copy is in none of
+    the allowed states.
+    """
+    with transaction.atomic():
+        for old_status, condition in allowed:
+            copies = BookInstance.objects.filter(condition, pk=copy_id, status=old_status)
+            if copies.update(status=new_status, updated_at=Now(), **changes):
+                break
+        else:
+            copy = BookInstance.objects.filter(pk=copy_id).first()
+            if copy is None:
+                raise CopyNotFound(f'Copy {copy_id} not found')
+            raise LoanError(f'Copy {copy_id} is {copy.get_status_display().lower()} and cannot be {action}')
+
+        copy = BookInstance.objects.get(pk=copy_id)
+        move_copy_count(copy.book_id, old_status, new_status)
+        invalidate_books([copy.book_id])
+        invalidate_dashboard_stats()
+    return copy
+
+
+def check_borrower(borrower_id):
+    if borrower_id is None:
+        raise LoanError('A borrower is required')
+    if not get_user_model().objects.filter(pk=borrower_id).exists():
+        raise LoanError(f'Borrower {borrower_id} not found')
+
+
+def checkout(copy_id, borrower_id, due_back=None):
+    """Lend an available copy, or one reserved for the borrower, until due_back (default: in LOAN_PERIOD)."""
+    check_borrower(borrower_id)
+    return change_copy(
+        copy_id, 'o', [('a', Q()), ('r', Q(borrower_id=borrower_id))], 'checked out',
+        borrower_id=borrower_id, due_back=due_back or datetime.date.today() + LOAN_PERIOD,
+    )
+
+
+def checkout_book(book_id, borrower_id, due_back=None):
+    """Lend the borrower any copy of a book, preferring one reserved for them."""
+    check_borrower(borrower_id)
+    while True:
+        candidates = list(
+            BookInstance.objects.filter(Q(status='a') | Q(status='r', borrower_id=borrower_id), book_id=book_id)
+            .order_by('-status').values_list('pk', flat=True)[:CHECKOUT_CANDIDATES]
+        )
+        if not candidates:
+            raise LoanError(f'No copy of book {book_id} is available')
+        for copy_id in candidates:
+            try:
+                return checkout(copy_id, borrower_id, due_back)
+            except LoanError:
+                # Lent to someone else in the meantime
+                continue
+
+
+def return_copy(copy_id, borrower_id=None, due_back=None):
+    """Take back a copy on loan and make it available."""
+    return change_copy(copy_id, 'a', [('o', Q())], 'returned', borrower_id=None, due_back=None)
+
+
+def renew(copy_id, borrower_id=None, due_back=None):
+    """Extend a loan until due_back (default: in LOAN_PERIOD), at most MAX_RENEWAL from today."""
+    today = datetime.date.today()
+    due_back = due_back or today + LOAN_PERIOD
+    if not today <= due_back <= today + MAX_RENEWAL:
+        raise LoanError(f'A loan can only be renewed until a date between today and {today + MAX_RENEWAL}')
+    return change_copy(copy_id, 'o', [('o', Q())], 'renewed', due_back=due_back)
+
+
+def reserve(copy_id, borrower_id, due_back=None):
+    """Hold an available copy for a borrower; only they can check it out."""
+    check_borrower(borrower_id)
+    return change_copy(copy_id, 'r', [('a', Q())], 'reserved', borrower_id=borrower_id, due_back=None)
+
+
+LOAN_ACTIONS = {
+    'checkout': checkout,
+    'return': return_copy,
+    'renew': renew,
+    'reserve': reserve,
+}
+
+
+def run_loan_actions(actions):
+    """Apply (action, copy_id, borrower_id, due_back) tuples in one transaction.
+
+    Returns one result per action: the updated copy or the LoanError
+    that refused it. Refused actions do not undo the others.
+
+    The transaction reads before it writes. On SQLite it needs the
+    BEGIN IMMEDIATE of the tuning profile (settings.SQLITE_TUNING): a
+    deferred transaction cannot wait for the write lock once it has
+    read, so it fails with "database is locked" under concurrent loans.
+    """
+    results = []
+    with transaction.atomic():
+        for action, copy_id, borrower_id, due_back in actions:
+            try:
+                if action not in LOAN_ACTIONS:
+                    raise LoanError(f'Unknown action {action!r}')
+                results.append(LOAN_ACTIONS[action](copy_id, borrower_id=borrower_id, due_back=due_back))
+            except LoanError as e:
+                results.append(e)
+    return results
@@ -0,0 +1,56 @@
+import importlib.util
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from catalog.benchmark import CONNECTION_CONFIGURATIONS, default_targets, run_connection_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Compare database connection reuse on the configured database: a new connection per request "
+            "(CONN_MAX_AGE 0), persistent connections with health checks, and a psycopg connection pool "
+            "(PostgreSQL with psycopg[pool] only). Requests the anonymous catalog pages and API reads "
+            "through the WSGI handler and writes the connection setup cost per request, latency "
+            "percentiles and throughput to a JSON report. Seed the database with seed_library first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--configurations', nargs='+', choices=list(CONNECTION_CONFIGURATIONS))
+        parser.add_argument('--iterations', type=int, default=500, help="Timed requests per configuration.")
+        parser.add_argument('--connects', type=int, default=50,
+                            help="New connections timed to measure the connection setup cost.")
+        parser.add_argument('--output', default='connection-benchmark.json', help="Where to write the report.")
+
+    def handle(self, *args, **options):
+        pool_available = connection.vendor == 'postgresql' and importlib.util.find_spec('psycopg_pool') is not None
+        configurations = options['configurations']
+        if configurations is None:
+            configurations = [name for name in CONNECTION_CONFIGURATIONS if name != 'pool' or pool_available]
+        elif 'pool' in configurations and not pool_available:
+            raise CommandError("The pool configuration needs PostgreSQL and psycopg[pool]: pip install 'psycopg[pool]'")
+
+        urls = [url for name, target_urls, user in default_targets() if user is None for url in target_urls]
+        if not urls:
+            raise CommandError("Nothing to request; seed the database with seed_library first.")
+
+        with override_settings(CATALOG_INSTRUMENTATION_SAMPLE_RATE=0):
+            report = run_connection_benchmark(
+                urls, configurations,
+                iterations=options['iterations'],
+                connects=options['connects'],
+                log=lambda name: self.stdout.write(f"Benchmarking {name}..."),
+            )
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(f"New {report['database']} connection: {report['connect_ms']:.3f} ms")
+        self.stdout.write(f"{'configuration':<14} {'conn/req':>9} {'setup ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'req/s':>8}")
+        for name, result in report['results'].items():
+            self.stdout.write(
+                f"{name:<14} {result['connections_per_request']:>9.3f} {result['connect_ms_per_request']:>9.3f} "
+                f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['throughput_rps']:>8.1f}"
+                + (self.style.ERROR(f"  {result['errors']} errors") if result['errors'] else '')
+            )
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}."))
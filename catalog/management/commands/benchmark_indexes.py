@@ -0,0 +1,88 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+from catalog.models import Author, Book, BookInstance
+from catalog.seed import seed_library
+
+
+def hot_queries(borrower_id):
+    """The BookInstance/Book/Author access paths served by the catalog pages."""
+    return {
+        'all-borrowed (status=o by due_back)':
+            BookInstance.objects.filter(status='o').order_by('due_back', 'id')[:10],
+        'my-borrowed (borrower, status=o by due_back)':
+            BookInstance.objects.filter(borrower_id=borrower_id, status='o').order_by('due_back', 'id')[:10],
+        'admin status filter (status=m by due_back)':
+            BookInstance.objects.filter(status='m').order_by('due_back')[:100],
+        'book_instances API page (due_back, id)':
+            BookInstance.objects.order_by('due_back', 'id')[:100],
+        'books by title':
+            Book.objects.order_by('title')[:10],
+        'author list page (last_name, first_name, id)':
+            Author.objects.order_by('last_name', 'first_name', 'id')[:10],
+    }
+
+
+class Command(BaseCommand):
+    help = ("Seed a scratch test database and compare the query plans and timings of the hot "
+            "catalog queries with and without the indexes added in migration 0008.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=20000)
+        parser.add_argument('--copies-per-book', type=float, default=10)
+        parser.add_argument('--borrowers', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs per query.")
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self.stdout.write(f"Seeding {options['books']} books x {options['copies_per_book']:g} copies...")
+            seed_library(
+                authors=options['books'] // 5 + 1,
+                books=options['books'],
+                copies_per_book=options['copies_per_book'],
+                borrowers=options['borrowers'],
+            )
+            borrower_id = BookInstance.objects.filter(status='o').values_list('borrower_id', flat=True).first()
+            after = self.measure(borrower_id, options['repeat'])
+            self.set_indexes(add=False)
+            before = self.measure(borrower_id, options['repeat'])
+            self.set_indexes(add=True)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        for name in after:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, (median, plan) in (('before', before[name]), ('after', after[name])):
+                self.stdout.write(f"  {label}: {median * 1000:.3f} ms")
+                for line in plan.splitlines():
+                    self.stdout.write(f"    {line}")
+
+    def measure(self, borrower_id, repeat):
+        """Return {query name: (median seconds, query plan)}."""
+        results = {}
+        for name, queryset in hot_queries(borrower_id).items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - start)
+            results[name] = (statistics.median(timings), queryset.explain())
+        return results
+
+    def set_indexes(self, add):
+        """Create or drop the hot-path indexes declared in the models' Meta.indexes."""
+        with connection.schema_editor() as schema_editor:
+            for model in (Author, Book, BookInstance):
+                for index in model._meta.indexes:
+                    if add:
+                        schema_editor.add_index(model, index)
+                    else:
+                        schema_editor.remove_index(model, index)
+        with connection.cursor() as cursor:
+            if connection.vendor in ('sqlite', 'postgresql'):
+                cursor.execute('ANALYZE')
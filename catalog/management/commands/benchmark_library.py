@@ -0,0 +1,79 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from catalog.benchmark import compare_reports, run_benchmark
+from catalog.seed import seed_library
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the catalog views and API endpoints with the test client and write p50/p95/p99 "
+            "latency, queries per request and throughput to a JSON report. By default a scratch test "
+            "database is seeded with seed_library; --current-db benchmarks the configured database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help="Timed requests per target.")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests per target.")
+        parser.add_argument('--output', default='benchmark-report.json', help="Where to write the report.")
+        parser.add_argument('--compare', metavar='REPORT', help="An earlier report to compare with.")
+        parser.add_argument('--current-db', action='store_true',
+                            help="Benchmark the configured database as it is instead of a seeded scratch one.")
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--copies-per-book', type=float, default=3)
+        parser.add_argument('--borrowers', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        before = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    before = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        setup_test_environment()
+        old_config = None
+        try:
+            if not options['current_db']:
+                old_config = setup_databases(verbosity=0, interactive=False)
+                self.stdout.write("Seeding a scratch database...")
+                seed_library(
+                    authors=options['authors'],
+                    books=options['books'],
+                    copies_per_book=options['copies_per_book'],
+                    borrowers=options['borrowers'],
+                    seed=options['seed'],
+                )
+            report = run_benchmark(
+                iterations=options['iterations'],
+                warmup=options['warmup'],
+                log=lambda name: self.stdout.write(f"Benchmarking {name}..."),
+            )
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(f"{'target':<20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'req/s':>8}")
+        for name, result in report['results'].items():
+            self.stdout.write(
+                f"{name:<20} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                f"{result['queries_per_request']:>8.1f} {result['throughput_rps']:>8.1f}"
+                + (self.style.ERROR(f"  {result['errors']} errors") if result['errors'] else '')
+            )
+
+        if before is not None:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\nCompared with {options['compare']}:"))
+            for name, field, old, new, change in compare_reports(before, report):
+                change = f"{change:+.1f}%" if change is not None else 'n/a'
+                self.stdout.write(f"{name:<20} {field:<20} {old:>10} -> {new:<10} {change}")
+
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}."))
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from catalog.benchmark import run_renderer_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Compare the API's response encoders: time encoding lists of BookOut and BookInstanceOut "
+            "records with the stdlib JSON renderer Ninja uses by default, orjson and (if installed) "
+            "MessagePack, and write the timings and sizes to a JSON report. Needs no database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=10000, help="Records per encoded list.")
+        parser.add_argument('--iterations', type=int, default=10, help="Timed encodings per encoder and list.")
+        parser.add_argument('--output', default='renderer-benchmark.json', help="Where to write the report.")
+
+    def handle(self, *args, **options):
+        report = run_renderer_benchmark(
+            records=options['records'],
+            iterations=options['iterations'],
+            log=lambda name: self.stdout.write(f"Benchmarking {name}..."),
+        )
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(f"{'encoder':<12} {'records':<15} {'best ms':>9} {'median ms':>10} "
+                          f"{'records/s':>11} {'bytes':>9}")
+        for name, results in report['results'].items():
+            for payload, result in results.items():
+                self.stdout.write(
+                    f"{name:<12} {payload:<15} {result['best_ms']:>9.2f} {result['median_ms']:>10.2f} "
+                    f"{result['records_per_s']:>11.1f} {result['bytes']:>9}"
+                )
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}."))
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.benchmark import run_serialization_benchmark, serialization_targets
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = ("Measure how fast the API turns books and book instances into response data: fetch batches "
+            "with the API's querysets, serialize them with its Out schemas (without HTTP or JSON encoding) "
+            "and write rows per second and queries per batch to a JSON report. book-unbatched serializes "
+            "books without loading their authors and genres up front, for comparison. Seed the database "
+            "with seed_library first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--targets', nargs='+', choices=list(serialization_targets()))
+        parser.add_argument('--rows', type=int, default=1000, help="Rows per batch.")
+        parser.add_argument('--iterations', type=int, default=5, help="Batches per target.")
+        parser.add_argument('--output', default='serialization-benchmark.json', help="Where to write the report.")
+
+    def handle(self, *args, **options):
+        if not Book.objects.exists():
+            raise CommandError("Nothing to serialize; seed the database with seed_library first.")
+        report = run_serialization_benchmark(
+            rows=options['rows'],
+            iterations=options['iterations'],
+            targets=options['targets'],
+            log=lambda name: self.stdout.write(f"Benchmarking {name}..."),
+        )
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(f"{'target':<16} {'rows':>6} {'queries':>8} {'fetch rows/s':>13} "
+                          f"{'serialize rows/s':>17} {'rows/s':>10}")
+        for name, result in report['results'].items():
+            self.stdout.write(
+                f"{name:<16} {result['rows']:>6} {result['queries']:>8} {result['fetch_rows_per_s'] or 0:>13.1f} "
+                f"{result['serialize_rows_per_s'] or 0:>17.1f} {result['rows_per_s'] or 0:>10.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}."))
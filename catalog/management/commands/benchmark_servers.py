@@ -0,0 +1,148 @@
+import contextlib
+import datetime
+import http.client
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.utils import get_random_secret_key
+from django.db import connection
+
+from catalog.benchmark import default_targets, load_test
+
+HOST = '127.0.0.1'
+
+# The deployments compared: the server module each needs and whether the
+# async read views are on
+SERVERS = {
+    'wsgi': ('gunicorn', False),
+    'asgi': ('uvicorn', True),
+}
+
+
+class Command(BaseCommand):
+    help = ("Compare the WSGI deployment (gunicorn, sync views) with the ASGI one (uvicorn, async read "
+            "views) under load: start each server on the configured database, keep CONCURRENCY requests "
+            "to the anonymous catalog pages and API reads in flight, and write latency percentiles and "
+            "throughput to a JSON report. Seed the database with seed_library first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+        parser.add_argument('--concurrency', nargs='+', type=int, default=[50, 200, 500],
+                            help="Requests in flight; each level is measured separately.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds per concurrency level.")
+        parser.add_argument('--warmup', type=float, default=2, help="Untimed seconds before each server's runs.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Processes per server.")
+        parser.add_argument('--threads', type=int, default=1,
+                            help="Threads per gunicorn worker (more than 1 uses the gthread worker).")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', default='server-benchmark.json', help="Where to write the report.")
+
+    def handle(self, *args, **options):
+        for server in options['servers']:
+            module = SERVERS[server][0]
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f"The {server} benchmark needs {module}: pip install {module}")
+
+        targets = [(name, target_urls) for name, target_urls, user in default_targets() if user is None]
+        urls = [url for name, target_urls in targets for url in target_urls]
+        if not urls:
+            raise CommandError("Nothing to request; seed the database with seed_library first.")
+
+        report = {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'duration': options['duration'],
+            'urls': len(urls),
+            'servers': {},
+        }
+        for server in options['servers']:
+            command = self.server_command(server, options)
+            self.stdout.write(f"Starting {' '.join(command[1:])}...")
+            with self.serve(server, command, options['port']):
+                self.check_targets(server, options['port'], targets)
+                load_test(HOST, options['port'], urls, max(options['concurrency']), options['warmup'])
+                results = []
+                for concurrency in options['concurrency']:
+                    self.stdout.write(f"  {concurrency} requests in flight...")
+                    results.append(load_test(HOST, options['port'], urls, concurrency, options['duration']))
+            report['servers'][server] = {'command': command[1:], 'results': results}
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(f"{'server':<8} {'in flight':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+        for server, result in report['servers'].items():
+            for row in result['results']:
+                self.stdout.write(
+                    f"{server:<8} {row['concurrency']:>9} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+                    f"{row['p99_ms']:>9.2f} {row['throughput_rps']:>9.1f}"
+                    + (self.style.ERROR(f"  {row['errors']} errors") if row['errors'] else '')
+                )
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}."))
+
+    def server_command(self, server, options):
+        address = f"{HOST}:{options['port']}"
+        if server == 'wsgi':
+            return [sys.executable, '-m', 'gunicorn', 'local_library.wsgi:application', '--bind', address,
+                    '--workers', str(options['workers']), '--threads', str(options['threads']),
+                    '--backlog', '4096', '--log-level', 'warning']
+        return [sys.executable, '-m', 'uvicorn', 'local_library.asgi:application', '--host', HOST,
+                '--port', str(options['port']), '--workers', str(options['workers']), '--backlog', '4096',
+                '--log-level', 'warning', '--no-access-log']
+
+    def check_targets(self, server, port, targets):
+        """Refuse to benchmark a target that fails, which would time its error responses."""
+        for name, urls in targets:
+            for url in urls:
+                conn = http.client.HTTPConnection(HOST, port, timeout=30)
+                conn.request('GET', url)
+                status = conn.getresponse().status
+                conn.close()
+                if status != 200:
+                    raise CommandError(f"{server}: {name} answered GET {url} with {status}")
+
+    @contextlib.contextmanager
+    def serve(self, server, command, port, timeout=30):
+        """Run a server process until the block ends, once it answers requests."""
+        env = {
+            **os.environ,
+            'CATALOG_ASYNC_VIEWS': str(SERVERS[server][1]),
+            # Every worker must sign sessions with the same key
+            'DJANGO_SECRET_KEY': os.environ.get('DJANGO_SECRET_KEY') or get_random_secret_key(),
+        }
+        env.setdefault('CATALOG_INSTRUMENTATION_SAMPLE_RATE', '0')
+        log = tempfile.TemporaryFile()
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stderr=log)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                if process.poll() is not None:
+                    log.seek(0)
+                    raise CommandError(f"{server} server exited:\n{log.read().decode()}")
+                try:
+                    conn = http.client.HTTPConnection(HOST, port, timeout=5)
+                    conn.request('GET', '/catalog/')
+                    if conn.getresponse().status == 200:
+                        break
+                except OSError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise CommandError(f"{server} server did not start within {timeout}s")
+                time.sleep(0.2)
+            yield process
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from catalog.benchmark import SESSION_CONFIGURATIONS, run_session_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Compare the session backends and home page visit counters (SESSION_ENGINE and "
+            "CATALOG_VISIT_COUNTER): request the home page as anonymous visitors on a scratch test "
+            "database and write latency percentiles, database writes per request and throughput to a "
+            "JSON report.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--configurations', nargs='+', choices=list(SESSION_CONFIGURATIONS),
+                            default=list(SESSION_CONFIGURATIONS))
+        parser.add_argument('--iterations', type=int, default=500, help="Timed requests per configuration.")
+        parser.add_argument('--visits', type=int, default=20, help="Home page visits per visitor.")
+        parser.add_argument('--output', default='session-benchmark.json', help="Where to write the report.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            report = run_session_benchmark(
+                options['configurations'],
+                iterations=options['iterations'],
+                visits=options['visits'],
+                log=lambda name: self.stdout.write(f"Benchmarking {name}..."),
+            )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(f"{'configuration':<22} {'p50 ms':>9} {'p95 ms':>9} {'writes':>7} {'req/s':>8}")
+        for name, result in report['results'].items():
+            self.stdout.write(
+                f"{name:<22} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                f"{result['writes_per_request']:>7.2f} {result['throughput_rps']:>8.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}."))
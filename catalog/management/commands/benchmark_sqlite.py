@@ -0,0 +1,149 @@
+import copy
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+
+from catalog.benchmark import latency_summary
+from catalog.loans import run_loan_actions
+from catalog.models import Book, BookInstance
+
+# SQLite connection OPTIONS compared; journal_mode is stored in the
+# database file, so the default profile sets it back explicitly
+PROFILES = {
+    # SQLite's defaults: rollback journal, fsync on every commit, deferred transactions
+    'default': {'init_command': 'PRAGMA journal_mode=DELETE;PRAGMA synchronous=FULL'},
+    'tuned': settings.SQLITE_TUNED_OPTIONS,
+}
+
+PAGE_SIZE = 10
+
+
+def worker(deadline, write_ratio, copy_ids, borrower_ids, pages, seed, results):
+    """Read catalog pages and run loan transactions until deadline; record into results."""
+    rng = random.Random(seed)
+    try:
+        while time.perf_counter() < deadline:
+            kind = 'write' if rng.random() < write_ratio else 'read'
+            start = time.perf_counter()
+            try:
+                if kind == 'write':
+                    # Reads (the borrower) before writing in one transaction
+                    copy_id = rng.choice(copy_ids)
+                    run_loan_actions([
+                        ('checkout', copy_id, rng.choice(borrower_ids), None),
+                        ('return', copy_id, None, None),
+                    ])
+                else:
+                    offset = rng.randrange(pages) * PAGE_SIZE
+                    list(Book.objects.select_related('author').order_by('title', 'pk')[offset:offset + PAGE_SIZE])
+                    BookInstance.objects.filter(status='o').count()
+            except OperationalError:
+                results[kind]['errors'] += 1
+            else:
+                results[kind]['latencies'].append(time.perf_counter() - start)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = ("Compare the SQLite tuning profile (settings.SQLITE_TUNED_OPTIONS: WAL, synchronous=NORMAL, "
+            "mmap, cache size, busy timeout, BEGIN IMMEDIATE) with SQLite's defaults: THREADS threads read "
+            "catalog pages and run loan transactions on a copy of the configured SQLite database, and the "
+            "reads and writes per second and 'database is locked' errors are written to a JSON report. "
+            "Seed the database with seed_library first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', choices=list(PROFILES), default=list(PROFILES))
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=5, help="Seconds per profile.")
+        parser.add_argument('--write-ratio', type=float, default=0.2, help="Share of operations that write.")
+        parser.add_argument('--output', default='sqlite-benchmark.json', help="Where to write the report.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The configured database is not SQLite.")
+        copy_ids = list(BookInstance.objects.filter(status='a').values_list('pk', flat=True)[:1000])
+        borrower_ids = list(BookInstance.objects.filter(borrower__isnull=False)
+                            .values_list('borrower', flat=True).distinct()[:100])
+        pages = max(1, Book.objects.count() // PAGE_SIZE)
+        if not copy_ids or not borrower_ids:
+            raise CommandError("Nothing to lend; seed the database with seed_library first.")
+
+        directory = tempfile.mkdtemp()
+        source = os.path.join(directory, 'source.sqlite3')
+        target = sqlite3.connect(source)
+        connection.ensure_connection()
+        connection.connection.backup(target)
+        target.close()
+
+        db = connections['default']
+        original = copy.deepcopy(db.settings_dict)
+        report = {
+            'threads': options['threads'],
+            'duration': options['duration'],
+            'write_ratio': options['write_ratio'],
+            'sqlite': sqlite3.sqlite_version,
+            'profiles': {},
+        }
+        try:
+            for name in options['profiles']:
+                self.stdout.write(f"Benchmarking {name}...")
+                path = os.path.join(directory, f'{name}.sqlite3')
+                shutil.copyfile(source, path)
+                db.close()
+                db.settings_dict.update(NAME=path, OPTIONS=copy.deepcopy(PROFILES[name]))
+                report['profiles'][name] = self.run_profile(copy_ids, borrower_ids, pages, options)
+                db.close()
+        finally:
+            db.settings_dict.clear()
+            db.settings_dict.update(original)
+            shutil.rmtree(directory)
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(f"{'profile':<10} {'reads/s':>9} {'writes/s':>9} {'read p95':>9} {'write p95':>10} {'locked':>7}")
+        for name, result in report['profiles'].items():
+            self.stdout.write(
+                f"{name:<10} {result['read']['per_second']:>9.1f} {result['write']['per_second']:>9.1f} "
+                f"{result['read'].get('p95_ms', 0):>9.2f} {result['write'].get('p95_ms', 0):>10.2f} "
+                f"{result['read']['errors'] + result['write']['errors']:>7}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}."))
+
+    def run_profile(self, copy_ids, borrower_ids, pages, options):
+        results = [{kind: {'latencies': [], 'errors': 0} for kind in ('read', 'write')}
+                   for _ in range(options['threads'])]
+        deadline = time.perf_counter() + options['duration']
+        threads = [
+            threading.Thread(target=worker, args=(
+                deadline, options['write_ratio'], copy_ids, borrower_ids, pages, seed, results[seed],
+            ))
+            for seed in range(options['threads'])
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        summary = {}
+        for kind in ('read', 'write'):
+            latencies = [latency for result in results for latency in result[kind]['latencies']]
+            summary[kind] = {
+                'operations': len(latencies),
+                'errors': sum(result[kind]['errors'] for result in results),
+                'per_second': round(len(latencies) / elapsed, 1),
+                **(latency_summary(latencies) if latencies else {}),
+            }
+        return summary
@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from catalog.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORTS, export_stream
+
+
+class Command(BaseCommand):
+    help = "Stream books, authors or book instances as NDJSON or CSV (optionally gzipped)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output on the fly.")
+        parser.add_argument('--output', '-o', help="File to write to (default: standard output).")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+                            help="Rows fetched from the database per round trip.")
+
+    def handle(self, *args, **options):
+        chunks = export_stream(options['kind'], options['format'], options['gzip'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
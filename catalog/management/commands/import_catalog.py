@@ -0,0 +1,62 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.importer import (
+    IMPORT_BATCH_SIZE, IMPORT_FORMATS, CatalogImporter, guess_format, prepare_records,
+)
+
+
+class Command(BaseCommand):
+    help = "Bulk import books (with authors, genres and copies) from a MARC 21, CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import; .gz files are decompressed on the fly.")
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help="Input format (default: guessed from the file extension).")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help="Records written per transaction.")
+        parser.add_argument('--copies', type=int, default=0,
+                            help="Copies to create for records that do not say how many they have.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Processes used to parse and validate records; the database "
+                                 "is still written by this process, in file order.")
+        parser.add_argument('--checkpoint',
+                            help="File recording progress after every batch; an existing "
+                                 "checkpoint makes the import resume where it stopped.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        if fmt is None:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format.")
+
+        checkpoint = options['checkpoint']
+        skip = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                skip = json.load(f)['consumed']
+            self.stdout.write(f"Resuming after record {skip}")
+
+        def on_batch(importer):
+            if checkpoint:
+                with open(checkpoint, 'w') as f:
+                    json.dump({'path': path, 'consumed': importer.consumed}, f)
+            self.stdout.write(
+                f"{importer.consumed} records: {importer.books} books, {importer.copies} copies, "
+                f"{importer.duplicates} duplicates, {importer.errors} errors "
+                f"({importer.rows_per_second:.0f} rows/s)"
+            )
+
+        records = prepare_records(path, fmt, default_copies=options['copies'], skip=skip,
+                                  workers=options['workers'])
+        importer = CatalogImporter(batch_size=options['batch_size'])
+        importer.run(records, skip=skip, on_batch=on_batch)
+
+        if checkpoint:
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {importer.books} books and {importer.copies} copies "
+            f"at {importer.rows_per_second:.0f} rows/s"
+        ))
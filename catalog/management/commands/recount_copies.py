@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Book
+from catalog.pagecache import invalidate_all
+
+
+class Command(BaseCommand):
+    help = "Recompute every book's copy counters (total, available, on loan, reserved, maintenance)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="Books updated per transaction.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        book_ids = Book.objects.order_by('pk').values_list('pk', flat=True)
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(book_ids.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                updated += Book.objects.filter(pk__gte=batch[0], pk__lte=batch[-1]).recount_copies()
+            last_id = batch[-1]
+        # Detail pages show the counters
+        invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f"Recounted the copies of {updated} books."))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.seed import SEED_BATCH_SIZE, seed_library
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with a synthetic, realistically skewed catalog of authors, genres, "
+            "languages, books, copies and borrowers, for load testing.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--copies-per-book', type=float, default=3,
+                            help="Average number of copies of a book.")
+        parser.add_argument('--borrowers', type=int, default=500)
+        parser.add_argument('--genres', type=int, default=40)
+        parser.add_argument('--languages', type=int, default=15)
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Random seed; the same seed generates the same catalog.")
+        parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE,
+                            help="Rows per INSERT.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        created = seed_library(
+            authors=options['authors'],
+            books=options['books'],
+            copies_per_book=options['copies_per_book'],
+            borrowers=options['borrowers'],
+            genres=options['genres'],
+            languages=options['languages'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            log=lambda message: self.stdout.write(f"{message}...") if options['verbosity'] else None,
+        )
+        elapsed = time.perf_counter() - start
+        summary = ', '.join(f"{count} {name}" for name, count in created.items())
+        self.stdout.write(self.style.SUCCESS(f"Created {summary} in {elapsed:.1f}s."))
@@ -0,0 +1,31 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.overdue import SWEEP_BATCH_SIZE, send_overdue_notices, sweep_overdue
+
+
+class Command(BaseCommand):
+    help = ("Record the loans that are overdue in the OverdueLoan report table and email each borrower "
+            "one notice listing their overdue books. Schedule it daily, e.g. from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Sweep as of this day (YYYY-MM-DD) instead of today.")
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE,
+                            help="Loans upserted per statement.")
+        parser.add_argument('--no-notices', action='store_true', help="Only update the report table.")
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Invalid date {options['date']!r}; use YYYY-MM-DD")
+
+        overdue, resolved = sweep_overdue(today, batch_size=options['batch_size'])
+        self.stdout.write(f"{overdue} overdue loans recorded, {resolved} no longer overdue removed.")
+        if not options['no_notices']:
+            emails, loans = send_overdue_notices(batch_size=options['batch_size'])
+            self.stdout.write(f"Sent {emails} notices covering {loans} loans.")
+        self.stdout.write(self.style.SUCCESS("Done."))
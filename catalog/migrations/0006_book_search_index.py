@@ -0,0 +1,71 @@
+# Full-text search index for books (see catalog/search.py)
+
+from django.db import migrations
+
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE catalog_book_fts USING fts5(
+        title, author, genres, summary,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    INSERT INTO catalog_book_fts (rowid, title, author, genres, summary)
+    SELECT b.id, b.title,
+           COALESCE(a.first_name || ' ' || a.last_name, ''),
+           COALESCE((SELECT group_concat(g.name, ' ')
+                     FROM catalog_book_genre bg JOIN catalog_genre g ON g.id = bg.genre_id
+                     WHERE bg.book_id = b.id), ''),
+           b.summary
+    FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id
+    """,
+]
+
+SQLITE_DROP = ["DROP TABLE IF EXISTS catalog_book_fts"]
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE catalog_book_search (
+        book_id bigint PRIMARY KEY REFERENCES catalog_book (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX catalog_book_search_document ON catalog_book_search USING GIN (document)",
+    """
+    INSERT INTO catalog_book_search (book_id, document)
+    SELECT b.id,
+           setweight(to_tsvector('english', b.title), 'A')
+           || setweight(to_tsvector('english', COALESCE(a.first_name || ' ' || a.last_name, '')), 'B')
+           || setweight(to_tsvector('english', COALESCE(
+                (SELECT string_agg(g.name, ' ')
+                 FROM catalog_book_genre bg JOIN catalog_genre g ON g.id = bg.genre_id
+                 WHERE bg.book_id = b.id), '')), 'C')
+           || setweight(to_tsvector('english', b.summary), 'D')
+    FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id
+    """,
+]
+
+POSTGRES_DROP = ["DROP TABLE IF EXISTS catalog_book_search"]
+
+
+def run_for_vendor(sqlite, postgresql):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgresql}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0005_alter_author_options"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_CREATE, POSTGRES_CREATE),
+            run_for_vendor(SQLITE_DROP, POSTGRES_DROP),
+        ),
+    ]
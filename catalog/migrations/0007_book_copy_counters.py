@@ -0,0 +1,65 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:07
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COPY_COUNT_FIELDS = {
+    "a": "copies_available",
+    "o": "copies_on_loan",
+    "r": "copies_reserved",
+    "m": "copies_maintenance",
+}
+
+
+def count_copies(apps, schema_editor):
+    Book = apps.get_model("catalog", "Book")
+    BookInstance = apps.get_model("catalog", "BookInstance")
+
+    def copy_count(status=None):
+        copies = BookInstance.objects.filter(book=OuterRef("pk"))
+        if status is not None:
+            copies = copies.filter(status=status)
+        count = copies.order_by().values("book").annotate(count=Count("pk")).values("count")
+        return Coalesce(Subquery(count), 0)
+
+    Book.objects.update(
+        copies_total=copy_count(),
+        **{field: copy_count(status) for status, field in COPY_COUNT_FIELDS.items()},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0006_book_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="copies_available",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="copies_maintenance",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="copies_on_loan",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="copies_reserved",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="copies_total",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0007_book_copy_counters"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="author",
+            index=models.Index(fields=["last_name", "first_name", "id"], name="author_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["title"], name="book_title_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="bookinstance",
+            index=models.Index(fields=["status", "due_back", "id"], name="bookinst_status_due_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="bookinstance",
+            index=models.Index(
+                fields=["borrower", "status", "due_back", "id"], name="bookinst_borrower_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookinstance",
+            index=models.Index(fields=["due_back", "id"], name="bookinst_due_back_id_idx"),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0009_updated_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OverdueLoan",
+            fields=[
+                (
+                    "book_instance",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="overdue_loan",
+                        serialize=False,
+                        to="catalog.bookinstance",
+                    ),
+                ),
+                ("due_back", models.DateField()),
+                ("detected_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "notified_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="When the borrower was last sent a notice",
+                        null=True,
+                    ),
+                ),
+                (
+                    "borrower",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="overdue_loans",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["due_back"],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0010_overdue_loans"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="book",
+            name="copies_available",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="book",
+            name="copies_maintenance",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="book",
+            name="copies_on_loan",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="book",
+            name="copies_reserved",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="book",
+            name="copies_total",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:07
+
+import catalog.pagination
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0011_copy_counters_signed"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="bookinstance",
+            name="bookinst_status_due_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="bookinstance",
+            name="bookinst_borrower_status_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="bookinstance",
+            name="bookinst_due_back_id_idx",
+        ),
+        migrations.AddIndex(
+            model_name="bookinstance",
+            index=catalog.pagination.KeysetIndex(
+                fields=["status", "due_back", "id"], name="bookinst_status_due_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookinstance",
+            index=catalog.pagination.KeysetIndex(
+                fields=["borrower", "status", "due_back", "id"],
+                name="bookinst_borrower_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookinstance",
+            index=catalog.pagination.KeysetIndex(
+                fields=["due_back", "id"], name="bookinst_due_back_id_idx"
+            ),
+        ),
+    ]
@@ -1,11 +1,11 @@
-from django.db import models
+from django.db import models, transaction
 
 # Create your models here.
 
 from django.urls import reverse # Used in get_absolute_url() to get URL for specified ID
 
 from django.db.models import UniqueConstraint # Constrains fields to unique values
-from django.db.models.functions import Lower # Returns lower cased value of field
+from django.db.models.functions import Coalesce, Lower, Now # Returns lower cased value of field
 
 from django.conf import settings
 
@@ -18,6 +18,7 @@ class Genre(models.Model):
         unique=True,
         help_text="Enter a book genre (e.g. Science Fiction, French Poetry etc.)"
     )
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         """String for representing the Model object."""
@@ -36,6 +37,30 @@ class Genre(models.Model):
             ),
         ]
 
+# Per-book copy counters, by BookInstance status
+COPY_COUNT_FIELDS = {
+    'a': 'copies_available',
+    'o': 'copies_on_loan',
+    'r': 'copies_reserved',
+    'm': 'copies_maintenance',
+}
+COPY_COUNTERS = ['copies_total', *COPY_COUNT_FIELDS.values()]
+
+
+class BookQuerySet(models.QuerySet):
+    def recount_copies(self):
+        """Recompute the copy counters of these books from BookInstance in one UPDATE."""
+        def copy_count(status=None):
+            copies = BookInstance.objects.filter(book=models.OuterRef('pk'))
+            if status is not None:
+                copies = copies.filter(status=status)
+            count = copies.order_by().values('book').annotate(count=models.Count('pk')).values('count')
+            return Coalesce(models.Subquery(count), 0)
+
+        counters = {field: copy_count(status) for status, field in COPY_COUNT_FIELDS.items()}
+        return self.update(copies_total=copy_count(), updated_at=Now(), **counters)
+
+
 class Book(models.Model):
     """Model representing a book (but not a specific copy of a book)."""
     title = models.CharField(max_length=200)
@@ -55,10 +80,46 @@ class Book(models.Model):
     genre = models.ManyToManyField(
         Genre, help_text="Select a genre for this book")
 
+    # Denormalized copy counts, kept up to date by BookInstance.save() and a
+    # post_delete receiver. Bulk writes call Book.objects.recount_copies();
+    # the recount_copies command repairs them. Plain integers, so that a
+    # counter that has drifted is repaired rather than failing the write.
+    copies_total = models.IntegerField(default=0, editable=False)
+    copies_available = models.IntegerField(default=0, editable=False)
+    copies_on_loan = models.IntegerField(default=0, editable=False)
+    copies_reserved = models.IntegerField(default=0, editable=False)
+    copies_maintenance = models.IntegerField(default=0, editable=False)
+
+    # Also moved forward when the copy counters change
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['title'], name='book_title_idx'),
+        ]
+
     def __str__(self):
         """String for representing the Model object."""
         return self.title
 
+    def save(self, *args, **kwargs):
+        """Save the book; updates leave the copy counters to the database, as this instance may be stale."""
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in COPY_COUNTERS
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the author, whose page lists this book
+        instance._loaded_author_id = instance.__dict__.get('author_id')
+        return instance
+
     def get_absolute_url(self):
         """Returns the URL to access a detail record for this book."""
         return reverse('book-detail', args=[str(self.id)])
@@ -72,6 +133,41 @@ class Book(models.Model):
 
 
 import uuid # Required for unique book instances
+from contextvars import ContextVar
+
+from .pagination import KeysetIndex
+
+# Set while BookInstanceQuerySet.delete() deletes copies, whose books it
+# then recounts and invalidates once; the post_delete receivers skip them
+deleting_copies_in_bulk = ContextVar('deleting_copies_in_bulk', default=False)
+
+
+class BookInstanceQuerySet(models.QuerySet):
+    def delete(self):
+        """Delete the copies, then recount and invalidate their books once instead of per copy."""
+        from .pagecache import invalidate_books  # pagecache imports this module
+
+        with transaction.atomic(using=self.db):
+            book_ids = set(self.order_by().values_list('book_id', flat=True).distinct()) - {None}
+            token = deleting_copies_in_bulk.set(True)
+            try:
+                deleted = super().delete()
+            finally:
+                deleting_copies_in_bulk.reset(token)
+            Book.objects.filter(pk__in=book_ids).recount_copies()
+            invalidate_books(book_ids)
+        return deleted
+
+    def overdue(self, today=None):
+        """Copies on loan whose due date has passed."""
+        return self.filter(status='o', due_back__lt=today or date.today())
+
+    def with_overdue(self, today=None):
+        """Annotate each copy with `overdue`, the condition of overdue() computed in SQL."""
+        return self.annotate(overdue=models.ExpressionWrapper(
+            models.Q(status='o', due_back__lt=today or date.today()), output_field=models.BooleanField(),
+        ))
+
 
 class BookInstance(models.Model):
 
@@ -97,14 +193,54 @@ class BookInstance(models.Model):
         default='m',
         help_text='Book availability',
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BookInstanceQuerySet.as_manager()
 
     class Meta:
         ordering = ['due_back']
+        indexes = [
+            # due_back is nullable: KeysetIndex sorts its NULLs first, as the cursor pagination does
+            # Staff loan list and admin status filter: one status ordered by (due_back, id)
+            KeysetIndex(fields=['status', 'due_back', 'id'], name='bookinst_status_due_idx'),
+            # A borrower's loans, ordered by (due_back, id)
+            KeysetIndex(fields=['borrower', 'status', 'due_back', 'id'], name='bookinst_borrower_status_idx'),
+            # The API keyset pagination
+            KeysetIndex(fields=['due_back', 'id'], name='bookinst_due_back_id_idx'),
+        ]
 
     def __str__(self):
         """String for representing the Model object."""
         return f'{self.id} ({self.book.title})'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which counter this copy is counted in
+        instance._counted_as = (instance.__dict__.get('book_id'), instance.__dict__.get('status'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Save the copy and move it between its book's counters in the same transaction.
+
+        The copy is taken off the counter of the book and status its row has
+        in the database, read under a row lock, not those it had when this
+        instance was loaded: a concurrent edit may have moved it since.
+        """
+        with transaction.atomic(using=kwargs.get('using')):
+            if not self._state.adding:
+                self._counted_as = (
+                    BookInstance.objects.db_manager(kwargs.get('using')).select_for_update()
+                    .filter(pk=self.pk).values_list('book_id', 'status').first()
+                )
+            super().save(*args, **kwargs)
+            counted_as = getattr(self, '_counted_as', None)
+            if counted_as != (self.book_id, self.status):
+                if counted_as is not None:
+                    adjust_copy_counts(*counted_as, -1)
+                adjust_copy_counts(self.book_id, self.status, 1)
+                self._counted_as = (self.book_id, self.status)
+
     @property
     def is_overdue(self):
         """Determines if the book is overdue based on due date and current date."""
@@ -112,16 +248,46 @@ class BookInstance(models.Model):
 
 
 
+def adjust_copy_counts(book_id, status, delta):
+    """Add delta to the total and status counters of a book with an atomic UPDATE."""
+    if book_id is None:
+        return
+    changes = {'copies_total': models.F('copies_total') + delta, 'updated_at': Now()}
+    if status in COPY_COUNT_FIELDS:
+        field = COPY_COUNT_FIELDS[status]
+        changes[field] = models.F(field) + delta
+    Book.objects.filter(pk=book_id).update(**changes)
+
+
+def move_copy_count(book_id, old_status, new_status):
+    """Move one copy of a book from the old to the new status counter with an atomic UPDATE."""
+    if book_id is None or old_status == new_status:
+        return
+    changes = {'updated_at': Now()}
+    if old_status in COPY_COUNT_FIELDS:
+        field = COPY_COUNT_FIELDS[old_status]
+        changes[field] = models.F(field) - 1
+    if new_status in COPY_COUNT_FIELDS:
+        field = COPY_COUNT_FIELDS[new_status]
+        changes[field] = models.F(field) + 1
+    Book.objects.filter(pk=book_id).update(**changes)
+
+
 class Author(models.Model):
     """Model representing an author."""
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField('Died', null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['last_name', 'first_name']
         permissions = (("can_mark_returned", "Set book as returned"),)
+        indexes = [
+            # Default ordering and keyset pagination of the author list
+            models.Index(fields=['last_name', 'first_name', 'id'], name='author_name_idx'),
+        ]
 
     def get_absolute_url(self):
         """Returns the URL to access a particular author instance."""
@@ -138,6 +304,7 @@ class Language(models.Model):
                             unique=True,
                             help_text="Enter the book's natural language (e.g. English, French, Japanese etc.)")
     book_instance = models.ForeignKey('BookInstance', on_delete=models.RESTRICT, null = True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def get_absolute_url(self):
         """Returns the URL to access a particular language instance."""
@@ -145,4 +312,21 @@ class Language(models.Model):
 
     def __str__(self):
         """String for representing the Model object."""
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class OverdueLoan(models.Model):
+    """An overdue loan found by the sweep_overdue command (see catalog/overdue.py)."""
+    book_instance = models.OneToOneField(BookInstance, on_delete=models.CASCADE, primary_key=True,
+                                         related_name='overdue_loan')
+    borrower = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True,
+                                 related_name='overdue_loans')
+    due_back = models.DateField()
+    detected_at = models.DateTimeField(auto_now_add=True)
+    notified_at = models.DateTimeField(null=True, blank=True, help_text='When the borrower was last sent a notice')
+
+    class Meta:
+        ordering = ['due_back']
+
+    def __str__(self):
+        return f'{self.book_instance_id} (due {self.due_back})'
@@ -0,0 +1,89 @@
+"""Overdue loan sweep and borrower notices.
+
+sweep_overdue() records the loans that are overdue on a given day in the
+OverdueLoan report table. It walks BookInstance.objects.overdue() in
+keyset batches on (due_back, id), which the bookinst_status_due_idx index
+serves, upserting each batch with one statement. Report rows whose copy
+has since been returned or renewed are removed in one DELETE.
+
+send_overdue_notices() builds one email per borrower listing all of their
+overdue books not noticed recently and sends every message over a single
+EMAIL_BACKEND connection.
+
+The sweep_overdue command runs both and is meant to be scheduled daily.
+"""
+
+import datetime
+import itertools
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BookInstance, OverdueLoan
+from .pagination import BOOKINSTANCE_ORDERING, CursorPaginator
+
+# Overdue loans upserted (and notices marked sent) per statement
+SWEEP_BATCH_SIZE = 1000
+
+NOTICE_SUBJECT = 'Overdue library books'
+
+
+def sweep_overdue(today=None, batch_size=SWEEP_BATCH_SIZE):
+    """Record the loans overdue on today in OverdueLoan; return (overdue, resolved) counts."""
+    overdue = BookInstance.objects.overdue(today or datetime.date.today())
+    paginator = CursorPaginator(overdue.only('id', 'borrower', 'due_back'), BOOKINSTANCE_ORDERING, batch_size)
+    found = 0
+    cursor = None
+    while True:
+        page = paginator.page(cursor)
+        OverdueLoan.objects.bulk_create(
+            [OverdueLoan(book_instance_id=copy.pk, borrower_id=copy.borrower_id, due_back=copy.due_back)
+             for copy in page],
+            update_conflicts=True, unique_fields=['book_instance'], update_fields=['borrower', 'due_back'],
+        )
+        found += len(page)
+        if not page.has_next():
+            break
+        cursor = page.next_cursor
+
+    resolved, _ = OverdueLoan.objects.exclude(book_instance__in=overdue.values('pk')).delete()
+    return found, resolved
+
+
+def notice_message(borrower, loans):
+    lines = [f'  - {loan.book_instance.book.title} (due {loan.due_back:%d %B %Y})' for loan in loans]
+    body = '\n'.join([
+        f'Dear {borrower.get_full_name() or borrower.get_username()},',
+        '',
+        'The following books you borrowed are overdue. Please return or renew them as soon as possible.',
+        '',
+        *lines,
+    ])
+    return EmailMessage(NOTICE_SUBJECT, body, to=[borrower.email])
+
+
+def send_overdue_notices(now=None, interval=None, batch_size=SWEEP_BATCH_SIZE):
+    """Email every borrower their overdue loans not noticed in interval; return (emails, loans) counts."""
+    now = now or timezone.now()
+    if interval is None:
+        interval = datetime.timedelta(days=settings.CATALOG_OVERDUE_NOTICE_INTERVAL_DAYS)
+    due = (
+        OverdueLoan.objects.filter(Q(notified_at__isnull=True) | Q(notified_at__lte=now - interval))
+        .filter(borrower__isnull=False).exclude(borrower__email='')
+        .select_related('borrower', 'book_instance__book')
+        .order_by('borrower', 'due_back')
+    )
+    messages = []
+    noticed = []
+    for borrower, loans in itertools.groupby(due, key=attrgetter('borrower')):
+        loans = list(loans)
+        messages.append(notice_message(borrower, loans))
+        noticed.extend(loan.pk for loan in loans)
+    if messages:
+        get_connection().send_messages(messages)
+        for start in range(0, len(noticed), batch_size):
+            OverdueLoan.objects.filter(pk__in=noticed[start:start + batch_size]).update(notified_at=now)
+    return len(messages), len(noticed)
@@ -0,0 +1,201 @@
+"""Versioned caching of the book and author detail pages.
+
+Each book and author has a version token in the cache. Everything
+cached for a detail page is keyed by the object's version (and by a
+global version that invalidate_all() bumps), so changing an object only
+means replacing its token; stale entries are never read again and
+expire on their own.
+
+* Anonymous GETs of a detail page are answered from a whole-page cache.
+* For everybody else the templates cache the expensive parts (a book's
+  genres and copies, an author's books) with {% cache %} fragments keyed
+  by cache_version.
+
+Pages that may fill the cache read from the primary database, not a
+replica that may not have seen the change yet (see catalog/replicas.py).
+
+Invalidation only reaches the server processes sharing the cache. With a
+cache private to each process (LocMemCache, the default without
+CACHE_URL) the version tokens, pages and Last-Modified dates expire after
+CATALOG_LOCAL_CACHE_TIMEOUT instead, which bounds how long another
+process serves a stale page.
+
+The signal receivers in catalog/signals.py bump the versions when books,
+copies, authors or genres change (a book's page shows its author, an
+author's page lists their books and copy counts); bulk writers call
+invalidate_books()/invalidate_authors() directly.
+
+acached_page() is VersionedCacheMixin for the async views.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .models import Book
+from .replicas import read_from_primary
+
+GLOBAL_VERSION_KEY = 'catalog:version'
+
+# Backends whose entries are private to one server process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def shared_cache():
+    """Whether every server process uses the same default cache (Redis, Memcached, database...)."""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+def version_timeout():
+    """Lifetime of version tokens: unlimited, unless other processes cannot see them bumped."""
+    return None if shared_cache() else settings.CATALOG_LOCAL_CACHE_TIMEOUT
+
+
+def page_cache_timeout():
+    """Lifetime of cached pages, fragments and Last-Modified dates."""
+    if shared_cache():
+        return settings.CATALOG_PAGE_CACHE_TIMEOUT
+    return min(settings.CATALOG_PAGE_CACHE_TIMEOUT, settings.CATALOG_LOCAL_CACHE_TIMEOUT)
+
+
+def version_key(kind, pk):
+    return f'catalog:version:{kind}:{pk}'
+
+
+def new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def bump(keys):
+    cache.set_many(dict.fromkeys(keys, new_token()), version_timeout())
+
+
+def current_versions(keys):
+    """Return the tokens of the version keys, starting the missing ones, joined in order."""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_token(), version_timeout())
+            versions[key] = cache.get(key)
+    return '.'.join(versions[key] for key in keys)
+
+
+def cache_version(kind, pk):
+    """Return the current version of the kind ('book' or 'author') object pk, or of their list if pk is 'list'."""
+    return current_versions([GLOBAL_VERSION_KEY, version_key(kind, pk)])
+
+
+async def acache_version(kind, pk):
+    """Async version of cache_version()."""
+    keys = [GLOBAL_VERSION_KEY, version_key(kind, pk)]
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, new_token(), version_timeout())
+            versions[key] = await cache.aget(key)
+    return '.'.join(versions[key] for key in keys)
+
+
+def page_key(kind, pk, version):
+    return f'catalog:page:{kind}:{pk}:{version}'
+
+
+def fragment_context(version):
+    """Template context for the {% cache %} fragments of a detail page."""
+    return {'cache_version': version, 'cache_timeout': page_cache_timeout()}
+
+
+def invalidate(kind, ids):
+    """Bump the versions of the kind objects with the given ids, and of the kind list."""
+    keys = [version_key(kind, pk) for pk in set(ids) if pk is not None]
+    if not keys:
+        return
+    keys.append(version_key(kind, 'list'))
+    bump(keys)
+    # And again at commit, in case a request cached the old rows in between
+    transaction.on_commit(lambda: bump(keys))
+
+
+def invalidate_books(book_ids, author_ids=()):
+    """Invalidate books and the pages of their authors (plus author_ids, e.g. previous authors)."""
+    book_ids = set(book_ids)
+    author_ids = set(author_ids) | set(Book.objects.filter(pk__in=book_ids).values_list('author_id', flat=True))
+    invalidate('book', book_ids)
+    invalidate('author', author_ids)
+
+
+def invalidate_authors(author_ids):
+    """Invalidate authors and the pages of their books."""
+    author_ids = set(author_ids)
+    invalidate('author', author_ids)
+    invalidate('book', Book.objects.filter(author__in=author_ids).values_list('pk', flat=True))
+
+
+def invalidate_all():
+    """Invalidate every cached page and fragment, e.g. after a bulk import or repair."""
+    bump([GLOBAL_VERSION_KEY])
+
+
+class VersionedCacheMixin:
+    """Detail view mixin: page cache for anonymous users and cache_version for fragments."""
+
+    cache_kind = None
+
+    def get(self, request, *args, **kwargs):
+        self.cache_version = cache_version(self.cache_kind, kwargs[self.pk_url_kwarg])
+        if request.user.is_authenticated:
+            # The page may fill fragments
+            read_from_primary()
+            return super().get(request, *args, **kwargs)
+
+        key = page_key(self.cache_kind, kwargs[self.pk_url_kwarg], self.cache_version)
+        content = cache.get(key)
+        if content is not None:
+            response = HttpResponse(content)
+        else:
+            read_from_primary()
+            response = super().get(request, *args, **kwargs)
+            if response.status_code == 200:
+                response.add_post_render_callback(
+                    lambda response: cache.set(key, response.content, page_cache_timeout())
+                )
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(fragment_context(self.cache_version))
+        return context
+
+
+async def acached_page(request, kind, pk, view):
+    """Async version of VersionedCacheMixin.get(): await view(version) unless the page is cached.
+
+    request.user must already be loaded (see catalog/async_views.py).
+    """
+    version = await acache_version(kind, pk)
+    if request.user.is_authenticated:
+        read_from_primary()
+        return await view(version)
+
+    key = page_key(kind, pk, version)
+    content = await cache.aget(key)
+    if content is not None:
+        response = HttpResponse(content)
+    else:
+        read_from_primary()
+        response = await view(version)
+        if response.status_code == 200:
+            # Runs in the thread that renders the TemplateResponse
+            response.add_post_render_callback(
+                lambda response: cache.set(key, response.content, page_cache_timeout())
+            )
+    patch_vary_headers(response, ['Cookie'])
+    return response
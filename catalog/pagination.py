@@ -0,0 +1,207 @@
+"""Keyset (cursor) pagination for catalog listings.
+
+Offset pagination makes the database walk and discard every row before the
+requested page and runs a full COUNT(*) to number the pages. A cursor page
+instead seeks directly past the last row already shown, using the ordering
+columns, so deep pages cost the same as the first one:
+
+    WHERE (due_back, id) > (<last due_back>, <last id>) ORDER BY due_back, id
+
+The position is handed to the client as an opaque token. Ordering columns
+may be nullable; NULLs sort first. Only nullable columns are ordered with
+an explicit NULLS FIRST/LAST, so NOT NULL ones are served by a default
+btree index on every database; indexes on nullable ones are declared as
+KeysetIndex.
+"""
+
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import F, Index, Q
+from django.http import Http404
+
+# Seek orderings used by the catalog listings. The primary key is always
+# last so that every row has a unique position.
+AUTHOR_ORDERING = ('last_name', 'first_name', 'id')
+BOOK_ORDERING = ('title', 'id')
+BOOKINSTANCE_ORDERING = ('due_back', 'id')
+
+
+class KeysetIndex(Index):
+    """An index on fields that sorts NULLs first, as CursorPaginator orders them.
+
+    PostgreSQL sorts NULLs last by default and cannot scan a plain index
+    for ORDER BY ... NULLS FIRST, so there the nullable fields are indexed
+    with NULLS FIRST. SQLite already sorts NULLs first and does not accept
+    the modifier in an index.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().create_sql(model, schema_editor, using, **kwargs)
+        expressions = [
+            F(name).asc(nulls_first=True) if model._meta.get_field(name).null else F(name)
+            for name in self.fields
+        ]
+        index = Index(*expressions, name=self.name, db_tablespace=self.db_tablespace,
+                      opclasses=self.opclasses, condition=self.condition, include=self.include)
+        return index.create_sql(model, schema_editor, using, **kwargs)
+
+
+class InvalidCursor(InvalidPage):
+    """Raised when a cursor token cannot be decoded."""
+    pass
+
+
+class CursorPage:
+    """A page of results together with the tokens for its neighbours."""
+
+    def __init__(self, object_list, next_cursor, previous_cursor, paginator):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.paginator = paginator
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Paginate a queryset by seeking on a unique tuple of ordering fields.
+
+    The total number of rows is only computed when ``with_count`` is true,
+    so a page normally costs a single query.
+    """
+
+    def __init__(self, queryset, ordering, per_page, with_count=False):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = int(per_page)
+        self.with_count = with_count
+        self.fields = [queryset.model._meta.get_field(name) for name in self.ordering]
+
+    @property
+    def count(self):
+        """Total number of rows, or None when counting is switched off."""
+        if not self.with_count:
+            return None
+        if not hasattr(self, '_count'):
+            self._count = self.queryset.count()
+        return self._count
+
+    def encode_cursor(self, obj, backwards=False):
+        """Return the opaque token pointing just past (or before) obj."""
+        values = [None if getattr(obj, field.attname) is None else field.value_to_string(obj)
+                  for field in self.fields]
+        payload = json.dumps({'p': int(backwards), 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        """Return (backwards, values) for a token produced by encode_cursor."""
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = payload['v']
+            if len(values) != len(self.fields):
+                raise ValueError('Wrong number of cursor values')
+            values = [None if value is None else field.to_python(value)
+                      for field, value in zip(self.fields, values)]
+            return bool(payload['p']), values
+        except (binascii.Error, ValueError, KeyError, TypeError, ValidationError):
+            raise InvalidCursor('Invalid cursor')
+
+    def _seek(self, values, backwards):
+        """Build the row-value comparison (fields) > values, or < when going backwards."""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for name, value in zip(self.ordering, values):
+            if backwards:
+                # Nothing sorts before NULL
+                if value is not None:
+                    condition |= equal & (Q(**{f'{name}__lt': value}) | Q(**{f'{name}__isnull': True}))
+            elif value is None:
+                condition |= equal & Q(**{f'{name}__isnull': False})
+            else:
+                condition |= equal & Q(**{f'{name}__gt': value})
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        return condition
+
+    def _order_by(self, backwards):
+        if backwards:
+            return [F(name).desc(nulls_last=field.null or None) for name, field in zip(self.ordering, self.fields)]
+        return [F(name).asc(nulls_first=field.null or None) for name, field in zip(self.ordering, self.fields)]
+
+    def page(self, cursor=None):
+        """Return the CursorPage that starts at the given token (or the first page)."""
+        backwards, values, queryset = self._page_query(cursor)
+        return self._make_page(list(queryset), backwards, values)
+
+    async def apage(self, cursor=None):
+        """Async version of page()."""
+        backwards, values, queryset = self._page_query(cursor)
+        return self._make_page([row async for row in queryset], backwards, values)
+
+    async def acount(self):
+        """Async version of count."""
+        if self.with_count and not hasattr(self, '_count'):
+            self._count = await self.queryset.acount()
+        return self.count
+
+    def _page_query(self, cursor):
+        backwards, values = self.decode_cursor(cursor) if cursor else (False, None)
+
+        queryset = self.queryset.order_by(*self._order_by(backwards))
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, backwards))
+
+        # Fetch one extra row to find out whether there is another page
+        return backwards, values, queryset[:self.per_page + 1]
+
+    def _make_page(self, rows, backwards, values):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or backwards:
+                next_cursor = self.encode_cursor(rows[-1])
+            if (has_more and backwards) or (values is not None and not backwards):
+                previous_cursor = self.encode_cursor(rows[0], backwards=True)
+        return CursorPage(rows, next_cursor, previous_cursor, self)
+
+
+class CursorPaginationMixin:
+    """Use keyset pagination in a generic ListView.
+
+    Set ``cursor_ordering`` to the seek fields; ``paginate_by`` gives the page
+    size. The page position is read from the ``cursor`` query parameter.
+    """
+    cursor_ordering = None
+    cursor_kwarg = 'cursor'
+    cursor_with_count = False
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, self.cursor_ordering, page_size,
+                                    with_count=self.cursor_with_count)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return (paginator, page, page.object_list, page.has_other_pages())
@@ -0,0 +1,13 @@
+"""Percentiles of latency samples, for the benchmarks and the request instrumentation."""
+
+import math
+
+
+def percentile(values, pct):
+    """The pct-th percentile of values, interpolating between the closest ranks."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * pct / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
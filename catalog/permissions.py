@@ -0,0 +1,66 @@
+"""Permission sets cached across requests.
+
+ModelBackend already keeps a user's permissions on the user object, so
+within one request they are loaded once (two queries: the user's own
+permissions and their groups'). CachedModelBackend also keeps them in the
+cache between requests, keyed by the user's permission version and a
+version shared by all users, so a logged-in page usually checks
+permissions without a query.
+
+The signal receivers in catalog/signals.py bump the versions when
+permission or group assignments change: the user's version for changes
+to one user (their permissions, groups, superuser or active flags) and
+the shared one for changes that may concern many users (a group's
+permissions, deleted groups and permissions).
+
+A revoked permission must not stay usable in other server processes, so
+permission sets are only cached across requests in a cache shared by all
+of them (see CACHE_URL). With a per-process cache such as the default
+LocMemCache the backend behaves like ModelBackend.
+"""
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+from .pagecache import bump, current_versions, shared_cache, version_key
+
+ALL_USERS = 'all'
+
+
+def permissions_key(user_id):
+    """Return the cache key of the permission set of user_id at the current versions."""
+    version = current_versions([version_key('perms', user_id), version_key('perms', ALL_USERS)])
+    return f'catalog:perms:{user_id}:{version}'
+
+
+def invalidate_permissions(user_ids=None):
+    """Drop the cached permissions of the given users, or of every user if user_ids is None."""
+    if user_ids is None:
+        keys = [version_key('perms', ALL_USERS)]
+    else:
+        keys = [version_key('perms', pk) for pk in set(user_ids) if pk is not None]
+    if not keys:
+        return
+    bump(keys)
+    # And again at commit, in case a request cached the old permissions in between
+    transaction.on_commit(lambda: bump(keys))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose permission sets are cached across requests when the cache is shared."""
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not shared_cache():
+            return super().get_all_permissions(user_obj, obj)
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            key = permissions_key(user_obj.pk)
+            perms = cache.get(key)
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                cache.set(key, perms, settings.CATALOG_PERMISSION_CACHE_TIMEOUT)
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
@@ -0,0 +1,122 @@
+"""Response rendering and request parsing for the Ninja API.
+
+Ninja's default renderer encodes responses with the stdlib json module
+and NinjaJSONEncoder, which for large lists and pages takes more CPU time
+than building them. CatalogRenderer encodes with orjson instead, which
+handles dates, datetimes and UUIDs natively; other values (Decimal, lazy
+strings, ...) are converted by NinjaJSONEncoder as before. CatalogParser
+decodes request bodies with orjson. Without orjson installed both fall
+back to the stdlib.
+
+With msgpack installed, clients may ask for MessagePack instead of JSON
+with an Accept header naming application/msgpack (or
+application/x-msgpack) at least as preferred as JSON; request bodies sent
+with either content type are decoded as MessagePack. Dates, UUIDs and
+Decimals are sent as the same strings JSON uses. Responses then carry
+Vary: Accept, and ETags are qualified with the representation so that a
+JSON copy is never revalidated as a MessagePack one.
+
+The benchmark_renderers command compares the encoders.
+"""
+
+import json
+
+from django.utils.cache import patch_vary_headers
+from ninja import NinjaAPI
+from ninja.parser import Parser
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack')
+
+# Converts what orjson and msgpack cannot encode themselves, as the default renderer does
+encode_default = NinjaJSONEncoder().default
+
+
+def dumps_json(data):
+    if orjson is None:
+        return json.dumps(data, cls=NinjaJSONEncoder)
+    return orjson.dumps(data, default=encode_default)
+
+
+def dumps_msgpack(data):
+    return msgpack.packb(data, default=encode_default, datetime=False)
+
+
+def quality(media_type):
+    try:
+        return float(media_type.params.get('q', 1))
+    except ValueError:
+        return 0
+
+
+def negotiate(request):
+    """The media type to answer request with: MessagePack if Accept prefers it (and msgpack is installed), else JSON."""
+    if msgpack is None:
+        return JSON
+    json_q = msgpack_q = 0
+    for accepted in request.accepted_types:
+        if accepted.match(JSON):
+            json_q = max(json_q, quality(accepted))
+        if f'{accepted.main_type}/{accepted.sub_type}' in MSGPACK_TYPES:
+            msgpack_q = max(msgpack_q, quality(accepted))
+    return MSGPACK if msgpack_q > 0 and msgpack_q >= json_q else JSON
+
+
+def representation_etag(request, etag):
+    """Qualify an API response's ETag with the negotiated media type (JSON ETags are left as they are)."""
+    if etag and negotiate(request) == MSGPACK:
+        return f'{etag}-msgpack'
+    return etag
+
+
+def vary_on_accept(response):
+    """Mark response as depending on Accept when there is more than one representation to choose from."""
+    if msgpack is not None:
+        patch_vary_headers(response, ['Accept'])
+    return response
+
+
+class CatalogRenderer(BaseRenderer):
+    media_type = JSON
+
+    def render(self, request, data, *, response_status):
+        if negotiate(request) == MSGPACK:
+            return dumps_msgpack(data)
+        return dumps_json(data)
+
+
+class CatalogParser(Parser):
+    def parse_body(self, request):
+        if msgpack is not None and request.content_type in MSGPACK_TYPES:
+            return msgpack.unpackb(request.body)
+        if orjson is None:
+            return json.loads(request.body)
+        return orjson.loads(request.body)
+
+
+class CatalogAPI(NinjaAPI):
+    """NinjaAPI rendering with CatalogRenderer and labelling each response with its negotiated media type."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('renderer', CatalogRenderer())
+        kwargs.setdefault('parser', CatalogParser())
+        super().__init__(**kwargs)
+
+    def create_response(self, request, data, *, status=None, temporal_response=None):
+        response = super().create_response(request, data, status=status, temporal_response=temporal_response)
+        if negotiate(request) == MSGPACK:
+            response['Content-Type'] = MSGPACK
+        return vary_on_accept(response)
@@ -0,0 +1,144 @@
+"""Read replica routing.
+
+DATABASE_REPLICA_URLS adds replicas of the default database to
+DATABASES as replica1, replica2, ... (see local_library/settings.py).
+ReplicaRouter then sends the catalog's reads during GET and HEAD requests
+to one replica, picked per request so that a page is read from a single
+snapshot. Everything else uses the primary ('default'): writes, reads
+during other requests (a loan is read and changed on the primary), reads
+outside requests (management commands), and reads of other apps' models
+such as sessions and users, which must be current right after a login.
+
+Read-your-writes: once a request writes a catalog model, the rest of it
+reads from the primary, and ReplicaMiddleware sets a cookie that keeps
+the browser's reads on the primary for DATABASE_REPLICA_STICKINESS
+seconds, longer than the replicas are expected to lag behind.
+
+Data cached for every visitor under a version that a write has just
+bumped must not come from a replica that has not seen the write yet, or
+it would stay stale until the next change. So the page cache, the
+Last-Modified cache and the home page counts are filled by reading from
+the primary (see primary_reads() and read_from_primary()); the requests
+they answer from the cache make no queries at all.
+"""
+
+import contextlib
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+STICKY_COOKIE = 'catalog_primary'
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class ReadState:
+    """Where the current request reads the catalog from: a replica alias, or None for the primary."""
+
+    def __init__(self, database=None):
+        self.database = database
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('catalog_read_state', default=None)
+
+
+def request_state(request):
+    replicas = settings.DATABASE_REPLICAS
+    if request.method in READ_METHODS and replicas and STICKY_COOKIE not in request.COOKIES:
+        return ReadState(random.choice(replicas))
+    return ReadState()
+
+
+def read_from_primary():
+    """Read the catalog from the primary for the rest of the current request."""
+    state = _state.get()
+    if state is not None:
+        state.database = None
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """Read the catalog from the primary inside the block."""
+    state = _state.get()
+    if state is None or state.database is None:
+        yield
+        return
+    database = state.database
+    state.database = None
+    try:
+        yield
+    finally:
+        if not state.wrote:
+            state.database = database
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is not None and state.database and model._meta.app_label == 'catalog':
+            return state.database
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label == 'catalog':
+            state.database = None
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema from the primary
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaMiddleware:
+    """Tracks where a request reads from, and keeps a browser that changed the catalog on the primary."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = request_state(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        # Sync views and the async ORM run in worker threads with a copy of
+        # this context, which refers to the same state
+        state = request_state(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
+
+    def finish(self, response, state):
+        if state.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=settings.DATABASE_REPLICA_STICKINESS, httponly=True, samesite='Lax',
+            )
+        return response
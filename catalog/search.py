@@ -0,0 +1,175 @@
+"""Full-text search over book titles, summaries, author names and genres.
+
+Each book has one document in an inverted index kept next to the catalog
+tables:
+
+* on SQLite, the FTS5 virtual table catalog_book_fts (rowid = book id),
+  ranked with bm25();
+* on PostgreSQL, catalog_book_search holding a weighted tsvector per book
+  with a GIN index, ranked with ts_rank().
+
+Documents are (re)built in SQL straight from the catalog tables, so keeping
+the index current is one statement per batch of books. The signal
+receivers in catalog/signals.py call index_books()/remove_books() when
+books, authors, genres or book genres change; bulk writers call them
+directly. Every query term is matched as a prefix.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Book
+
+# Terms of a search query; everything else is ignored
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# Books (re)indexed per statement
+INDEX_BATCH_SIZE = 500
+
+
+def query_terms(query):
+    return TERM_RE.findall(query.lower())
+
+
+class SQLiteBackend:
+    """FTS5 index; columns are weighted title 10, author 5, genres 3, summary 1."""
+
+    def index(self, cursor, book_ids):
+        placeholders = ', '.join(['%s'] * len(book_ids))
+        cursor.execute(f'DELETE FROM catalog_book_fts WHERE rowid IN ({placeholders})', book_ids)
+        cursor.execute(f"""
+            INSERT INTO catalog_book_fts (rowid, title, author, genres, summary)
+            SELECT b.id, b.title,
+                   COALESCE(a.first_name || ' ' || a.last_name, ''),
+                   COALESCE((SELECT group_concat(g.name, ' ')
+                             FROM catalog_book_genre bg JOIN catalog_genre g ON g.id = bg.genre_id
+                             WHERE bg.book_id = b.id), ''),
+                   b.summary
+            FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id
+            WHERE b.id IN ({placeholders})
+        """, book_ids)
+
+    def remove(self, cursor, book_ids):
+        placeholders = ', '.join(['%s'] * len(book_ids))
+        cursor.execute(f'DELETE FROM catalog_book_fts WHERE rowid IN ({placeholders})', book_ids)
+
+    def search(self, cursor, terms, limit):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        cursor.execute("""
+            SELECT rowid, -bm25(catalog_book_fts, 10.0, 5.0, 3.0, 1.0) AS rank
+            FROM catalog_book_fts WHERE catalog_book_fts MATCH %s
+            ORDER BY rank DESC LIMIT %s
+        """, [match, limit])
+        return cursor.fetchall()
+
+
+class PostgresBackend:
+    """tsvector index; title, author, genres and summary carry weights A to D."""
+
+    def index(self, cursor, book_ids):
+        cursor.execute("""
+            INSERT INTO catalog_book_search (book_id, document)
+            SELECT b.id,
+                   setweight(to_tsvector('english', b.title), 'A')
+                   || setweight(to_tsvector('english', COALESCE(a.first_name || ' ' || a.last_name, '')), 'B')
+                   || setweight(to_tsvector('english', COALESCE(
+                        (SELECT string_agg(g.name, ' ')
+                         FROM catalog_book_genre bg JOIN catalog_genre g ON g.id = bg.genre_id
+                         WHERE bg.book_id = b.id), '')), 'C')
+                   || setweight(to_tsvector('english', b.summary), 'D')
+            FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id
+            WHERE b.id = ANY(%s)
+            ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document
+        """, [list(book_ids)])
+
+    def remove(self, cursor, book_ids):
+        cursor.execute('DELETE FROM catalog_book_search WHERE book_id = ANY(%s)', [list(book_ids)])
+
+    def search(self, cursor, terms, limit):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        cursor.execute("""
+            SELECT book_id, ts_rank(document, query) AS rank
+            FROM catalog_book_search, to_tsquery('english', %s) query
+            WHERE document @@ query
+            ORDER BY rank DESC LIMIT %s
+        """, [tsquery, limit])
+        return cursor.fetchall()
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgresBackend,
+}
+
+
+def get_backend():
+    """Return the index backend for the default database, or None if it has no full-text support."""
+    backend = BACKENDS.get(connection.vendor)
+    return backend() if backend else None
+
+
+def batches(ids, size=INDEX_BATCH_SIZE):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def index_books(book_ids):
+    """(Re)build the index documents of the given books."""
+    backend = get_backend()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        for batch in batches(set(book_ids)):
+            backend.index(cursor, batch)
+
+
+def remove_books(book_ids):
+    """Drop the index documents of the given (deleted) books."""
+    backend = get_backend()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        for batch in batches(set(book_ids)):
+            backend.remove(cursor, batch)
+
+
+def rebuild_index():
+    """Reindex every book."""
+    index_books(Book.objects.values_list('pk', flat=True).iterator())
+
+
+def search_books(query, limit=50):
+    """Return up to limit books matching every term of query, best match first.
+
+    Each book gets a ``rank`` attribute (higher is better). Without a
+    full-text backend this falls back to unranked icontains matching.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    books = Book.objects.select_related('author')
+
+    backend = get_backend()
+    if backend is None:
+        for term in terms:
+            books = books.filter(
+                Q(title__icontains=term) | Q(summary__icontains=term) | Q(genre__name__icontains=term)
+                | Q(author__first_name__icontains=term) | Q(author__last_name__icontains=term)
+            )
+        results = list(books.distinct()[:limit])
+        for book in results:
+            book.rank = None
+        return results
+
+    with connection.cursor() as cursor:
+        ranked = backend.search(cursor, terms, limit)
+    found = books.in_bulk([book_id for book_id, rank in ranked])
+    results = []
+    for book_id, rank in ranked:
+        if book_id in found:
+            found[book_id].rank = rank
+            results.append(found[book_id])
+    return results
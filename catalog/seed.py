@@ -0,0 +1,199 @@
+"""Synthetic catalog data for load testing and benchmarks.
+
+seed_library() generates authors, genres, languages, books, copies and
+borrowers with bulk inserts. Volumes are skewed the way a real library's
+are: a few prolific authors write most of the books, a few genres cover
+most of them, a few books have many copies, and a minority of
+borrowers hold most of the loans (some of them overdue). The same seed
+always produces the same catalog.
+"""
+
+import datetime
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from .models import Author, Book, BookInstance, Genre, Language
+from .pagecache import invalidate_all
+from .search import index_books
+
+# Rows per INSERT
+SEED_BATCH_SIZE = 2000
+
+FIRST_NAMES = [
+    'Ada', 'Alan', 'Anne', 'Boris', 'Chen', 'Clara', 'David', 'Elena', 'Fatima', 'George',
+    'Hana', 'Ivan', 'Jane', 'Kofi', 'Lena', 'Marcus', 'Nadia', 'Omar', 'Priya', 'Rosa',
+    'Sven', 'Tomas', 'Ursula', 'Victor', 'Wen', 'Yara', 'Zoe',
+]
+LAST_NAMES = [
+    'Abbott', 'Baker', 'Castillo', 'Dubois', 'Eriksen', 'Fischer', 'Garcia', 'Haddad', 'Ito',
+    'Jensen', 'Kowalski', 'Larsen', 'Moreau', 'Nakamura', 'Okafor', 'Petrov', 'Quinn', 'Rossi',
+    'Sato', 'Tanaka', 'Umarov', 'Vargas', 'Weber', 'Xu', 'Young', 'Zhang',
+]
+TITLE_WORDS = [
+    'Shadow', 'River', 'Secret', 'Garden', 'Empire', 'Winter', 'Glass', 'Silent', 'Last',
+    'Forgotten', 'Iron', 'Golden', 'Night', 'Storm', 'House', 'Star', 'Ocean', 'Crown',
+    'Machine', 'City', 'Letters', 'Fire', 'Mountain', 'Dream', 'Library', 'Road', 'Memory',
+]
+GENRE_NAMES = [
+    'Fiction', 'Science Fiction', 'Fantasy', 'Mystery', 'Romance', 'History', 'Biography',
+    'Poetry', 'Horror', 'Travel', 'Philosophy', 'Science', 'Children', 'Drama', 'Cookery',
+]
+LANGUAGE_NAMES = [
+    'English', 'French', 'Spanish', 'German', 'Japanese', 'Chinese', 'Italian', 'Portuguese',
+    'Russian', 'Arabic', 'Hindi', 'Korean', 'Dutch', 'Swedish', 'Polish',
+]
+IMPRINTS = ['Penguin', 'Vintage', 'Faber', 'Tor', 'Orbit', 'Gollancz', 'Picador', 'Virago']
+
+# Share of copies per status: available, on loan, reserved, maintenance
+STATUS_WEIGHTS = {'a': 55, 'o': 30, 'r': 8, 'm': 7}
+
+# Share of loans that are already overdue
+OVERDUE_RATE = 0.15
+
+
+def isbn13(n):
+    """Return a valid ISBN-13 in the 979 range built from the number n."""
+    digits = f'979{n:09d}'
+    check = -sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(digits)) % 10
+    return f'{digits}{check}'
+
+
+def skewed_weights(count, rng, alpha=1.2):
+    """Zipf-like popularity weights for count items, in random order."""
+    weights = [1 / (rank ** alpha) for rank in range(1, count + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def unique_names(names, count, taken):
+    """count names not in taken (compared case-insensitively), numbering repeats of names."""
+    taken = {name.lower() for name in taken}
+    result = []
+    i = 0
+    while len(result) < count:
+        name = names[i % len(names)]
+        if i >= len(names):
+            name = f'{name} {i // len(names) + 1}'
+        if name.lower() not in taken:
+            result.append(name)
+        i += 1
+    return result
+
+
+def seed_library(authors=1000, books=10000, copies_per_book=3, borrowers=500, genres=40,
+                 languages=15, seed=0, batch_size=SEED_BATCH_SIZE, log=None):
+    """Add a synthetic catalog to the database and return the number of rows created per model.
+
+    copies_per_book is the average number of copies of a book. Copy
+    counters and the search index are brought up to date at the end, and
+    cached detail pages are invalidated.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    today = datetime.date.today()
+    User = get_user_model()
+
+    with transaction.atomic():
+        log(f'Creating {borrowers} borrowers')
+        taken = set(User.objects.values_list('username', flat=True))
+        usernames = [f'reader{i}' for i in range(borrowers + len(taken)) if f'reader{i}' not in taken][:borrowers]
+        password = make_password(None)
+        users = User.objects.bulk_create(
+            [User(username=username, password=password) for username in usernames],
+            batch_size=batch_size,
+        )
+
+        log(f'Creating {genres} genres and {languages} languages')
+        genre_names = unique_names(GENRE_NAMES, genres, Genre.objects.values_list('name', flat=True))
+        genre_objs = Genre.objects.bulk_create([Genre(name=name) for name in genre_names])
+
+        log(f'Creating {authors} authors')
+        author_objs = Author.objects.bulk_create([
+            Author(
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                date_of_birth=today - datetime.timedelta(days=rng.randrange(20 * 365, 90 * 365)),
+            )
+            for _ in range(authors)
+        ], batch_size=batch_size)
+
+        log(f'Creating {books} books')
+        author_weights = skewed_weights(len(author_objs), rng)
+        genre_weights = skewed_weights(len(genre_objs), rng)
+        isbn_offset = Book.objects.count()
+        book_authors = rng.choices(author_objs, weights=author_weights, k=books)
+        book_objs = Book.objects.bulk_create([
+            Book(
+                title=' '.join(rng.sample(TITLE_WORDS, rng.randint(1, 4))),
+                author=author,
+                summary=' '.join(rng.choices(TITLE_WORDS, k=rng.randint(10, 40))).capitalize() + '.',
+                isbn=isbn13(isbn_offset + i),
+            )
+            for i, author in enumerate(book_authors)
+        ], batch_size=batch_size)
+
+        BookGenre = Book.genre.through
+        links = []
+        for book in book_objs:
+            for genre in set(rng.choices(genre_objs, weights=genre_weights, k=rng.randint(1, 3))):
+                links.append(BookGenre(book_id=book.pk, genre_id=genre.pk))
+        BookGenre.objects.bulk_create(links, batch_size=batch_size)
+
+        log(f'Creating about {round(books * copies_per_book)} copies')
+        # A long tail of copies per book: most have one or two, a few have many
+        borrower_weights = skewed_weights(len(users), rng, alpha=0.8)
+        statuses, status_weights = zip(*STATUS_WEIGHTS.items())
+        copies = []
+        language_copies = []
+        num_copies = 0
+        for book in book_objs:
+            count = max(1, round(rng.expovariate(1 / copies_per_book))) if copies_per_book else 0
+            for _ in range(count):
+                status = rng.choices(statuses, weights=status_weights)[0]
+                on_loan = status == 'o' and bool(users)
+                due_back = None
+                if on_loan:
+                    days = -rng.randint(1, 60) if rng.random() < OVERDUE_RATE else rng.randint(0, 28)
+                    due_back = today + datetime.timedelta(days=days)
+                copy = BookInstance(
+                    book=book,
+                    imprint=f'{rng.choice(IMPRINTS)}, {rng.randint(1950, today.year)}',
+                    status=status,
+                    due_back=due_back,
+                    borrower=rng.choices(users, weights=borrower_weights)[0] if on_loan else None,
+                )
+                copies.append(copy)
+                if len(language_copies) < languages:
+                    language_copies.append(copy)
+            if len(copies) >= batch_size:
+                BookInstance.objects.bulk_create(copies)
+                num_copies += len(copies)
+                copies = []
+        BookInstance.objects.bulk_create(copies)
+        num_copies += len(copies)
+
+        language_names = unique_names(LANGUAGE_NAMES, languages, Language.objects.values_list('name', flat=True))
+        Language.objects.bulk_create([
+            Language(name=name, book_instance=language_copies[i] if i < len(language_copies) else None)
+            for i, name in enumerate(language_names)
+        ])
+
+        log('Updating copy counters and the search index')
+        book_ids = [book.pk for book in book_objs]
+        for start in range(0, len(book_ids), batch_size):
+            batch = book_ids[start:start + batch_size]
+            Book.objects.filter(pk__in=batch).recount_copies()
+        index_books(book_ids)
+        invalidate_all()
+
+    return {
+        'borrowers': len(users),
+        'genres': len(genre_objs),
+        'languages': len(language_names),
+        'authors': len(author_objs),
+        'books': len(book_objs),
+        'book_instances': num_copies,
+    }
@@ -0,0 +1,168 @@
+"""Signal receivers that keep derived catalog data in step with the models."""
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db.models.functions import Now
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Author, Book, BookInstance, Genre, adjust_copy_counts, deleting_copies_in_bulk
+from .pagecache import invalidate, invalidate_authors, invalidate_books
+from .permissions import invalidate_permissions
+from .search import index_books, remove_books
+from .stats import invalidate_dashboard_stats
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=BookInstance)
+@receiver([post_save, post_delete], sender=Genre)
+@receiver([post_save, post_delete], sender=Author)
+def refresh_dashboard_stats(sender, **kwargs):
+    """Invalidate the cached home page counts when a counted model changes."""
+    invalidate_dashboard_stats()
+
+
+@receiver(post_delete, sender=BookInstance)
+def uncount_deleted_copy(sender, instance, **kwargs):
+    """Take a deleted copy off its book's counters (queryset deletes recount the books instead)."""
+    if deleting_copies_in_bulk.get():
+        return
+    adjust_copy_counts(*getattr(instance, '_counted_as', (instance.book_id, instance.status)), -1)
+
+
+# Search index maintenance (see catalog/search.py)
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, **kwargs):
+    index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    remove_books([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+def reindex_renamed_books(sender, instance, created, **kwargs):
+    """Author and genre names are part of their books' documents."""
+    if not created:
+        index_books(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Genre)
+def remember_genre_books(sender, instance, **kwargs):
+    # The genre's through rows are gone by post_delete
+    instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def reindex_genre_books(sender, instance, **kwargs):
+    index_books(getattr(instance, '_search_book_ids', []))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def reindex_book_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    """Reindex books whose genres were added, removed or cleared, from either side."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            index_books([instance.pk])
+    elif action == 'pre_clear':
+        instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        index_books(getattr(instance, '_search_book_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        index_books(pk_set)
+
+
+# Detail page cache versions (see catalog/pagecache.py)
+
+@receiver([post_save, post_delete], sender=Book)
+def invalidate_book_pages(sender, instance, **kwargs):
+    """A book shows on its own page and on its current and previous author's pages."""
+    invalidate('book', [instance.pk])
+    invalidate('author', [instance.author_id, getattr(instance, '_loaded_author_id', None)])
+    instance._loaded_author_id = instance.author_id
+
+
+@receiver([post_save, post_delete], sender=BookInstance)
+def invalidate_copy_pages(sender, instance, **kwargs):
+    """A copy shows on its book's page, also the one it moved from, and counts on their authors' pages."""
+    if deleting_copies_in_bulk.get():
+        return
+    previous_book_id = getattr(instance, '_counted_as', (None, None))[0]
+    invalidate_books([instance.book_id, previous_book_id])
+
+
+@receiver([post_save, post_delete], sender=Author)
+def invalidate_author_pages(sender, instance, **kwargs):
+    """Book pages show their author's name."""
+    invalidate_authors([instance.pk])
+
+
+@receiver(post_save, sender=Genre)
+def invalidate_genre_pages(sender, instance, created, **kwargs):
+    if not created:
+        invalidate('book', instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def invalidate_deleted_genre_pages(sender, instance, **kwargs):
+    # Books remembered by remember_genre_books
+    invalidate('book', getattr(instance, '_search_book_ids', []))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def invalidate_book_genre_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    """Genres are shown on book pages; also move the books' updated_at forward for Last-Modified."""
+    if not reverse:
+        book_ids = [instance.pk] if action in ('post_add', 'post_remove', 'post_clear') else []
+    elif action == 'post_clear':
+        # Books remembered by reindex_book_genres at pre_clear
+        book_ids = getattr(instance, '_search_book_ids', [])
+    elif action in ('post_add', 'post_remove'):
+        book_ids = pk_set
+    else:
+        book_ids = []
+    if book_ids:
+        invalidate('book', book_ids)
+        Book.objects.filter(pk__in=book_ids).update(updated_at=Now())
+
+
+# Cached permission sets (see catalog/permissions.py)
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user_permissions(sender, instance, update_fields, **kwargs):
+    """The superuser and active flags decide a user's permissions too (logging in only saves last_login)."""
+    if update_fields is None or {'is_superuser', 'is_active'} & update_fields:
+        invalidate_permissions([instance.pk])
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_assigned_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    """Permissions or groups given to or taken from users, from either side."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_permissions([instance.pk])
+    elif action == 'post_clear':
+        # The users that had this permission or group are not known any more
+        invalidate_permissions()
+    else:
+        invalidate_permissions(pk_set)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_permissions()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_deleted_permissions(sender, **kwargs):
+    invalidate_permissions()
@@ -0,0 +1,91 @@
+"""Dashboard statistics for the catalog home page.
+
+All of the numbers shown on the index page are computed with conditional
+counts in a single database round trip and cached for a short time. The
+cache entry is dropped whenever a Book, BookInstance, Genre or Author is
+saved or deleted (see catalog/signals.py), and refilled from the primary
+database.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Value
+
+from .models import Author, Book, BookInstance, Genre
+from .replicas import primary_reads
+
+STATS_CACHE_KEY = 'catalog:dashboard-stats'
+
+# Words counted on the home page
+GENRE_WORD = 'fiction'
+BOOK_WORD = 'secret'
+
+
+def _tally(queryset, table, matching=None):
+    """Return a one-row queryset with the total and the conditional count for a table."""
+    return (
+        queryset.order_by()
+        .annotate(table=Value(table))
+        .values('table')
+        .annotate(total=Count('pk'), matching=Count('pk', filter=matching))
+    )
+
+
+def dashboard_rows(genre_word=GENRE_WORD, book_word=BOOK_WORD):
+    """One UNION of conditional aggregates giving a row of counts per table."""
+    return _tally(Book.objects.all(), 'book', Q(title__icontains=book_word)).union(
+        _tally(BookInstance.objects.all(), 'bookinstance', Q(status__exact='a')),
+        _tally(Author.objects.all(), 'author'),
+        _tally(Genre.objects.all(), 'genre', Q(name__icontains=genre_word)),
+        all=True,
+    )
+
+
+def _dashboard_stats(rows, genre_word, book_word):
+    counts = {row['table']: row for row in rows}
+
+    return {
+        'num_books': counts['book']['total'],
+        'num_books_with_word': counts['book']['matching'],
+        'num_instances': counts['bookinstance']['total'],
+        'num_instances_available': counts['bookinstance']['matching'],
+        'num_authors': counts['author']['total'],
+        'num_genres_with_word': counts['genre']['matching'],
+        'genre_word': genre_word,
+        'book_word': book_word,
+    }
+
+
+def compute_dashboard_stats(genre_word=GENRE_WORD, book_word=BOOK_WORD):
+    """Compute the home page counts using one UNION of conditional aggregates."""
+    return _dashboard_stats(dashboard_rows(genre_word, book_word), genre_word, book_word)
+
+
+async def acompute_dashboard_stats(genre_word=GENRE_WORD, book_word=BOOK_WORD):
+    rows = [row async for row in dashboard_rows(genre_word, book_word)]
+    return _dashboard_stats(rows, genre_word, book_word)
+
+
+def get_dashboard_stats():
+    """Return the cached home page counts, computing them on a cache miss."""
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        with primary_reads():
+            stats = compute_dashboard_stats()
+        cache.set(STATS_CACHE_KEY, stats, settings.CATALOG_STATS_CACHE_TIMEOUT)
+    return stats
+
+
+async def aget_dashboard_stats():
+    """Async version of get_dashboard_stats()."""
+    stats = await cache.aget(STATS_CACHE_KEY)
+    if stats is None:
+        with primary_reads():
+            stats = await acompute_dashboard_stats()
+        await cache.aset(STATS_CACHE_KEY, stats, settings.CATALOG_STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def invalidate_dashboard_stats():
+    """Drop the cached counts so the next home page hit recomputes them."""
+    cache.delete(STATS_CACHE_KEY)
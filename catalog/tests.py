@@ -1,3 +1,1500 @@
 from django.test import TestCase
 
 # Create your tests here.
+
+import datetime
+
+from django.contrib.auth.models import Permission, User
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance, Genre
+
+
+def create_catalog(num_books, copies_per_book=2, borrower=None):
+    """Create num_books books (each with its own author and copies on loan) and return the books."""
+    genre = Genre.objects.create(name=f'Genre {Genre.objects.count()}')
+    due_back = datetime.date.today() + datetime.timedelta(days=5)
+    books = []
+    for i in range(num_books):
+        author = Author.objects.create(first_name=f'First {i}', last_name=f'Last {i}')
+        book = Book.objects.create(
+            title=f'Book {i}',
+            author=author,
+            summary='Summary',
+            isbn=f'{Book.objects.count():013d}',
+        )
+        book.genre.add(genre)
+        for _ in range(copies_per_book):
+            BookInstance.objects.create(
+                book=book, imprint='Imprint', due_back=due_back, borrower=borrower, status='o'
+            )
+        books.append(book)
+    return books
+
+
+def login_admin(client):
+    """Sign client in as a superuser, who may use every write endpoint of the API."""
+    client.force_login(User.objects.create_superuser(username='admin'))
+
+
+class ListViewQueryCountTest(TestCase):
+    """The list and detail views run a fixed number of queries regardless of row count."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.user.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.user.is_staff = True
+        cls.user.save()
+
+    def assertConstantQueries(self, url, num, login=False):
+        """Request url with 1 and then 5 books in the catalog and check the query count."""
+        if login:
+            # Warm up the caches the view reads
+            self.client.force_login(self.user)
+            self.client.get(url)
+        for num_books in (1, 4):
+            create_catalog(num_books, borrower=self.user)
+            if login:
+                self.client.force_login(self.user)
+            with self.assertNumQueries(num):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_book_list(self):
+        # Last-Modified (once per change) + one keyset page of books joined to authors
+        self.assertConstantQueries(reverse('books'), 2)
+
+    def test_author_list(self):
+        # Last-Modified (once per change) + cursor pagination: a single keyset query, no COUNT
+        self.assertConstantQueries(reverse('authors'), 2)
+
+    def test_author_detail(self):
+        author = Author.objects.create(first_name='Many', last_name='Books')
+        url = reverse('author-detail', args=[author.pk])
+        for num_books in (1, 4):
+            for book in create_catalog(num_books):
+                book.author = author
+                book.save()
+            # Last-Modified (once per change) + author + books
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '(2)')
+
+    def test_book_detail(self):
+        book = create_catalog(1, copies_per_book=1)[0]
+        url = reverse('book-detail', args=[book.pk])
+        # Last-Modified (once per change) + book joined to author + genres + copies
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        for _ in range(5):
+            BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+    def test_loaned_books_by_user(self):
+        # Session + user + the user's and their groups' permissions (only cached
+        # across requests in a shared cache) + copies joined to books
+        self.assertConstantQueries(reverse('my-borrowed'), 5, login=True)
+
+    def test_loaned_books_all_users(self):
+        # Session + user + permissions + copies joined to books and borrowers
+        self.assertConstantQueries(reverse('all-borrowed'), 5, login=True)
+
+
+from django.db import connection
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgreSQLWrapper
+
+from catalog.pagination import BOOKINSTANCE_ORDERING, CursorPaginator, InvalidCursor
+
+
+class CursorPaginatorTest(TestCase):
+    """Walking cursor pages visits every row exactly once, in order, in both directions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        book = create_catalog(1, copies_per_book=0)[0]
+        today = datetime.date.today()
+        # Repeated and NULL due dates exercise the tie-breaker and NULL ordering
+        for i in range(23):
+            due_back = None if i % 5 == 0 else today + datetime.timedelta(days=i % 4)
+            BookInstance.objects.create(book=book, imprint='Imprint', due_back=due_back, status='o')
+
+    def walk(self, paginator, cursor=None, backwards=False):
+        pages = []
+        while True:
+            page = paginator.page(cursor)
+            pages.append([copy.pk for copy in page])
+            cursor = page.previous_cursor if backwards else page.next_cursor
+            if cursor is None:
+                return pages
+
+    def test_walk_forwards_and_backwards(self):
+        expected = [copy.pk for copy in sorted(
+            BookInstance.objects.all(),
+            key=lambda copy: (copy.due_back is not None, copy.due_back or datetime.date.min, copy.pk),
+        )]
+        paginator = CursorPaginator(BookInstance.objects.all(), BOOKINSTANCE_ORDERING, 5)
+        forwards = self.walk(paginator)
+        self.assertEqual([len(page) for page in forwards], [5, 5, 5, 5, 3])
+        self.assertEqual(sum(forwards, []), expected)
+
+        last_page = paginator.page(paginator.page().next_cursor)
+        for _ in range(3):
+            last_page = paginator.page(last_page.next_cursor)
+        self.assertFalse(last_page.has_next())
+        backwards = self.walk(paginator, last_page.previous_cursor, backwards=True)
+        self.assertEqual(sum(reversed(backwards), []), expected[:20])
+
+    def test_count_is_optional(self):
+        paginator = CursorPaginator(BookInstance.objects.all(), BOOKINSTANCE_ORDERING, 5)
+        self.assertIsNone(paginator.count)
+        paginator = CursorPaginator(BookInstance.objects.all(), BOOKINSTANCE_ORDERING, 5, with_count=True)
+        self.assertEqual(paginator.count, 23)
+
+    def test_invalid_cursor(self):
+        paginator = CursorPaginator(BookInstance.objects.all(), BOOKINSTANCE_ORDERING, 5)
+        with self.assertRaises(InvalidCursor):
+            paginator.page('not-a-cursor')
+
+    def test_indexes_match_null_ordering(self):
+        postgresql = PostgreSQLWrapper(dict(connection.settings_dict, NAME='catalog'))
+        index = next(index for index in BookInstance._meta.indexes if index.name == 'bookinst_due_back_id_idx')
+        with postgresql.schema_editor(collect_sql=True, atomic=False) as editor:
+            self.assertIn('("due_back" ASC NULLS FIRST, "id")', str(index.create_sql(BookInstance, editor)))
+        # Only the nullable column is ordered NULLS FIRST, like in the index
+        paginator = CursorPaginator(BookInstance.objects.all(), BOOKINSTANCE_ORDERING, 5)
+        query = str(BookInstance.objects.order_by(*paginator._order_by(backwards=False)).query)
+        self.assertIn('"due_back" ASC NULLS FIRST, "catalog_bookinstance"."id" ASC', query)
+
+
+import json
+from unittest import mock
+
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from catalog.models import COPY_COUNTERS
+
+
+class BulkApiTest(TestCase):
+    """The /bulk endpoints write whole batches and report a result per item."""
+
+    def setUp(self):
+        login_admin(self.client)
+
+    def send(self, method, url, data):
+        response = getattr(self.client, method)(url, json.dumps(data), content_type='application/json')
+        return response.status_code, response.json()
+
+    def test_bulk_create_books(self):
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        genre = Genre.objects.create(name='Fantasy')
+        payload = [
+            {'title': f'Book {i}', 'author_id': author.pk, 'summary': 'Summary',
+             'isbn': f'{i:013d}', 'genre_ids': [genre.pk]}
+            for i in range(20)
+        ]
+        payload.append(dict(payload[0], isbn='9999999999999', author_id=author.pk + 1))
+        payload.append(dict(payload[0]))
+
+        # Session and user + author, genre and ISBN lookups + book, genre and search index writes in a savepoint
+        with self.assertNumQueries(11):
+            status, results = self.send('post', '/api/books/bulk', payload)
+
+        self.assertEqual(status, 200)
+        self.assertTrue(all(result['success'] for result in results[:20]))
+        self.assertEqual(results[20]['message'], f'Author {author.pk + 1} not found')
+        self.assertEqual(results[21]['message'], 'Book with this ISBN already exists')
+        self.assertEqual(Book.objects.count(), 20)
+        self.assertEqual(genre.book_set.count(), 20)
+
+    def test_bulk_update_and_delete_book_instances(self):
+        book = create_catalog(1, copies_per_book=3)[0]
+        ids = [str(pk) for pk in book.bookinstance_set.values_list('id', flat=True)]
+        status, results = self.send('put', '/api/book_instances/bulk', [
+            {'id': pk, 'book_id': book.pk, 'imprint': 'Reprint', 'status': 'a'} for pk in ids
+        ])
+        self.assertEqual(status, 200)
+        self.assertEqual(BookInstance.objects.filter(imprint='Reprint', status='a').count(), 3)
+
+        status, results = self.send('delete', '/api/book_instances/bulk', {'ids': ids[:2]})
+        self.assertEqual([result['success'] for result in results], [True, True])
+        self.assertEqual(BookInstance.objects.count(), 1)
+
+    def test_bulk_delete_book_instances_recounts_once(self):
+        counts = []
+        for num_copies in (2, 6):
+            book = create_catalog(1, copies_per_book=num_copies)[0]
+            ids = [str(pk) for pk in book.bookinstance_set.values_list('id', flat=True)]
+            with CaptureQueriesContext(connection) as queries:
+                status, results = self.send('delete', '/api/book_instances/bulk', {'ids': ids})
+            self.assertEqual(status, 200)
+            counts.append(len(queries))
+            book.refresh_from_db()
+            self.assertEqual([getattr(book, field) for field in COPY_COUNTERS], [0] * len(COPY_COUNTERS))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_bulk_delete_referenced_rows(self):
+        book = create_catalog(1, copies_per_book=1)[0]
+        unused = Author.objects.create(first_name='Unused', last_name='Author')
+        status, results = self.send('delete', '/api/authors/bulk', {'ids': [book.author_id, unused.pk]})
+        self.assertEqual(status, 200)
+        self.assertEqual([result['success'] for result in results], [False, True])
+        self.assertEqual(results[0]['message'], f'Referenced by book {book.pk}')
+        self.assertEqual(list(Author.objects.all()), [book.author])
+
+    def test_bulk_borrower_zero_means_none(self):
+        book = create_catalog(1, copies_per_book=0)[0]
+        status, results = self.send('post', '/api/book_instances/bulk', [
+            {'book_id': book.pk, 'imprint': 'Imprint', 'borrower_id': 0, 'status': 'a'},
+        ])
+        self.assertEqual(status, 200)
+        copy = BookInstance.objects.get()
+        self.assertIsNone(copy.borrower_id)
+        status, results = self.send('put', '/api/book_instances/bulk', [
+            {'id': str(copy.pk), 'book_id': book.pk, 'imprint': 'Reprint', 'borrower_id': 0, 'status': 'a'},
+        ])
+        self.assertEqual((status, results[0]['success']), (200, True))
+
+    def test_permissions(self):
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        self.client.logout()
+        self.assertEqual(self.send('delete', '/api/authors/bulk', {'ids': [author.pk]})[0], 401)
+        user = User.objects.create_user(username='reader')
+        self.client.force_login(user)
+        self.assertEqual(self.send('delete', '/api/authors/bulk', {'ids': [author.pk]})[0], 403)
+        user.user_permissions.add(Permission.objects.get(codename='delete_author'))
+        # Session-authenticated writes need the CSRF token
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.force_login(user)
+        response = csrf_client.delete('/api/authors/bulk', json.dumps({'ids': [author.pk]}),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.send('delete', '/api/authors/bulk', {'ids': [author.pk]})[0], 200)
+        self.assertFalse(Author.objects.exists())
+
+    def test_concurrent_conflict(self):
+        Genre.objects.create(name='Fantasy')
+        # As if another request created the genre between validation and the INSERT
+        with mock.patch('local_library.api.check_unique_names'):
+            status, result = self.send('post', '/api/genres/bulk', [{'name': 'Gothic'}, {'name': 'Fantasy'}])
+        self.assertEqual(status, 409)
+        self.assertFalse(Genre.objects.filter(name='Gothic').exists())
+
+
+import gzip
+
+
+class ExportTest(TestCase):
+    """The catalog export streams every row in the requested format."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(3)
+        cls.staff = User.objects.create_user(username='staff', password='1X<ISRUkw+tuK', is_staff=True)
+
+    def test_export_requires_staff(self):
+        self.assertEqual(self.client.get('/api/export/books').status_code, 403)
+
+    def test_export_books_ndjson(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/export/books')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['author'], 'Last 0, First 0')
+        self.assertEqual(json.loads(lines[0])['genres'], ['Genre 0'])
+
+    def test_export_book_instances_gzipped_csv(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/export/book_instances?format=csv&compress=true')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(lines[0], 'id,book_id,imprint,due_back,status,borrower_id')
+        self.assertEqual(len(lines), 7)
+
+
+import csv
+import os
+import io
+import tempfile
+
+from django.core.management import call_command
+
+from catalog.importer import is_valid_isbn, marc_units
+
+
+def isbn13(n):
+    """Return a valid ISBN-13 built from the number n."""
+    digits = f'978{n:09d}'
+    check = -sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(digits)) % 10
+    return f'{digits}{check}'
+
+
+def marc_record(fields):
+    """Build one ISO 2709 record from [(tag, [(code, value), ...]), ...]."""
+    directory = b''
+    data = b''
+    for tag, subfields in fields:
+        field = b'  ' + b''.join(b'\x1f' + code.encode() + value.encode() for code, value in subfields) + b'\x1e'
+        directory += f'{tag}{len(field):04d}{len(data):05d}'.encode()
+        data += field
+    base = 24 + len(directory) + 1
+    length = base + len(data) + 1
+    leader = f'{length:05d}nam a22{base:05d} a 4500'.encode()
+    return leader + directory + b'\x1e' + data + b'\x1d'
+
+
+class ImportCatalogTest(TestCase):
+    """import_catalog writes books, authors, genres and copies in bulk and skips known ISBNs."""
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+        return path
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_import_csv(self):
+        Genre.objects.create(name='Fantasy')
+        path = self.write('books.csv', (
+            'title,author,summary,isbn,genres,copies\n'
+            'A Wizard of Earthsea,"Le Guin, Ursula",Summary,978-0-553-38304-1,fantasy; Coming of age,2\n'
+            'The Tombs of Atuan,"Le Guin, Ursula",Summary,9780689845369,Fantasy,1\n'
+            'Duplicate,"Le Guin, Ursula",Summary,9780553383041,Fantasy,1\n'
+            ',No title,Summary,9780000000000,,1\n'
+        ))
+        call_command('import_catalog', path, stdout=io.StringIO())
+
+        self.assertEqual(Book.objects.count(), 2)
+        self.assertEqual(Author.objects.get().last_name, 'Le Guin')
+        self.assertEqual(Genre.objects.count(), 2)
+        self.assertEqual(BookInstance.objects.count(), 3)
+        book = Book.objects.get(isbn='9780553383041')
+        self.assertEqual(sorted(genre.name for genre in book.genre.all()), ['Coming of age', 'Fantasy'])
+        self.assertEqual((book.copies_total, book.copies_maintenance), (2, 2))
+
+    def test_import_marc(self):
+        path = self.write('books.mrc', b''.join([
+            marc_record([
+                ('020', [('a', '9780553383041 (pbk.)')]),
+                ('100', [('a', 'Le Guin, Ursula K.,')]),
+                ('245', [('a', 'A wizard of Earthsea /')]),
+                ('650', [('a', 'Wizards.')]),
+                ('650', [('a', 'Fantasy.')]),
+            ]),
+            marc_record([('020', [('a', '9780689845369')]), ('245', [('a', 'The tombs of Atuan')])]),
+        ]))
+        with open(path, 'rb') as f:
+            self.assertEqual(len(list(marc_units(f))), 2)
+        call_command('import_catalog', path, stdout=io.StringIO())
+
+        book = Book.objects.get(isbn='9780553383041')
+        self.assertEqual(book.title, 'A wizard of Earthsea')
+        self.assertEqual(str(book.author), 'Le Guin, Ursula K.')
+        self.assertEqual(book.genre.count(), 2)
+        self.assertIsNone(Book.objects.get(isbn='9780689845369').author)
+
+    def test_malformed_units_are_rejected(self):
+        good = marc_record([('020', [('a', '9780553383041')]), ('245', [('a', 'A wizard of Earthsea')])])
+        bad_leader = b'0x123nam a2200000 a 4500' + b'garbage\x1e\x1d'
+        path = self.write('books.mrc', good + bad_leader
+                          + marc_record([('020', [('a', '9780689845369')]), ('245', [('a', 'The tombs of Atuan')])])
+                          + b'00042nam')
+        stdout = io.StringIO()
+        call_command('import_catalog', path, stdout=stdout)
+        self.assertEqual(Book.objects.count(), 2)
+        self.assertIn('2 errors', stdout.getvalue())
+
+        path = self.write('books.csv', (
+            'title,isbn\n'
+            f'"{"x" * (csv.field_size_limit() + 1)}",9780000000002\n'
+            'The Farthest Shore,9780689845345\n'
+        ))
+        stdout = io.StringIO()
+        call_command('import_catalog', path, stdout=stdout)
+        self.assertTrue(Book.objects.filter(isbn='9780689845345').exists())
+        self.assertIn('1 errors', stdout.getvalue())
+
+    def test_resume_from_checkpoint(self):
+        lines = [json.dumps({'title': f'Book {i}', 'isbn': isbn13(i), 'genres': ['Poetry']}) for i in range(10)]
+        path = self.write('books.ndjson', '\n'.join(lines))
+        checkpoint = self.write('books.checkpoint', json.dumps({'consumed': 4}))
+        call_command('import_catalog', path, '--checkpoint', checkpoint, '--batch-size', '3',
+                     stdout=io.StringIO())
+
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)),
+                         [f'Book {i}' for i in range(4, 10)])
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_isbn_check_digit(self):
+        self.assertTrue(is_valid_isbn('9780553383041'))
+        self.assertTrue(is_valid_isbn('080442957X'))
+        self.assertFalse(is_valid_isbn('9780553383042'))
+        self.assertFalse(is_valid_isbn('0000000001'))
+
+    def test_workers_import_identically(self):
+        lines = [
+            json.dumps({'title': f'Book {i}', 'author': f'Author {i % 7}, First', 'isbn': isbn13(i),
+                        'genres': [f'Genre {i % 5}'], 'copies': i % 3})
+            for i in range(200)
+        ]
+        lines.insert(50, json.dumps({'title': 'Bad checksum', 'isbn': '9780000000001'}))
+        lines.insert(60, '{not json')
+        path = self.write('books.ndjson', '\n'.join(lines))
+
+        def import_and_snapshot(*args):
+            call_command('import_catalog', path, '--batch-size', '64', *args, stdout=io.StringIO())
+            snapshot = (
+                list(Book.objects.order_by('pk').values_list('isbn', 'author__last_name')),
+                list(Book.genre.through.objects.order_by('pk').values_list('book__isbn', 'genre__name')),
+                BookInstance.objects.count(),
+            )
+            BookInstance.objects.all().delete()
+            Book.objects.all().delete()
+            Author.objects.all().delete()
+            Genre.objects.all().delete()
+            return snapshot
+
+        single = import_and_snapshot()
+        self.assertEqual(len(single[0]), 200)
+        self.assertEqual(single, import_and_snapshot('--workers', '2'))
+
+
+from catalog.search import search_books
+
+
+class SearchTest(TestCase):
+    """The search index follows changes to books, authors and genres."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        cls.wizard = Book.objects.create(
+            title='A Wizard of Earthsea', author=cls.author, isbn='9780553383041',
+            summary='A young mage on the island of Gont.',
+        )
+        cls.wizard.genre.add(cls.fantasy)
+        cls.tombs = Book.objects.create(
+            title='The Tombs of Atuan', author=cls.author, isbn='9780689845369',
+            summary='Tenar, priestess of the Nameless Ones, meets a wizard.',
+        )
+
+    def titles(self, query):
+        return [book.title for book in search_books(query)]
+
+    def test_ranked_prefix_search(self):
+        # A title match outranks a summary match; 'wiz' matches as a prefix
+        self.assertEqual(self.titles('wiz'), ['A Wizard of Earthsea', 'The Tombs of Atuan'])
+        self.assertEqual(self.titles('guin tomb'), ['The Tombs of Atuan'])
+        self.assertEqual(self.titles('fantasy'), ['A Wizard of Earthsea'])
+        self.assertEqual(self.titles('dragons'), [])
+
+    def test_index_follows_changes(self):
+        self.author.last_name = 'LeGuin'
+        self.author.save()
+        self.assertEqual(len(self.titles('leguin')), 2)
+
+        self.fantasy.book_set.add(self.tombs)
+        self.assertEqual(len(self.titles('fantasy')), 2)
+        self.tombs.genre.clear()
+        self.assertEqual(self.titles('fantasy'), ['A Wizard of Earthsea'])
+
+        self.fantasy.delete()
+        self.assertEqual(self.titles('fantasy'), [])
+
+        self.wizard.delete()
+        self.assertEqual(self.titles('wizard'), ['The Tombs of Atuan'])
+
+    def test_search_view_and_api(self):
+        response = self.client.get(reverse('search'), {'q': 'earthsea'})
+        self.assertContains(response, 'A Wizard of Earthsea')
+        response = self.client.get('/api/search', {'q': 'atuan'})
+        self.assertEqual(response.json()[0]['author'], 'Le Guin, Ursula')
+
+
+class CopyCounterTest(TestCase):
+    """Book copy counters follow BookInstance creates, status/book changes and deletes."""
+
+    def counts(self, book):
+        book.refresh_from_db()
+        return (book.copies_total, book.copies_available, book.copies_on_loan,
+                book.copies_reserved, book.copies_maintenance)
+
+    def test_counters_follow_copies(self):
+        book, other = create_catalog(2, copies_per_book=0)
+        copy = BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=book, imprint='Imprint')
+        self.assertEqual(self.counts(book), (2, 1, 0, 0, 1))
+
+        copy = BookInstance.objects.get(pk=copy.pk)
+        copy.status = 'o'
+        copy.save()
+        self.assertEqual(self.counts(book), (2, 0, 1, 0, 1))
+
+        copy.book = other
+        copy.status = 'r'
+        copy.save()
+        self.assertEqual(self.counts(book), (1, 0, 0, 0, 1))
+        self.assertEqual(self.counts(other), (1, 0, 0, 1, 0))
+
+        BookInstance.objects.filter(book=book).delete()
+        self.assertEqual(self.counts(book), (0, 0, 0, 0, 0))
+
+    def test_stale_copy_does_not_drift(self):
+        book = create_catalog(1, copies_per_book=0)[0]
+        copy = BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        stale = BookInstance.objects.get(pk=copy.pk)
+        # Another request lends the copy after this one loaded it
+        copy.status = 'o'
+        copy.save()
+        stale.status = 'm'
+        stale.save()
+        self.assertEqual(self.counts(book), (1, 0, 0, 0, 1))
+
+    def test_recount_repairs_counters(self):
+        book = create_catalog(1, copies_per_book=3)[0]
+        Book.objects.update(copies_total=0, copies_on_loan=0)
+        call_command('recount_copies', stdout=io.StringIO())
+        self.assertEqual(self.counts(book), (3, 0, 3, 0, 0))
+
+
+from catalog.benchmark import compare_reports, default_targets, run_benchmark
+from catalog.percentiles import percentile
+from catalog.models import Language
+from django.db.models import Q
+
+
+class SeedLibraryTest(TestCase):
+    """seed_library generates a consistent, reproducible catalog."""
+
+    def test_seed_library(self):
+        call_command('seed_library', authors=20, books=100, borrowers=10, genres=5, languages=3,
+                     stdout=io.StringIO())
+        self.assertEqual(Author.objects.count(), 20)
+        self.assertEqual(Book.objects.count(), 100)
+        self.assertEqual(Genre.objects.count(), 5)
+        self.assertEqual(Language.objects.filter(book_instance__isnull=False).count(), 3)
+        self.assertFalse(Book.objects.filter(genre__isnull=True).exists())
+        self.assertTrue(all(is_valid_isbn(isbn) for isbn in Book.objects.values_list('isbn', flat=True)))
+        # Counters are up to date and loans have a borrower and a due date
+        self.assertEqual(sum(Book.objects.values_list('copies_total', flat=True)), BookInstance.objects.count())
+        loans = BookInstance.objects.filter(status='o')
+        self.assertTrue(loans.exists())
+        self.assertFalse(loans.filter(Q(borrower__isnull=True) | Q(due_back__isnull=True)).exists())
+
+        # Seeding again adds a second catalog without name or ISBN clashes
+        titles = list(Book.objects.order_by('pk').values_list('title', flat=True))
+        call_command('seed_library', authors=20, books=100, borrowers=10, genres=5, languages=3,
+                     stdout=io.StringIO())
+        self.assertEqual(Book.objects.count(), 200)
+        self.assertEqual(list(Book.objects.order_by('pk').values_list('title', flat=True)[100:]), titles)
+
+
+class BenchmarkTest(TestCase):
+    """The benchmark harness reports latency percentiles and queries per request."""
+
+    def test_percentile(self):
+        self.assertEqual(percentile([4, 1, 3, 2], 50), 2.5)
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 100), 5)
+        self.assertIsNone(percentile([], 95))
+
+    def test_run_and_compare(self):
+        create_catalog(3)
+        targets = [('book-list', [reverse('books')], None), ('missing', ['/no-such-page/'], None)]
+        report = run_benchmark(targets, iterations=5, warmup=1)
+        result = report['results']['book-list']
+        self.assertEqual((result['requests'], result['errors'], result['queries_per_request']), (5, 0, 1))
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(report['results']['missing']['errors'], 5)
+        json.dumps(report)
+
+        rows = {(name, field): change for name, field, old, new, change in compare_reports(report, report)}
+        self.assertEqual(rows[('book-list', 'queries_per_request')], 0)
+
+    def test_default_targets_succeed(self):
+        create_catalog(3)
+        for name, urls, user in default_targets():
+            if user is not None:
+                self.client.force_login(user)
+            for url in urls:
+                self.assertEqual(self.client.get(url).status_code, 200, name)
+            self.client.logout()
+
+
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from catalog.instrumentation import RequestInstrumentationMiddleware, stats as request_stats
+
+
+@override_settings(CATALOG_INSTRUMENTATION_SAMPLE_RATE=1.0, CATALOG_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD=3,
+                   CATALOG_SERVER_TIMING=True)
+class InstrumentationTest(TestCase):
+    """Sampled requests get Server-Timing headers, JSON log records and per-view totals."""
+
+    def setUp(self):
+        request_stats.reset()
+
+    def test_server_timing_and_log(self):
+        create_catalog(2)
+        with self.assertLogs('catalog.requests', 'INFO') as logs:
+            response = self.client.get(reverse('books'))
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="2 queries"', timing)
+        self.assertIn('tpl;dur=', timing)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['view'], record['status'], record['queries']), ('books', 200, 2))
+        self.assertEqual(record['bytes'], len(response.content))
+        self.assertEqual(record['n_plus_one'], [])
+
+    def test_flags_n_plus_one(self):
+        create_catalog(4)
+
+        def view(request):
+            # One author query per book
+            return HttpResponse(', '.join(str(book.author) for book in Book.objects.all()))
+
+        with self.assertLogs('catalog.requests', 'WARNING') as logs:
+            RequestInstrumentationMiddleware(view)(RequestFactory().get('/'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['queries'], 5)
+        self.assertEqual(record['n_plus_one'][0]['count'], 4)
+        self.assertEqual(record['duplicates'], [])
+
+    @override_settings(CATALOG_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled(self):
+        response = self.client.get(reverse('books'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(request_stats.summary(), [])
+
+    @override_settings(CATALOG_SERVER_TIMING=False)
+    def test_server_timing_off(self):
+        with self.assertLogs('catalog.requests', 'INFO'):
+            response = self.client.get(reverse('books'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_stats_endpoint(self):
+        create_catalog(1)
+        self.client.get(reverse('books'))
+        self.client.get(reverse('books'))
+        self.assertEqual(self.client.get('/api/instrumentation').status_code, 403)
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        rows = {row['view']: row for row in self.client.get('/api/instrumentation').json()}
+        self.assertEqual(rows['books']['requests'], 2)
+        self.assertEqual(rows['books']['mean_queries'], 1.5)
+        self.client.get('/api/instrumentation', {'reset': True})
+        self.assertNotIn('books', {row['view'] for row in self.client.get('/api/instrumentation').json()})
+
+
+import time
+
+from django.core.cache import cache
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+
+from catalog.pagecache import page_cache_timeout, version_timeout
+
+
+class PageCacheTest(TestCase):
+    """Detail pages are served from cache until the objects they show change."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_page_cache(self):
+        book, other = create_catalog(2, copies_per_book=1)
+        url = reverse('book-detail', args=[book.pk])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, '0 available, 1 on loan')
+
+        # Moving a copy to another book invalidates both books and their authors
+        copy = BookInstance.objects.get(book=book)
+        author_url = reverse('author-detail', args=[book.author_id])
+        self.assertContains(self.client.get(author_url), '(1)')
+        self.client.get(reverse('book-detail', args=[other.pk]))
+        copy.book = other
+        copy.save()
+        self.assertContains(self.client.get(url), '0 available, 0 on loan')
+        self.assertContains(self.client.get(reverse('book-detail', args=[other.pk])), str(copy.pk))
+        self.assertContains(self.client.get(author_url), '(0)')
+
+    def test_related_changes_invalidate(self):
+        book = create_catalog(1)[0]
+        url = reverse('book-detail', args=[book.pk])
+        self.client.get(url)
+        genre = book.genre.get()
+        genre.name = 'Renamed genre'
+        genre.save()
+        self.assertContains(self.client.get(url), 'Renamed genre')
+        book.author.last_name = 'Renamed'
+        book.author.save()
+        self.assertContains(self.client.get(url), 'Renamed, First 0')
+        Book.objects.get(pk=book.pk).genre.clear()
+        self.assertNotContains(self.client.get(url), 'Renamed genre')
+
+    def test_process_local_cache_expires(self):
+        book = create_catalog(1)[0]
+        url = reverse('book-detail', args=[book.pk])
+        self.client.get(url)
+        # Changed by a process whose invalidation this process's LocMemCache does not see
+        Book.objects.filter(pk=book.pk).update(title='Retitled')
+        self.assertNotContains(self.client.get(url), 'Retitled')
+        with mock.patch('time.time', return_value=time.time() + version_timeout() + 1):
+            self.assertContains(self.client.get(url), 'Retitled')
+
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=redis, CATALOG_PAGE_CACHE_TIMEOUT=3600):
+            self.assertEqual((version_timeout(), page_cache_timeout()), (None, 3600))
+
+    def test_fragments_for_logged_in_users(self):
+        book = create_catalog(1)[0]
+        reader = User.objects.create_user(username='reader')
+        reader.user_permissions.add(Permission.objects.get(codename='change_bookinstance'))
+        self.client.force_login(reader)
+        url = reverse('book-detail', args=[book.pk])
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        # Last-Modified is cached and the genres and copies come from the cached fragment
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(url)
+        self.assertEqual(len(second), len(first) - 3)
+        self.assertContains(response, '0 available, 2 on loan')
+
+        self.client.put('/api/book_instances/bulk', [
+            {'id': str(copy.pk), 'book_id': book.pk, 'imprint': 'Imprint', 'status': 'a'}
+            for copy in book.bookinstance_set.all()
+        ], content_type='application/json')
+        self.assertContains(self.client.get(url), '2 available, 0 on loan')
+
+
+class ConditionalGetTest(TestCase):
+    """Pages and API reads answer If-None-Match / If-Modified-Since with 304 when nothing changed."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_book_detail(self):
+        book = create_catalog(1)[0]
+        url = reverse('book-detail', args=[book.pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Logged-in users see a different page
+        etag = response['ETag']
+        self.client.force_login(User.objects.create_user(username='reader'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_if_modified_since(self):
+        create_catalog(2)
+        url = reverse('authors')
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT').status_code, 200
+        )
+
+    def test_api_reads(self):
+        book = create_catalog(1)[0]
+        copy = book.bookinstance_set.first()
+        genre = book.genre.get()
+        for url in [f'/api/author/{book.author_id}', f'/api/genre/{genre.pk}', '/api/authors',
+                    '/api/book_instances?status=o', f'/api/book_instance/{copy.pk}']:
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, url)
+
+        url = f'/api/genre/{genre.pk}'
+        etag = self.client.get(url)['ETag']
+        genre.name = 'Renamed'
+        genre.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['name'], 'Renamed')
+
+    def test_bulk_writes(self):
+        book = create_catalog(1)[0]
+        url = '/api/books'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(reverse('index')).context['num_books'], 1)
+
+        login_admin(self.client)
+        self.client.post('/api/books/bulk', [
+            {'title': 'Bulk', 'author_id': book.author_id, 'summary': 'Summary', 'isbn': '9999999999999',
+             'genre_ids': []},
+        ], content_type='application/json')
+        self.assertEqual(len(self.client.get(url, HTTP_IF_NONE_MATCH=etag).json()['items']), 2)
+        self.assertEqual(self.client.get(reverse('index')).context['num_books'], 2)
+
+    def test_copy_list_changes_with_the_date(self):
+        create_catalog(1)
+        url = '/api/book_instances'
+        etag = self.client.get(url)['ETag']
+        # is_overdue turns true without any row changing
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        with mock.patch('local_library.api.date', wraps=datetime.date) as date:
+            date.today.return_value = tomorrow
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+from django.test import AsyncRequestFactory
+from django.urls import include, path
+
+from catalog import urls as catalog_urls
+from local_library import urls as project_urls
+from local_library.api import BookInstanceOut, BookOut, aget_author, aget_book, aget_book_instance, alist_authors
+
+# The site with the catalog's async read views, as served under ASGI
+urlpatterns = [path('catalog/', include(catalog_urls.async_urlpatterns))] + project_urls.urlpatterns
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewsTest(TestCase):
+    """The async read pages and API endpoints answer like the sync ones."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = create_catalog(2)[0]
+        cls.user = User.objects.create_user(username='reader')
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_pages(self):
+        response = await self.async_client.get(reverse('index'))
+        self.assertContains(response, '<strong>Books:</strong> 2')
+        self.assertContains(await self.async_client.get(reverse('books')), 'Book 1')
+        self.assertContains(await self.async_client.get(reverse('authors')), 'Last 0')
+        self.assertContains(await self.async_client.get(reverse('author-detail', args=[self.book.author_id])), 'Book 0')
+        self.assertEqual((await self.async_client.get(reverse('book-detail', args=[999]))).status_code, 404)
+
+        url = reverse('book-detail', args=[self.book.pk])
+        response = await self.async_client.get(url)
+        self.assertContains(response, '0 available, 2 on loan')
+        cached = await self.async_client.get(url)
+        not_modified = await self.async_client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(not_modified.status_code, 304)
+
+        await self.async_client.aforce_login(self.user)
+        self.assertContains(await self.async_client.get(url), 'User: reader')
+
+    async def test_api_reads(self):
+        response = HttpResponse()
+        author = await aget_author(AsyncRequestFactory().get('/'), response, self.book.author_id)
+        self.assertEqual(author, self.book.author)
+        request = AsyncRequestFactory().get('/', headers={'if-none-match': response['ETag']})
+        self.assertEqual((await aget_author(request, HttpResponse(), self.book.author_id)).status_code, 304)
+
+        page = await alist_authors(AsyncRequestFactory().get('/'), HttpResponse(), limit=1, with_count=True)
+        self.assertEqual((len(page['items']), page['count']), (1, 2))
+        self.assertIsNotNone(page['next'])
+
+        # The related rows are loaded up front, so the schemas serialize without queries
+        book = BookOut.from_orm(await aget_book(AsyncRequestFactory().get('/'), HttpResponse(), self.book.pk))
+        self.assertEqual((book.author, book.genre, book.copies_on_loan), ('Last 0, First 0', ['Genre 0'], 2))
+        copy = await self.book.bookinstance_set.afirst()
+        copy_out = await aget_book_instance(AsyncRequestFactory().get('/'), HttpResponse(), str(copy.pk))
+        copy_out = BookInstanceOut.from_orm(copy_out)
+        self.assertEqual((copy_out.book_id, copy_out.status), (self.book.pk, 'o'))
+
+    @override_settings(CATALOG_INSTRUMENTATION_SAMPLE_RATE=1.0, CATALOG_SERVER_TIMING=True)
+    async def test_instrumentation(self):
+        async def view(request):
+            return HttpResponse(str(await Book.objects.acount()))
+
+        middleware = RequestInstrumentationMiddleware(view)
+        with self.assertLogs('catalog.requests', 'INFO') as logs:
+            response = await middleware(AsyncRequestFactory().get('/'))
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertEqual(json.loads(logs.records[0].getMessage())['queries'], 1)
+
+
+import threading
+
+from django.db import connections
+from django.test import TransactionTestCase
+
+from catalog.loans import LoanError, checkout, checkout_book, renew, reserve, return_copy
+
+
+class LoanTest(TestCase):
+    """Checkout, return, renew and reserve only apply to copies in the right state."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = create_catalog(1, copies_per_book=0)[0]
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.other = User.objects.create_user(username='other')
+        cls.librarian = User.objects.create_user(username='librarian')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+    def counts(self):
+        book = Book.objects.get(pk=self.book.pk)
+        return book.copies_available, book.copies_on_loan, book.copies_reserved
+
+    def test_loan_cycle(self):
+        reserve(self.copy.pk, self.reader.pk)
+        self.assertEqual(self.counts(), (0, 0, 1))
+        with self.assertRaisesMessage(LoanError, 'is reserved and cannot be checked out'):
+            checkout(self.copy.pk, self.other.pk)
+
+        copy = checkout(self.copy.pk, self.reader.pk)
+        self.assertEqual((copy.status, copy.borrower_id), ('o', self.reader.pk))
+        self.assertEqual(copy.due_back, datetime.date.today() + datetime.timedelta(weeks=3))
+        self.assertEqual(self.counts(), (0, 1, 0))
+
+        due_back = datetime.date.today() + datetime.timedelta(weeks=4)
+        self.assertEqual(renew(self.copy.pk, due_back=due_back).due_back, due_back)
+        with self.assertRaises(LoanError):
+            renew(self.copy.pk, due_back=due_back + datetime.timedelta(days=1))
+
+        copy = return_copy(self.copy.pk)
+        self.assertEqual((copy.status, copy.borrower_id, copy.due_back), ('a', None, None))
+        self.assertEqual(self.counts(), (1, 0, 0))
+        with self.assertRaisesMessage(LoanError, 'is available and cannot be returned'):
+            return_copy(self.copy.pk)
+
+    def test_api(self):
+        url = f'/api/book_instance/{self.copy.pk}/checkout'
+        self.assertEqual(self.client.post(url, {'borrower_id': self.reader.pk}, 'application/json').status_code, 401)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.post(url, {'borrower_id': self.reader.pk}, 'application/json').status_code, 403)
+        # A librarian's session cookie alone is not enough: forged cross-site requests are rejected
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.force_login(self.librarian)
+        self.assertEqual(csrf_client.post(url, {'borrower_id': self.reader.pk}, 'application/json').status_code, 403)
+        self.assertEqual(csrf_client.post('/api/loans/batch', [], 'application/json').status_code, 403)
+        self.client.force_login(self.librarian)
+        response = self.client.post(url, {'borrower_id': self.reader.pk}, 'application/json')
+        self.assertEqual(response.json()['status'], 'o')
+        self.assertEqual(self.client.post(url, {'borrower_id': self.other.pk}, 'application/json').status_code, 409)
+        missing = f'/api/book_instance/{BookInstance().pk}/return'
+        self.assertEqual(self.client.post(missing).status_code, 404)
+
+        response = self.client.post('/api/loans/batch', [
+            {'action': 'return', 'book_instance_id': str(self.copy.pk)},
+            {'action': 'return', 'book_instance_id': str(self.copy.pk)},
+            {'action': 'reserve', 'book_instance_id': str(self.copy.pk), 'borrower_id': self.other.pk},
+            {'action': 'lose', 'book_instance_id': str(self.copy.pk)},
+        ], 'application/json')
+        self.assertEqual([item['success'] for item in response.json()], [True, False, True, False])
+        self.assertEqual(self.counts(), (0, 0, 1))
+
+
+class LoanContentionTest(TransactionTestCase):
+    """Many desks lending copies of one popular book at once never lend a copy twice."""
+
+    def test_concurrent_checkouts(self):
+        book = create_catalog(1, copies_per_book=0)[0]
+        for _ in range(5):
+            BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        borrowers = [User.objects.create_user(username=f'reader{i}') for i in range(20)]
+        results = []
+        start = threading.Barrier(len(borrowers))
+
+        def borrow(borrower):
+            start.wait()
+            try:
+                results.append(checkout_book(book.pk, borrower.pk))
+            except LoanError as e:
+                results.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=borrow, args=[borrower]) for borrower in borrowers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        loans = [result for result in results if isinstance(result, BookInstance)]
+        self.assertEqual(len(results), 20)
+        self.assertEqual(len(loans), 5)
+        self.assertEqual(len({copy.pk for copy in loans}), 5)
+        self.assertEqual(BookInstance.objects.filter(book=book, status='o').count(), 5)
+        book.refresh_from_db()
+        self.assertEqual((book.copies_available, book.copies_on_loan), (0, 5))
+
+
+from django.core import mail
+
+from catalog.models import OverdueLoan
+from django.utils import timezone
+
+from catalog.overdue import send_overdue_notices, sweep_overdue
+
+
+class OverdueTest(TestCase):
+    """Overdue loans are found in SQL, swept into OverdueLoan and noticed once per borrower."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', email='reader@example.com')
+        cls.other = User.objects.create_user(username='other', email='other@example.com')
+        book = create_catalog(1, copies_per_book=0)[0]
+        today = datetime.date.today()
+        cls.copies = [
+            BookInstance.objects.create(book=book, imprint='Imprint', status=status, borrower=borrower,
+                                        due_back=today + datetime.timedelta(days=days))
+            for status, borrower, days in [
+                ('o', cls.reader, -3), ('o', cls.reader, -1), ('o', cls.other, -2),
+                ('o', cls.other, 2), ('r', cls.other, -5),
+            ]
+        ]
+
+    def test_queryset(self):
+        self.assertEqual(set(BookInstance.objects.overdue()), set(self.copies[:3]))
+        flags = dict(BookInstance.objects.with_overdue().values_list('pk', 'overdue'))
+        self.assertEqual([flags[copy.pk] for copy in self.copies], [True, True, True, False, False])
+
+    def test_sweep_and_notices(self):
+        self.assertEqual(sweep_overdue(batch_size=2), (3, 0))
+        self.assertEqual(set(OverdueLoan.objects.values_list('book_instance', flat=True)),
+                         {copy.pk for copy in self.copies[:3]})
+
+        self.assertEqual(send_overdue_notices(), (2, 3))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['other@example.com', 'reader@example.com'])
+        notice = next(message for message in mail.outbox if message.to == ['reader@example.com'])
+        self.assertEqual(notice.body.count('Book 0'), 2)
+        # Nothing new to notice until the interval has passed
+        self.assertEqual(send_overdue_notices(), (0, 0))
+
+        BookInstance.objects.filter(pk=self.copies[0].pk).update(status='a', borrower=None, due_back=None)
+        self.assertEqual(sweep_overdue(), (2, 1))
+        later = timezone.now() + datetime.timedelta(days=8)
+        self.assertEqual(send_overdue_notices(now=later), (2, 2))
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('sweep_overdue', stdout=out)
+        self.assertIn('3 overdue loans recorded', out.getvalue())
+        self.assertIn('Sent 2 notices covering 3 loans', out.getvalue())
+
+
+from django.contrib.auth.models import Group
+
+from catalog.context_processors import can_mark_returned
+
+
+class PermissionCacheTest(TestCase):
+    """Permission sets are cached across requests until permission or group assignments change."""
+
+    @classmethod
+    def setUpClass(cls):
+        # A cache all server processes share, unlike the default LocMemCache
+        directory = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        }))
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.permission = Permission.objects.get(codename='can_mark_returned')
+        cls.group = Group.objects.create(name='Librarians')
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader')
+
+    def has_perm(self, num_queries=0):
+        """Check the permission as a new request would, with a freshly loaded user."""
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(num_queries):
+            return user.has_perm('catalog.can_mark_returned')
+
+    def test_cached_across_requests(self):
+        # The user's and their groups' permissions
+        self.assertFalse(self.has_perm(2))
+        self.assertFalse(self.has_perm())
+
+    def test_not_cached_in_process_local_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertFalse(self.has_perm(2))
+            self.assertFalse(self.has_perm(2))
+
+    def test_user_assignments_invalidate(self):
+        self.has_perm(2)
+        self.user.user_permissions.add(self.permission)
+        self.assertTrue(self.has_perm(2))
+        self.permission.user_set.remove(self.user)
+        self.assertFalse(self.has_perm(2))
+
+        self.user.groups.add(self.group)
+        self.group.permissions.add(self.permission)
+        self.assertTrue(self.has_perm(2))
+        self.group.user_set.clear()
+        self.assertFalse(self.has_perm(2))
+
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).get_all_permissions())
+
+    def test_group_changes_invalidate(self):
+        self.user.groups.add(self.group)
+        self.group.permissions.add(self.permission)
+        self.assertTrue(self.has_perm(2))
+        self.group.permissions.clear()
+        self.assertFalse(self.has_perm(2))
+        self.group.permissions.add(self.permission)
+        self.assertTrue(self.has_perm(2))
+        self.group.delete()
+        self.assertFalse(self.has_perm(2))
+
+    def test_context_processor_is_lazy(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            context = can_mark_returned(request)
+        self.user.user_permissions.add(self.permission)
+        with self.assertNumQueries(2):
+            self.assertTrue(context['can_mark_returned']())
+
+
+from catalog.benchmark import run_session_benchmark
+from catalog.visits import check_shared_cache
+
+
+class VisitCounterTest(TestCase):
+    """The home page visit counter, saved in the session on every visit or every few."""
+
+    def setUp(self):
+        cache.clear()
+
+    def session_writes(self, visits):
+        """Visit the home page visits times; return the visit counts shown and the session writes."""
+        counts = []
+        with CaptureQueriesContext(connection) as captured:
+            for _ in range(visits):
+                counts.append(self.client.get(reverse('index')).context['num_visits'])
+        writes = [q for q in captured.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))
+                  and 'django_session' in q['sql']]
+        return counts, len(writes)
+
+    def test_session_counter(self):
+        self.assertEqual(self.session_writes(3), ([1, 2, 3], 3))
+
+    @override_settings(CATALOG_VISIT_COUNTER='cache', CATALOG_VISIT_FLUSH_EVERY=5)
+    def test_coalesced_counter(self):
+        # The first visit creates the session, then the count is saved at 5 and 10
+        counts, writes = self.session_writes(12)
+        self.assertEqual(counts, list(range(1, 13)))
+        self.assertEqual(writes, 3)
+
+        # Evicted counts resume from the last saved one
+        cache.clear()
+        self.assertEqual(self.session_writes(1)[0], [11])
+
+    @override_settings(CATALOG_VISIT_COUNTER='cache', CATALOG_VISIT_FLUSH_EVERY=2, CATALOG_ASYNC_VIEWS=True,
+                       ROOT_URLCONF=__name__)
+    async def test_async_coalesced_counter(self):
+        for expected in (1, 2, 3):
+            response = await self.async_client.get(reverse('index'))
+            self.assertEqual(response.context['num_visits'], expected)
+
+    def test_cache_modes_need_a_shared_cache(self):
+        with override_settings(CATALOG_VISIT_COUNTER='cache',
+                               SESSION_ENGINE='django.contrib.sessions.backends.cache'):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['catalog.E001', 'catalog.E002'])
+            redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+            with override_settings(CACHES=redis):
+                self.assertEqual(check_shared_cache(None), [])
+        self.assertEqual(check_shared_cache(None), [])
+
+    def test_session_benchmark(self):
+        report = run_session_benchmark(['db', 'signed_cookies'], iterations=4, visits=2)
+        self.assertEqual(report['results']['db']['writes_per_request'], 1)
+        self.assertEqual(report['results']['signed_cookies']['writes_per_request'], 0)
+
+
+import sqlite3
+from unittest import skipUnless
+
+from django.conf import settings
+from django.test import Client
+
+from catalog.replicas import STICKY_COOKIE, ReplicaRouter
+
+
+@skipUnless(connection.vendor == 'sqlite', "The replica is a copy of the SQLite test database")
+class ReplicaRoutingTest(TransactionTestCase):
+    """Catalog reads of GET requests go to a replica, except right after the same browser changed the catalog."""
+
+    def setUp(self):
+        cache.clear()
+        self.book = create_catalog(1, copies_per_book=0)[0]
+        self.copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.librarian = User.objects.create_user(username='librarian')
+        self.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+        # A second SQLite file stands in for the replica: a copy of the
+        # primary that does not see the changes made after it was taken
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        primary = connections['default']
+        replica = primary.__class__({**primary.settings_dict, 'NAME': path}, 'replica')
+        connections['replica'] = replica
+        self.addCleanup(self.remove_replica)
+        primary.ensure_connection()
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection)
+        self.enterContext(override_settings(DATABASE_REPLICAS=['replica']))
+
+        Book.objects.filter(pk=self.book.pk).update(title='New title')
+
+    def remove_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+
+    def test_reads_from_replica(self):
+        response = self.client.get(reverse('books'))
+        self.assertContains(response, 'Book 0')
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+        # Users and sessions are always read from the primary
+        self.client.force_login(self.librarian)
+        self.assertContains(self.client.get(reverse('books')), 'librarian')
+
+    def test_cache_fills_read_from_primary(self):
+        self.assertContains(self.client.get(reverse('book-detail', args=[self.book.pk])), 'New title')
+        self.assertEqual(self.client.get(reverse('index')).context['num_books'], 1)
+
+    def test_read_your_writes(self):
+        self.client.force_login(self.librarian)
+        response = self.client.post(f'/api/book_instance/{self.copy.pk}/checkout',
+                                    {'borrower_id': self.librarian.pk}, 'application/json')
+        self.assertEqual(response.json()['status'], 'o')
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], settings.DATABASE_REPLICA_STICKINESS)
+        # This browser now reads from the primary, others still from the replica
+        self.assertContains(self.client.get(reverse('books')), 'New title')
+        self.assertContains(Client().get(reverse('books')), 'Book 0')
+
+    def test_outside_requests(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Book), 'default')
+        self.assertEqual(Book.objects.get(pk=self.book.pk).title, 'New title')
+        self.assertFalse(router.allow_migrate('replica', 'catalog'))
+        self.assertIsNone(router.allow_migrate('default', 'catalog'))
+
+
+from catalog.benchmark import run_connection_benchmark
+
+
+class ConnectionBenchmarkTest(TransactionTestCase):
+    def test_connection_reuse(self):
+        create_catalog(1)
+        report = run_connection_benchmark(
+            [reverse('books'), reverse('authors')], ['per-request', 'persistent'], iterations=4, connects=2,
+        )
+        self.assertEqual(report['results']['per-request']['connections_per_request'], 1)
+        self.assertLessEqual(report['results']['persistent']['connections_per_request'], 0.25)
+        self.assertEqual(report['results']['persistent']['errors'], 0)
+        # The database settings are restored
+        self.assertEqual(connections['default'].settings_dict['CONN_MAX_AGE'], settings.DATABASE_CONN_MAX_AGE)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Benchmarks the SQLite profiles")
+class SqliteBenchmarkTest(TransactionTestCase):
+    def test_tuned_profile(self):
+        book = create_catalog(1, borrower=User.objects.create_user(username='reader'))[0]
+        for _ in range(5):
+            BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        database = dict(connection.settings_dict)
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark_sqlite', threads=4, duration=0.5, output=output.name, stdout=io.StringIO())
+            report = json.load(output)
+        tuned = report['profiles']['tuned']
+        self.assertGreater(tuned['write']['operations'], 0)
+        self.assertEqual(tuned['read']['errors'] + tuned['write']['errors'], 0)
+        # The test database is left as it was
+        self.assertEqual(connection.settings_dict, database)
+        self.assertEqual(Book.objects.get().copies_available, 5)
+
+
+from catalog.genres import assign_genres, set_genres
+
+
+class GenreAssignmentTest(TestCase):
+    """Genres of many books are changed with a fixed number of queries, writing only the changed links."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_assign_genres(self):
+        books = create_catalog(30, copies_per_book=0)
+        old = books[0].genre.get()
+        new = Genre.objects.create(name='Gothic')
+        book_ids = [book.pk for book in books]
+        url = reverse('book-detail', args=[books[0].pk])
+        self.client.get(url)
+        before = Book.objects.get(pk=books[0].pk).updated_at
+
+        # Links, INSERT, DELETE, updated_at and search index, independent of the number of books
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(assign_genres(book_ids, add=[new.pk], remove=[old.pk]), (30, 30))
+        self.assertLessEqual(len(queries), 8)
+        self.assertEqual(new.book_set.count(), 30)
+        self.assertEqual(old.book_set.count(), 0)
+        self.assertGreater(Book.objects.get(pk=books[0].pk).updated_at, before)
+        self.assertEqual(len(search_books('gothic')), 30)
+        self.assertContains(self.client.get(url), 'Gothic')
+
+        # Nothing left to change: only the links are read (in a savepoint)
+        with self.assertNumQueries(3):
+            self.assertEqual(assign_genres(book_ids, add=[new.pk]), (0, 0))
+        with self.assertRaises(ValueError):
+            assign_genres(book_ids, add=[new.pk], remove=[new.pk])
+
+        self.assertEqual(set_genres({books[0].pk: [old.pk, new.pk], books[1].pk: []}), (1, 1))
+        self.assertEqual(set(books[0].genre.all()), {old, new})
+        self.assertFalse(books[1].genre.exists())
+
+    def test_api(self):
+        book = create_catalog(1, copies_per_book=0)[0]
+        genre = Genre.objects.create(name='Gothic')
+        data = {'book_ids': [book.pk, book.pk + 1], 'add': [genre.pk]}
+        self.assertEqual(self.client.post('/api/books/genres', data, content_type='application/json').status_code, 401)
+        self.client.force_login(User.objects.create_user(username='reader'))
+        self.assertEqual(self.client.put('/api/books/genres', data, content_type='application/json').status_code, 403)
+        login_admin(self.client)
+        response = self.client.post('/api/books/genres', data, content_type='application/json')
+        self.assertEqual(response.json(), {'added': 1, 'removed': 0, 'not_found': [book.pk + 1]})
+
+        data = {'book_ids': [book.pk], 'genre_ids': [genre.pk + 1]}
+        response = self.client.put('/api/books/genres', data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        data = {'book_ids': [book.pk], 'genre_ids': [genre.pk]}
+        response = self.client.put('/api/books/genres', data, content_type='application/json')
+        self.assertEqual(response.json(), {'added': 0, 'removed': 1, 'not_found': []})
+        self.assertEqual(list(book.genre.all()), [genre])
+
+
+from catalog.benchmark import run_serialization_benchmark
+
+
+class ApiSerializationTest(TestCase):
+    """The API serializes books and copies from querysets that load related rows in bulk."""
+
+    def setUp(self):
+        cache.clear()
+        login_admin(self.client)
+
+    def test_book_endpoints(self):
+        books = create_catalog(30, copies_per_book=1)
+        response = self.client.get(f'/api/book/{books[0].pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['author'], response.json()['genre']), ('Last 0, First 0', ['Genre 0']))
+
+        # Validators + books with their authors + genres, whatever the page size
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/books', {'limit': 30})
+        self.assertEqual(len(response.json()['items']), 30)
+        self.assertEqual(response.json()['items'][1]['author'], 'Last 1, First 1')
+
+        data = {'title': 'New', 'author_id': books[0].author_id, 'summary': 'Summary', 'isbn': '9' * 13,
+                'genre_ids': []}
+        response = self.client.put(f'/api/book/{books[1].pk}', data, content_type='application/json')
+        self.assertEqual((response.json()['author'], response.json()['genre']), ('Last 0, First 0', []))
+
+        genre = Genre.objects.create(name='Gothic')
+        data.update(isbn='8' * 13, genre_ids=[genre.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/book/create', data, content_type='application/json')
+        self.assertEqual(response.json()['genre'], ['Gothic'])
+        # The links are read without a join and the response does not read the genres back
+        self.assertFalse([query for query in queries if 'INNER JOIN "catalog_book_genre"' in query['sql']])
+
+        # Replacing a genre removes and adds links with one updated_at write
+        data.update(genre_ids=[Genre.objects.create(name='Horror').pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(f'/api/book/{response.json()["id"]}', data, content_type='application/json')
+        self.assertEqual(response.json()['genre'], ['Horror'])
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "catalog_book" SET "updated_at"')]
+        self.assertEqual(len(updates), 1)
+
+    def test_book_instance_endpoints(self):
+        book = create_catalog(1, copies_per_book=0)[0]
+        borrower = User.objects.create_user(username='reader')
+        data = {'book_id': book.pk, 'imprint': 'Imprint', 'borrower_id': borrower.pk, 'status': 'o'}
+        response = self.client.post('/api/book_instance/create', data, content_type='application/json')
+        self.assertEqual((response.json()['book_id'], response.json()['borrower_id']), (book.pk, borrower.pk))
+        self.assertEqual(Book.objects.get().copies_on_loan, 1)
+
+        data['borrower_id'] = borrower.pk + 1
+        response = self.client.put(f"/api/book_instance/{response.json()['id']}", data,
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_benchmark(self):
+        create_catalog(5, copies_per_book=1)
+        report = run_serialization_benchmark(rows=5, iterations=1)
+        self.assertEqual(report['results']['book']['queries'], 2)
+        self.assertEqual(report['results']['book-unbatched']['queries'], 11)
+        self.assertEqual(report['results']['book-instance']['rows'], 5)
+
+
+import decimal
+import uuid
+
+from catalog import renderers
+from catalog.benchmark import run_renderer_benchmark
+
+
+class RendererTest(TestCase):
+    """The API encodes and decodes with orjson, and speaks MessagePack when asked to."""
+
+    def setUp(self):
+        login_admin(self.client)
+
+    def test_json(self):
+        copy_id, today = uuid.uuid4(), datetime.date.today()
+        content = renderers.dumps_json({'id': copy_id, 'due_back': today, 'fine': decimal.Decimal('1.50')})
+        self.assertEqual(json.loads(content), {'id': str(copy_id), 'due_back': today.isoformat(), 'fine': '1.50'})
+
+        response = self.client.post('/api/genre/create', '{"name": "Gothic"}', content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/json; charset=utf-8')
+        self.assertEqual(response.json(), {'id': Genre.objects.get().pk})
+        response = self.client.post('/api/genre/create', '{"name": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(renderers.msgpack, "Needs msgpack")
+    def test_msgpack(self):
+        book = create_catalog(1, copies_per_book=0)[0]
+        url = f'/api/book/{book.pk}'
+        response = self.client.get(url, headers={'accept': 'application/msgpack, application/json;q=0.5'})
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(renderers.msgpack.unpackb(response.content)['title'], 'Book 0')
+        # The JSON copy's ETag does not revalidate the MessagePack one
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, headers={'accept': 'application/msgpack', 'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post('/api/genre/create', renderers.msgpack.packb({'name': 'Gothic'}),
+                                    content_type='application/msgpack')
+        self.assertTrue(Genre.objects.filter(name='Gothic').exists())
+
+    def test_benchmark(self):
+        report = run_renderer_benchmark(records=10, iterations=1)
+        encoders = {'stdlib-json'} | {name for name in ('orjson', 'msgpack') if getattr(renderers, name)}
+        self.assertEqual(set(report['results']), encoders)
+        for results in report['results'].values():
+            self.assertGreater(results['book-instances']['bytes'], 0)
@@ -9,6 +9,7 @@ urlpatterns = [
     path('book/<int:pk>', views.BookDetailView.as_view(), name='book-detail'),
     path('authors/', views.AuthorListView.as_view(), name='authors'),
     path('author/<int:pk>', views.AuthorDetailView.as_view(), name='author-detail'),
+    path('search/', views.search, name='search'),
 ]
 
 urlpatterns += [
@@ -41,3 +42,20 @@ urlpatterns += [
     path('book/<int:pk>/update/', views.BookUpdate.as_view(), name='book-update'),
     path('book/<int:pk>/delete/', views.BookDelete.as_view(), name='book-delete'),
 ]
+
+from django.conf import settings
+from . import async_views
+
+# Async versions of the read pages (see catalog/async_views.py). Under ASGI
+# (CATALOG_ASYNC_VIEWS) they are listed first, so they answer instead of
+# the sync views at the same paths.
+async_urlpatterns = [
+    path('', async_views.index, name='index'),
+    path('books/', async_views.book_list, name='books'),
+    path('book/<int:pk>', async_views.book_detail, name='book-detail'),
+    path('authors/', async_views.author_list, name='authors'),
+    path('author/<int:pk>', async_views.author_detail, name='author-detail'),
+]
+
+if settings.CATALOG_ASYNC_VIEWS:
+    urlpatterns = async_urlpatterns + urlpatterns
@@ -3,99 +3,111 @@ from django.shortcuts import render
 # Create your views here.
 
 from .models import Book, Author, BookInstance, Genre
+from .stats import get_dashboard_stats
+from .visits import count_visit
 
 def index(request):
     """View function for home page of site."""
 
-    # Generate counts of some of the main objects
-    num_books = Book.objects.all().count()
-    num_instances = BookInstance.objects.all().count()
+    # Record counts come from one cached aggregate query (see catalog/stats.py)
+    stats = get_dashboard_stats()
 
-    # Available books (status = 'a')
-    num_instances_available = BookInstance.objects.filter(status__exact='a').count()
-
-    # The 'all()' is implied by default.
-    num_authors = Author.objects.count()
-
-    # Generate counts for genres and books with a particular word
-    genre_word = 'fiction'
-    book_word = 'secret'
-
-    num_genres_with_word = 0
-    for genre in Genre.objects.all():
-        if genre_word in genre.name.lower():
-            num_genres_with_word += 1
-    
-    num_books_with_word = 0
-    for book in Book.objects.all():
-        if book_word in book.title.lower():
-            num_books_with_word += 1
-
-    # Number of visits to this view, as counted in the session variable.
-    num_visits = request.session.get('num_visits', 0)
-    num_visits += 1
-    request.session['num_visits'] = num_visits
+    # Number of visits to this view by this session (see catalog/visits.py)
+    num_visits = count_visit(request)
 
     context = {
-        'num_books': num_books,
-        'num_instances': num_instances,
-        'num_instances_available': num_instances_available,
-        'num_authors': num_authors,
-        'genre_word': genre_word,
-        'book_word': book_word,
-        'num_genres_with_word': num_genres_with_word,
-        'num_books_with_word': num_books_with_word,
+        **stats,
         'num_visits': num_visits,
-        'can_mark_returned': request.user.has_perm('catalog.can_mark_returned'),
     }
 
     # Render the HTML template index.html with the data in the context variable
     return render(request, 'index.html', context=context)
 
+from .search import search_books
+
+def search(request):
+    """View function for full-text search over books, authors and genres."""
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'book_list': search_books(query) if query else [],
+    }
+    return render(request, 'catalog/book_search.html', context=context)
+
 from django.views import generic
 
-class BookListView(generic.ListView):
+from .conditional import ConditionalGetMixin, detail_validators, list_validators
+from .pagecache import VersionedCacheMixin
+from .pagination import AUTHOR_ORDERING, BOOK_ORDERING, BOOKINSTANCE_ORDERING, CursorPaginationMixin
+
+class BookListView(ConditionalGetMixin, CursorPaginationMixin, generic.ListView):
     model = Book
     paginate_by = 10
+    cursor_ordering = BOOK_ORDERING
+    # The list shows each book's author, so join it in the page query
+    queryset = Book.objects.select_related('author')
 
-class BookDetailView(generic.DetailView):
+    def get_validators(self):
+        return list_validators('book', Book.objects.all(), 'author')
+
+class BookDetailView(ConditionalGetMixin, VersionedCacheMixin, generic.DetailView):
     model = Book
+    cache_kind = 'book'
+    # Genres and copies are only loaded when their cached fragment is stale
+    queryset = Book.objects.select_related('author')
+
+    def get_validators(self):
+        return detail_validators('book', self.kwargs['pk'])
 
-class AuthorListView(generic.ListView):
+class AuthorListView(ConditionalGetMixin, CursorPaginationMixin, generic.ListView):
     model = Author
     paginate_by = 10
+    cursor_ordering = AUTHOR_ORDERING
 
-class AuthorDetailView(generic.DetailView):
+    def get_validators(self):
+        return list_validators('author', Author.objects.all())
+
+class AuthorDetailView(ConditionalGetMixin, VersionedCacheMixin, generic.DetailView):
     model = Author
+    cache_kind = 'author'
+
+    def get_validators(self):
+        return detail_validators('author', self.kwargs['pk'])
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 
-class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
+class LoanedBooksByUserListView(LoginRequiredMixin, CursorPaginationMixin, generic.ListView):
     """Generic class-based view listing books on loan to current user."""
     model = BookInstance
     template_name = 'catalog/bookinstance_list_borrowed_user.html'
     paginate_by = 10
+    cursor_ordering = BOOKINSTANCE_ORDERING
 
     def get_queryset(self):
         return (
             BookInstance.objects.filter(borrower=self.request.user)
             .filter(status__exact='o')
+            .with_overdue()
+            .select_related('book')
             .order_by('due_back')
         )
 
 from django.contrib.auth.mixins import PermissionRequiredMixin
 
-class LoanedBooksAllUsersListView(LoginRequiredMixin, PermissionRequiredMixin, generic.ListView):
+class LoanedBooksAllUsersListView(LoginRequiredMixin, PermissionRequiredMixin, CursorPaginationMixin, generic.ListView):
     """Generic class-based view listing books on loan to current user."""
     model = BookInstance
     template_name = 'catalog/bookinstance_list_borrowed_staff.html'
     paginate_by = 10
+    cursor_ordering = BOOKINSTANCE_ORDERING
     permission_required = 'catalog.can_mark_returned'
 
     def get_queryset(self):
         return (
             BookInstance.objects.all()
             .filter(status__exact='o')
+            .with_overdue()
+            .select_related('book', 'borrower')
             .order_by('due_back')
         )
 
@@ -108,6 +120,7 @@ from django.http import HttpResponseRedirect
 from django.urls import reverse
 
 from catalog.forms import RenewBookForm
+from catalog.loans import LoanError, renew
 
 @login_required
 @permission_required('catalog.can_mark_returned', raise_exception=True)
@@ -123,12 +136,14 @@ def renew_book_librarian(request, pk):
 
         # Check if the form is valid:
         if form.is_valid():
-            # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
-            book_instance.due_back = form.cleaned_data['renewal_date']
-            book_instance.save()
-
-            # redirect to a new URL:
-            return HttpResponseRedirect(reverse('all-borrowed'))
+            # Renew with a conditional update, so a copy returned meanwhile is not put back on loan
+            try:
+                renew(book_instance.pk, due_back=form.cleaned_data['renewal_date'])
+            except LoanError as e:
+                form.add_error(None, str(e))
+            else:
+                # redirect to a new URL:
+                return HttpResponseRedirect(reverse('all-borrowed'))
 
     # If this is a GET (or any other method) create the default form.
     else:
@@ -0,0 +1,97 @@
+"""The home page visit counter.
+
+Each session counts its visits to the home page in num_visits. Storing
+the new count in the session on every visit makes the session backend
+save the session on every home page hit, which with the default database
+backend is an UPDATE of django_session per page view.
+
+CATALOG_VISIT_COUNTER selects how visits are counted:
+
+* "session" saves the count in the session on every visit.
+* "cache" counts in the cache with an atomic increment and saves the
+  count in the session only every CATALOG_VISIT_FLUSH_EVERY visits, so
+  most visits write nothing to the session store. If the cache entry is
+  evicted counting resumes from the last saved count, losing at most
+  CATALOG_VISIT_FLUSH_EVERY - 1 visits. The cache must be shared by all
+  server processes (Redis, Memcached, see CACHE_URL), not LocMemCache;
+  check_shared_cache() refuses it otherwise.
+
+SESSION_ENGINE is independent of this: the signed-cookie or cache
+session backends avoid database writes altogether, at the price of
+cookie-sized sessions or sessions lost with the cache. The
+benchmark_sessions command compares the combinations. The cache session
+backend needs a shared cache too.
+"""
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+
+from .pagecache import shared_cache
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """System check: visits and sessions are only kept in the cache if every server process shares it."""
+    if shared_cache():
+        return []
+    hint = "Set CACHE_URL to a Redis or Memcached server."
+    errors = []
+    if settings.CATALOG_VISIT_COUNTER == 'cache':
+        errors.append(checks.Error(
+            "CATALOG_VISIT_COUNTER = 'cache' needs a cache shared by all server processes, not "
+            f"{settings.CACHES['default']['BACKEND']}.", hint=hint, id='catalog.E001',
+        ))
+    if settings.SESSION_ENGINE == 'django.contrib.sessions.backends.cache':
+        errors.append(checks.Error(
+            "The cache session backend needs a cache shared by all server processes, not "
+            f"{settings.CACHES['default']['BACKEND']}.", hint=hint, id='catalog.E002',
+        ))
+    return errors
+
+
+def visits_key(session_key):
+    return f'catalog:visits:{session_key}'
+
+
+def coalesce_visits(session):
+    """Whether the visit can be counted in the cache (the session must already have a key)."""
+    return settings.CATALOG_VISIT_COUNTER == 'cache' and session.session_key is not None
+
+
+def count_visit(request):
+    """Count a home page visit of the request's session and return its number of visits."""
+    session = request.session
+    if not coalesce_visits(session):
+        num_visits = session.get('num_visits', 0) + 1
+        session['num_visits'] = num_visits
+        return num_visits
+
+    key = visits_key(session.session_key)
+    try:
+        num_visits = cache.incr(key)
+    except ValueError:
+        # Not counted in the cache yet (or evicted): start from the last saved count
+        cache.add(key, session.get('num_visits', 0), settings.SESSION_COOKIE_AGE)
+        num_visits = cache.incr(key)
+    if num_visits % settings.CATALOG_VISIT_FLUSH_EVERY == 0:
+        session['num_visits'] = num_visits
+    return num_visits
+
+
+async def acount_visit(request):
+    """Async version of count_visit()."""
+    session = request.session
+    if not coalesce_visits(session):
+        num_visits = await session.aget('num_visits', 0) + 1
+        await session.aset('num_visits', num_visits)
+        return num_visits
+
+    key = visits_key(session.session_key)
+    try:
+        num_visits = await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, await session.aget('num_visits', 0), settings.SESSION_COOKIE_AGE)
+        num_visits = await cache.aincr(key)
+    if num_visits % settings.CATALOG_VISIT_FLUSH_EVERY == 0:
+        await session.aset('num_visits', num_visits)
+    return num_visits
@@ -1,7 +1,11 @@
-from ninja import NinjaAPI, Schema, UploadedFile, File
+from ninja import Schema, UploadedFile, File
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
+from catalog.renderers import CatalogAPI
 
-api = NinjaAPI()
+# orjson rendering and parsing, MessagePack on request (see catalog/renderers.py)
+api = CatalogAPI()
 
 class HelloSchema(Schema):
     name: str = "world"
@@ -23,6 +27,28 @@ class UserSchema(Schema):
 class Error(Schema):
     message: str
 
+# Every operation that writes requires the session of a user holding the
+# model permission the admin would ask for. Ninja's SessionAuth also
+# enforces CSRF, which Ninja otherwise skips.
+from ninja.errors import HttpError
+from ninja.security import SessionAuth
+
+class PermissionAuth(SessionAuth):
+    """Session authentication of a user with all of perms; 401 when signed out, 403 without the permissions."""
+
+    def __init__(self, *perms):
+        super().__init__()
+        self.perms = perms
+
+    def authenticate(self, request, key):
+        user = super().authenticate(request, key)
+        if user is not None and not user.has_perms(self.perms):
+            raise HttpError(403, "You do not have permission to perform this action")
+        return user
+
+def can(action, model_name):
+    return PermissionAuth(f"catalog.{action}_{model_name}")
+
 @api.get("/me", response={200: UserSchema, 403: Error})
 def me(request):
     if not request.user.is_authenticated:
@@ -31,15 +57,16 @@ def me(request):
 
 # Create api endpoints for all CRUD actions for the Author model
 from datetime import date
+from typing import List, Optional
 from catalog.models import Author
 
 class AuthorIn(Schema):
     first_name: str
     last_name: str
-    date_of_birth: date = None
-    date_of_death: date = None
+    date_of_birth: Optional[date] = None
+    date_of_death: Optional[date] = None
 
-@api.post("/author/create")
+@api.post("/author/create", auth=can("add", "author"))
 def create_author(request, payload: AuthorIn):
     author = Author.objects.create(**payload.dict())
     return {"id": author.id}
@@ -48,15 +75,107 @@ class AuthorOut(Schema):
     id: int
     first_name: str
     last_name: str
-    date_of_birth: date = None
-    date_of_death: date = None
+    date_of_birth: Optional[date] = None
+    date_of_death: Optional[date] = None
+
+from catalog.pagination import AUTHOR_ORDERING, BOOKINSTANCE_ORDERING, CursorPaginator, InvalidCursor
+
+# Largest page size accepted by the cursor-paginated list endpoints
+MAX_PAGE_SIZE = 1000
+
+def paginate(queryset, ordering, cursor, limit, with_count):
+    """Return one keyset page of queryset as a dict for the *Page schemas."""
+    paginator = CursorPaginator(queryset, ordering, min(max(limit, 1), MAX_PAGE_SIZE), with_count=with_count)
+    page = paginator.page(cursor)
+    return {
+        "items": page.object_list,
+        "next": page.next_cursor,
+        "previous": page.previous_cursor,
+        "count": paginator.count,
+    }
+
+async def apaginate(queryset, ordering, cursor, limit, with_count):
+    paginator = CursorPaginator(queryset, ordering, min(max(limit, 1), MAX_PAGE_SIZE), with_count=with_count)
+    page = await paginator.apage(cursor)
+    return {
+        "items": page.object_list,
+        "next": page.next_cursor,
+        "previous": page.previous_cursor,
+        "count": await paginator.acount(),
+    }
+
+# Conditional GET for the read endpoints (see catalog/conditional.py)
+from django.http import HttpResponse
+from catalog.conditional import (
+    adetail_validators, alist_validators, arow_validators, atable_validators, conditional_response,
+    detail_validators, list_validators, row_validators, set_validators, table_validators,
+)
+from catalog.renderers import representation_etag, vary_on_accept
+
+def not_modified(request, response, validators):
+    """Return a 304/412 response when the client's copy is current, else set ETag/Last-Modified on response."""
+    etag, last_modified = validators
+    etag = representation_etag(request, etag)
+    conditional = conditional_response(request, etag, last_modified)
+    if conditional is None:
+        set_validators(response, etag, last_modified)
+    else:
+        vary_on_accept(conditional)
+    return conditional
+
+# Async versions of the GET endpoints, using the async ORM. ASGI deployments
+# (CATALOG_ASYNC_VIEWS, see local_library/asgi.py) register them instead of
+# the sync ones, under the same operation names.
+from django.shortcuts import aget_object_or_404
+
+def async_read(async_view):
+    """Register async_view in place of the decorated endpoint when CATALOG_ASYNC_VIEWS is on."""
+    def choose(view):
+        if not settings.CATALOG_ASYNC_VIEWS:
+            return view
+        async_view.__name__ = view.__name__
+        return async_view
+    return choose
+
+class AuthorPage(Schema):
+    items: List[AuthorOut]
+    next: Optional[str] = None
+    previous: Optional[str] = None
+    count: Optional[int] = None
+
+async def alist_authors(request, response: HttpResponse, cursor: str = None, limit: int = 100,
+                       with_count: bool = False):
+    if conditional := not_modified(request, response, await alist_validators("author", Author.objects.all())):
+        return conditional
+    try:
+        return await apaginate(Author.objects.all(), AUTHOR_ORDERING, cursor, limit, with_count)
+    except InvalidCursor as e:
+        return 400, {"message": str(e)}
+
+@api.get("/authors", response={200: AuthorPage, 400: Error})
+@async_read(alist_authors)
+def list_authors(request, response: HttpResponse, cursor: str = None, limit: int = 100, with_count: bool = False):
+    if conditional := not_modified(request, response, list_validators("author", Author.objects.all())):
+        return conditional
+    try:
+        return paginate(Author.objects.all(), AUTHOR_ORDERING, cursor, limit, with_count)
+    except InvalidCursor as e:
+        return 400, {"message": str(e)}
+
+async def aget_author(request, response: HttpResponse, author_id: int):
+    if conditional := not_modified(request, response, await adetail_validators("author", author_id)):
+        return conditional
+    return await aget_object_or_404(Author, id=author_id)
 
 @api.get("/author/{author_id}", response=AuthorOut)
-def get_author(request, author_id: int):
+@async_read(aget_author)
+def get_author(request, response: HttpResponse, author_id: int):
+    if conditional := not_modified(request, response, detail_validators("author", author_id)):
+        return conditional
     author = get_object_or_404(Author, id=author_id)
     return author
 
-@api.put("/author/{author_id}")
+@api.put("/author/{author_id}", auth=can("change", "author"))
 def update_author(request, author_id: int, payload: AuthorIn):
     author = get_object_or_404(Author, id=author_id)
     for attr, value in payload.dict().items():
@@ -64,7 +183,7 @@ def update_author(request, author_id: int, payload: AuthorIn):
     author.save()
     return {"success": True}
 
-@api.delete("/author/{author_id}")
+@api.delete("/author/{author_id}", auth=can("delete", "author"))
 def delete_author(request, author_id: int):
     author = get_object_or_404(Author, id=author_id)
     author.delete()
@@ -77,7 +196,7 @@ from catalog.models import Genre
 class GenreIn(Schema):
     name: str
 
-@api.post("/genre/create")
+@api.post("/genre/create", auth=can("add", "genre"))
 def create_genre(request, payload: GenreIn):
     genre = Genre.objects.create(**payload.dict())
     return {"id": genre.id}
@@ -86,12 +205,20 @@ class GenreOut(Schema):
     id: int
     name: str
 
+async def aget_genre(request, response: HttpResponse, genre_id: int):
+    if conditional := not_modified(request, response, await arow_validators(Genre, genre_id)):
+        return conditional
+    return await aget_object_or_404(Genre, id=genre_id)
+
 @api.get("/genre/{genre_id}", response=GenreOut)
-def get_genre(request, genre_id: int):
+@async_read(aget_genre)
+def get_genre(request, response: HttpResponse, genre_id: int):
+    if conditional := not_modified(request, response, row_validators(Genre, genre_id)):
+        return conditional
     genre = get_object_or_404(Genre, id=genre_id)
     return genre
 
-@api.put("/genre/{genre_id}")
+@api.put("/genre/{genre_id}", auth=can("change", "genre"))
 def update_genre(request, genre_id: int, payload: GenreIn):
     genre = get_object_or_404(Genre, id=genre_id)
     for attr, value in payload.dict().items():
@@ -99,7 +226,7 @@ def update_genre(request, genre_id: int, payload: GenreIn):
     genre.save()
     return {"success": True}
 
-@api.delete("/genre/{genre_id}")
+@api.delete("/genre/{genre_id}", auth=can("delete", "genre"))
 def delete_genre(request, genre_id: int):
     genre = get_object_or_404(Genre, id=genre_id)
     genre.delete()
@@ -112,7 +239,7 @@ from catalog.models import Language
 class LanguageIn(Schema):
     name: str
 
-@api.post("/language/create")
+@api.post("/language/create", auth=can("add", "language"))
 def create_language(request, payload: LanguageIn):
     language = Language.objects.create(**payload.dict())
     return {"id": language.id}
@@ -121,12 +248,20 @@ class LanguageOut(Schema):
     id: int
     name: str
 
+async def aget_language(request, response: HttpResponse, language_id: int):
+    if conditional := not_modified(request, response, await arow_validators(Language, language_id)):
+        return conditional
+    return await aget_object_or_404(Language, id=language_id)
+
 @api.get("/language/{language_id}", response=LanguageOut)
-def get_language(request, language_id: int):
+@async_read(aget_language)
+def get_language(request, response: HttpResponse, language_id: int):
+    if conditional := not_modified(request, response, row_validators(Language, language_id)):
+        return conditional
     language = get_object_or_404(Language, id=language_id)
     return language
 
-@api.put("/language/{language_id}")
+@api.put("/language/{language_id}", auth=can("change", "language"))
 def update_language(request, language_id: int, payload: LanguageIn):
     language = get_object_or_404(Language, id=language_id)
     for attr, value in payload.dict().items():
@@ -134,16 +269,14 @@ def update_language(request, language_id: int, payload: LanguageIn):
     language.save()
     return {"success": True}
 
-@api.delete("/language/{language_id}")
+@api.delete("/language/{language_id}", auth=can("delete", "language"))
 def delete_language(request, language_id: int):
     language = get_object_or_404(Language, id=language_id)
     language.delete()
     return {"success": True}
 
 from catalog.models import Book, BookInstance
-from typing import List
-from django.conf import settings
-from datetime import date
+from uuid import UUID
 
 # Create Schemas
 
@@ -161,78 +294,127 @@ class BookOut(Schema):
     summary: str
     isbn: str
     genre: List[str]
+    copies_total: int = 0
+    copies_available: int = 0
+    copies_on_loan: int = 0
+    copies_reserved: int = 0
+    copies_maintenance: int = 0
+
+    @staticmethod
+    def resolve_author(book):
+        return str(book.author) if book.author_id else ""
+
+    @staticmethod
+    def resolve_genre(book):
+        # Set by the endpoints that just wrote the genres, to save reading them back
+        if hasattr(book, "_genre_names"):
+            return book._genre_names
+        return [genre.name for genre in book.genre.all()]
 
 class BookInstanceIn(Schema):
     book_id: int
     imprint: str
-    due_back: str
-    borrower_id: int = None
+    due_back: Optional[date] = None
+    borrower_id: Optional[int] = None
     status: str
 
 class BookInstanceOut(Schema):
-    id: str
+    id: UUID
     book_id: int
     imprint: str
-    due_back: str
-    borrower_id: int = None
+    due_back: Optional[date] = None
+    borrower_id: Optional[int] = None
     status: str
     is_overdue: bool
 
+# The endpoints return model instances and the Out schemas read their
+# fields. Books are read from book_queryset(), which loads their authors in
+# the same query and the genres of all of them in one more, so a page of
+# books costs two queries however long it is. BookInstanceOut only reads
+# columns of the copy itself (book_id, borrower_id), never the related rows.
+from django.db.models import Prefetch
+from django.http import Http404
+from catalog.pagination import BOOK_ORDERING
+from catalog.genres import set_genres
+
+def book_queryset():
+    return Book.objects.select_related("author").prefetch_related(
+        Prefetch("genre", queryset=Genre.objects.only("name"))
+    )
+
+def require(model, pk):
+    """Raise Http404 unless the model row pk exists (without loading it)."""
+    if not model.objects.filter(pk=pk).exists():
+        raise Http404(f"No {model._meta.object_name} matches the given query.")
+
 # CRUD operations for Book
 
-@api.post("/book/create", response=BookOut)
+@api.post("/book/create", response=BookOut, auth=can("add", "book"))
 def create_book(request, payload: BookIn):
     author = get_object_or_404(Author, id=payload.author_id)
-    genres = Genre.objects.filter(id__in=payload.genre_ids)
+    genres = list(Genre.objects.filter(id__in=payload.genre_ids))
     book = Book.objects.create(
         title=payload.title,
         author=author,
         summary=payload.summary,
         isbn=payload.isbn,
     )
-    book.genre.set(genres)
-    return {
-        "id": book.id,
-        "title": book.title,
-        "author": book.author.name,
-        "summary": book.summary,
-        "isbn": book.isbn,
-        "genre": [genre.name for genre in book.genre.all()],
-    }
+    set_genres({book.pk: [genre.pk for genre in genres]})
+    book._genre_names = [genre.name for genre in genres]
+    return book
+
+class BookPage(Schema):
+    items: List[BookOut]
+    next: Optional[str] = None
+    previous: Optional[str] = None
+    count: Optional[int] = None
+
+async def alist_books(request, response: HttpResponse, cursor: str = None, limit: int = 100,
+                      with_count: bool = False):
+    if conditional := not_modified(request, response, await alist_validators("book", Book.objects.all(), "author")):
+        return conditional
+    try:
+        return await apaginate(book_queryset(), BOOK_ORDERING, cursor, limit, with_count)
+    except InvalidCursor as e:
+        return 400, {"message": str(e)}
+
+@api.get("/books", response={200: BookPage, 400: Error})
+@async_read(alist_books)
+def list_books(request, response: HttpResponse, cursor: str = None, limit: int = 100, with_count: bool = False):
+    if conditional := not_modified(request, response, list_validators("book", Book.objects.all(), "author")):
+        return conditional
+    try:
+        return paginate(book_queryset(), BOOK_ORDERING, cursor, limit, with_count)
+    except InvalidCursor as e:
+        return 400, {"message": str(e)}
+
+async def aget_book(request, response: HttpResponse, book_id: int):
+    if conditional := not_modified(request, response, await adetail_validators("book", book_id)):
+        return conditional
+    return await aget_object_or_404(book_queryset(), id=book_id)
 
 @api.get("/book/{book_id}", response=BookOut)
-def get_book(request, book_id: int):
-    book = get_object_or_404(Book, id=book_id)
-    return {
-        "id": book.id,
-        "title": book.title,
-        "author": book.author.name,
-        "summary": book.summary,
-        "isbn": book.isbn,
-        "genre": [genre.name for genre in book.genre.all()],
-    }
+@async_read(aget_book)
+def get_book(request, response: HttpResponse, book_id: int):
+    if conditional := not_modified(request, response, detail_validators("book", book_id)):
+        return conditional
+    return get_object_or_404(book_queryset(), id=book_id)
 
-@api.put("/book/{book_id}", response=BookOut)
+@api.put("/book/{book_id}", response=BookOut, auth=can("change", "book"))
 def update_book(request, book_id: int, payload: BookIn):
     book = get_object_or_404(Book, id=book_id)
     author = get_object_or_404(Author, id=payload.author_id)
-    genres = Genre.objects.filter(id__in=payload.genre_ids)
+    genres = list(Genre.objects.filter(id__in=payload.genre_ids))
     book.title = payload.title
     book.author = author
     book.summary = payload.summary
     book.isbn = payload.isbn
-    book.genre.set(genres)
     book.save()
-    return {
-        "id": book.id,
-        "title": book.title,
-        "author": book.author.name,
-        "summary": book.summary,
-        "isbn": book.isbn,
-        "genre": [genre.name for genre in book.genre.all()],
-    }
+    set_genres({book.pk: [genre.pk for genre in genres]})
+    book._genre_names = [genre.name for genre in genres]
+    return book
 
-@api.delete("/book/{book_id}")
+@api.delete("/book/{book_id}", auth=can("delete", "book"))
 def delete_book(request, book_id: int):
     book = get_object_or_404(Book, id=book_id)
     book.delete()
@@ -240,67 +422,632 @@ def delete_book(request, book_id: int):
 
 # CRUD operations for BookInstance
 
-@api.post("/book_instance/create", response=BookInstanceOut)
+@api.post("/book_instance/create", response=BookInstanceOut, auth=can("add", "bookinstance"))
 def create_book_instance(request, payload: BookInstanceIn):
-    book = get_object_or_404(Book, id=payload.book_id)
-    borrower = None
+    require(Book, payload.book_id)
     if payload.borrower_id:
-        borrower = get_object_or_404(settings.AUTH_USER_MODEL, id=payload.borrower_id)
-    book_instance = BookInstance.objects.create(
-        book=book,
+        require(get_user_model(), payload.borrower_id)
+    return BookInstance.objects.create(
+        book_id=payload.book_id,
         imprint=payload.imprint,
         due_back=payload.due_back,
-        borrower=borrower,
+        borrower_id=payload.borrower_id or None,
         status=payload.status,
     )
-    return {
-        "id": book_instance.id,
-        "book_id": book_instance.book.id,
-        "imprint": book_instance.imprint,
-        "due_back": book_instance.due_back,
-        "borrower_id": book_instance.borrower.id if book_instance.borrower else None,
-        "status": book_instance.status,
-        "is_overdue": book_instance.is_overdue,
-    }
+
+class BookInstancePage(Schema):
+    items: List[BookInstanceOut]
+    next: Optional[str] = None
+    previous: Optional[str] = None
+    count: Optional[int] = None
+
+async def alist_book_instances(request, response: HttpResponse, status: str = None, cursor: str = None,
+                              limit: int = 100, with_count: bool = False):
+    book_instances = BookInstance.objects.all()
+    if status:
+        book_instances = book_instances.filter(status=status)
+    if conditional := not_modified(request, response, await atable_validators(book_instances, date.today())):
+        return conditional
+    try:
+        return await apaginate(book_instances, BOOKINSTANCE_ORDERING, cursor, limit, with_count)
+    except InvalidCursor as e:
+        return 400, {"message": str(e)}
+
+@api.get("/book_instances", response={200: BookInstancePage, 400: Error})
+@async_read(alist_book_instances)
+def list_book_instances(request, response: HttpResponse, status: str = None, cursor: str = None, limit: int = 100,
+                        with_count: bool = False):
+    book_instances = BookInstance.objects.all()
+    if status:
+        book_instances = book_instances.filter(status=status)
+    if conditional := not_modified(request, response, table_validators(book_instances, date.today())):
+        return conditional
+    try:
+        return paginate(book_instances, BOOKINSTANCE_ORDERING, cursor, limit, with_count)
+    except InvalidCursor as e:
+        return 400, {"message": str(e)}
+
+async def aget_book_instance(request, response: HttpResponse, book_instance_id: str):
+    validators = await arow_validators(BookInstance, book_instance_id, date.today())
+    if conditional := not_modified(request, response, validators):
+        return conditional
+    return await aget_object_or_404(BookInstance, id=book_instance_id)
 
 @api.get("/book_instance/{book_instance_id}", response=BookInstanceOut)
-def get_book_instance(request, book_instance_id: str):
-    book_instance = get_object_or_404(BookInstance, id=book_instance_id)
-    return {
-        "id": book_instance.id,
-        "book_id": book_instance.book.id,
-        "imprint": book_instance.imprint,
-        "due_back": book_instance.due_back,
-        "borrower_id": book_instance.borrower.id if book_instance.borrower else None,
-        "status": book_instance.status,
-        "is_overdue": book_instance.is_overdue,
-    }
+@async_read(aget_book_instance)
+def get_book_instance(request, response: HttpResponse, book_instance_id: str):
+    # is_overdue changes with the date
+    validators = row_validators(BookInstance, book_instance_id, date.today())
+    if conditional := not_modified(request, response, validators):
+        return conditional
+    return get_object_or_404(BookInstance, id=book_instance_id)
 
-@api.put("/book_instance/{book_instance_id}", response=BookInstanceOut)
+@api.put("/book_instance/{book_instance_id}", response=BookInstanceOut, auth=can("change", "bookinstance"))
 def update_book_instance(request, book_instance_id: str, payload: BookInstanceIn):
     book_instance = get_object_or_404(BookInstance, id=book_instance_id)
-    book = get_object_or_404(Book, id=payload.book_id)
-    borrower = None
+    require(Book, payload.book_id)
     if payload.borrower_id:
-        borrower = get_object_or_404(settings.AUTH_USER_MODEL, id=payload.borrower_id)
-    book_instance.book = book
+        require(get_user_model(), payload.borrower_id)
+    book_instance.book_id = payload.book_id
     book_instance.imprint = payload.imprint
     book_instance.due_back = payload.due_back
-    book_instance.borrower = borrower
+    book_instance.borrower_id = payload.borrower_id or None
     book_instance.status = payload.status
     book_instance.save()
-    return {
-        "id": book_instance.id,
-        "book_id": book_instance.book.id,
-        "imprint": book_instance.imprint,
-        "due_back": book_instance.due_back,
-        "borrower_id": book_instance.borrower.id if book_instance.borrower else None,
-        "status": book_instance.status,
-        "is_overdue": book_instance.is_overdue,
-    }
+    return book_instance
 
-@api.delete("/book_instance/{book_instance_id}")
+@api.delete("/book_instance/{book_instance_id}", auth=can("delete", "bookinstance"))
 def delete_book_instance(request, book_instance_id: str):
     book_instance = get_object_or_404(BookInstance, id=book_instance_id)
     book_instance.delete()
     return {"success": True}
+
+
+# Full-text search (see catalog/search.py)
+from catalog.search import search_books
+
+class BookSearchOut(Schema):
+    id: int
+    title: str
+    author: Optional[str] = None
+    rank: Optional[float] = None
+
+    @staticmethod
+    def resolve_author(obj):
+        return str(obj.author) if obj.author else None
+
+@api.get("/search", response=List[BookSearchOut])
+def search(request, q: str, limit: int = 20):
+    return search_books(q, limit=min(max(limit, 1), MAX_PAGE_SIZE))
+
+
+# Streaming export of the whole catalog (see catalog/export.py)
+from django.http import StreamingHttpResponse
+from catalog.export import EXPORT_FORMATS, EXPORTS, export_filename, export_stream
+
+@api.get("/export/{kind}", response={403: Error, 404: Error})
+def export_catalog(request, kind: str, format: str = "ndjson", compress: bool = False):
+    if not request.user.is_staff:
+        return 403, {"message": "Only staff can export the catalog"}
+    if kind not in EXPORTS or format not in EXPORT_FORMATS:
+        return 404, {"message": f"Unknown export {kind}.{format}"}
+    response = StreamingHttpResponse(
+        export_stream(kind, format, compress),
+        content_type="application/gzip" if compress else EXPORT_FORMATS[format],
+    )
+    response["Content-Disposition"] = f'attachment; filename="{export_filename(kind, format, compress)}"'
+    return response
+
+
+
+# Per-view totals of the sampled requests of this process (see catalog/instrumentation.py)
+from catalog.instrumentation import stats as request_stats
+
+class RequestStatsOut(Schema):
+    view: Optional[str]
+    requests: int
+    errors: int
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    mean_db_ms: float
+    mean_template_ms: float
+    mean_queries: float
+    max_queries: int
+    mean_bytes: int
+    requests_with_repeated_queries: int
+
+@api.get("/instrumentation", response={200: List[RequestStatsOut], 403: Error})
+def instrumentation(request, reset: bool = False):
+    if not request.user.is_staff:
+        return 403, {"message": "Only staff can see request statistics"}
+    summary = request_stats.summary()
+    if reset:
+        request_stats.reset()
+    return summary
+
+# Bulk create/update/delete endpoints for every model.
+#
+# Each request takes an array, resolves every foreign key it mentions with a
+# single IN query, writes with bulk_create/bulk_update inside one transaction
+# and answers with one result per input item (in input order). Items that
+# fail validation are reported and skipped; the others are still written.
+# Bulk writes send no model signals and bulk_update does not set
+# updated_at, so the search index, the copy counters and updated_at are
+# updated here, and the cached detail pages invalidated.
+import functools
+from typing import Union
+from django.db import IntegrityError, transaction
+from django.db.models import ProtectedError, RestrictedError
+from django.db.models.functions import Lower
+from django.utils import timezone
+from catalog.pagecache import invalidate, invalidate_authors, invalidate_books
+from catalog.search import index_books
+from catalog.stats import invalidate_dashboard_stats
+
+# Rows per INSERT/UPDATE statement, small enough for SQLite's variable limit
+BULK_BATCH_SIZE = 500
+
+class BulkResult(Schema):
+    index: int
+    success: bool
+    id: Union[int, UUID, None] = None
+    message: Optional[str] = None
+
+class BulkDeleteIn(Schema):
+    ids: List[int]
+
+class BookInstanceBulkDeleteIn(Schema):
+    ids: List[UUID]
+
+def atomic_bulk(view):
+    """Validate and write a batch in one transaction.
+
+    A row inserted or deleted by a concurrent request after validation
+    still makes the database reject the batch; that is answered with 409.
+    """
+    @functools.wraps(view)
+    def atomic_view(request, payload):
+        try:
+            with transaction.atomic():
+                return view(request, payload)
+        except IntegrityError:
+            return 409, {"message": "The batch conflicts with a concurrent change; retry it"}
+    return atomic_view
+
+def bulk_results(items, errors, objects):
+    """Build the per-item results from {index: message} errors and {index: saved object}."""
+    return [
+        {"index": i, "success": False, "message": errors[i]} if i in errors
+        else {"index": i, "success": True, "id": objects[i].pk}
+        for i in range(len(items))
+    ]
+
+def existing_ids(model, ids):
+    """Return the subset of ids that exist for model, in one query."""
+    return set(model.objects.filter(pk__in=set(ids)).order_by().values_list("pk", flat=True))
+
+def bulk_delete(model, ids):
+    """Delete the given rows in one transaction and report per id.
+
+    Rows still referenced by protected or restricted foreign keys are left
+    in place and reported as failures; the others are deleted.
+    """
+    found = existing_ids(model, ids)
+    errors = {pk: "Not found" for pk in ids if pk not in found}
+    while found:
+        try:
+            with transaction.atomic():
+                model.objects.filter(pk__in=found).delete()
+            break
+        except (ProtectedError, RestrictedError) as e:
+            referrers = e.protected_objects if isinstance(e, ProtectedError) else e.restricted_objects
+            blocked = referenced_ids(model, referrers, found)
+            if not blocked:
+                raise
+            errors.update(blocked)
+            found -= blocked.keys()
+    return [
+        {"index": i, "success": False, "id": pk, "message": errors[pk]} if pk in errors
+        else {"index": i, "success": True, "id": pk}
+        for i, pk in enumerate(ids)
+    ]
+
+def referenced_ids(model, referrers, ids):
+    """Map the ids of model rows that the referrers point to onto the reason they cannot be deleted."""
+    blocked = {}
+    for obj in referrers:
+        for field in obj._meta.concrete_fields:
+            pk = getattr(obj, field.attname) if field.is_relation and field.related_model is model else None
+            if pk in ids:
+                blocked.setdefault(pk, f"Referenced by {obj._meta.verbose_name} {obj.pk}")
+    return blocked
+
+def check_unique_names(model, payloads, errors):
+    """Record an error for names held by another row (case insensitive) or repeated in the batch."""
+    names = [payload.name.lower() for payload in payloads]
+    holders = dict(
+        model.objects.annotate(lower_name=Lower("name"))
+        .filter(lower_name__in=set(names))
+        .values_list("lower_name", "pk")
+    )
+    seen = set()
+    for i, name in enumerate(names):
+        own_id = getattr(payloads[i], "id", None)
+        if holders.get(name, own_id) != own_id or name in seen:
+            errors.setdefault(i, f"{model.__name__} with this name already exists")
+        seen.add(name)
+
+def fetch_for_update(model, payloads, errors):
+    """Load the rows named by payload ids in one query, recording missing ones as errors."""
+    rows = model.objects.in_bulk([payload.id for payload in payloads])
+    for i, payload in enumerate(payloads):
+        if payload.id not in rows:
+            errors[i] = "Not found"
+    return rows
+
+# Authors
+
+class AuthorUpdateIn(AuthorIn):
+    id: int
+
+@api.post("/authors/bulk", response={200: List[BulkResult], 409: Error}, auth=can("add", "author"))
+@atomic_bulk
+def bulk_create_authors(request, payload: List[AuthorIn]):
+    authors = [Author(**item.dict()) for item in payload]
+    Author.objects.bulk_create(authors, batch_size=BULK_BATCH_SIZE)
+    invalidate("author", [author.pk for author in authors])
+    invalidate_dashboard_stats()
+    return bulk_results(payload, {}, dict(enumerate(authors)))
+
+@api.put("/authors/bulk", response={200: List[BulkResult], 409: Error}, auth=can("change", "author"))
+@atomic_bulk
+def bulk_update_authors(request, payload: List[AuthorUpdateIn]):
+    errors = {}
+    rows = fetch_for_update(Author, payload, errors)
+    updated = {}
+    now = timezone.now()
+    for i, item in enumerate(payload):
+        if i not in errors:
+            author = rows[item.id]
+            for attr, value in item.dict(exclude={"id"}).items():
+                setattr(author, attr, value)
+            author.updated_at = now
+            updated[i] = author
+    Author.objects.bulk_update(
+        updated.values(), ["first_name", "last_name", "date_of_birth", "date_of_death", "updated_at"],
+        batch_size=BULK_BATCH_SIZE,
+    )
+    index_books(Book.objects.filter(author__in=updated.values()).values_list("pk", flat=True))
+    invalidate_authors([author.pk for author in updated.values()])
+    invalidate_dashboard_stats()
+    return bulk_results(payload, errors, updated)
+
+@api.delete("/authors/bulk", response={200: List[BulkResult], 409: Error}, auth=can("delete", "author"))
+@atomic_bulk
+def bulk_delete_authors(request, payload: BulkDeleteIn):
+    return bulk_delete(Author, payload.ids)
+
+# Genres and languages
+
+class GenreUpdateIn(GenreIn):
+    id: int
+
+class LanguageUpdateIn(LanguageIn):
+    id: int
+
+def bulk_create_named(model, payload):
+    """bulk_create for the models that only have a unique name."""
+    errors = {}
+    check_unique_names(model, payload, errors)
+    created = {i: model(name=item.name) for i, item in enumerate(payload) if i not in errors}
+    model.objects.bulk_create(created.values(), batch_size=BULK_BATCH_SIZE)
+    if model is Genre:
+        invalidate_dashboard_stats()
+    return bulk_results(payload, errors, created)
+
+def bulk_update_named(model, payload):
+    """bulk_update for the models that only have a unique name."""
+    errors = {}
+    rows = fetch_for_update(model, payload, errors)
+    check_unique_names(model, payload, errors)
+    updated = {}
+    now = timezone.now()
+    for i, item in enumerate(payload):
+        if i not in errors:
+            updated[i] = rows[item.id]
+            updated[i].name = item.name
+            updated[i].updated_at = now
+    model.objects.bulk_update(updated.values(), ["name", "updated_at"], batch_size=BULK_BATCH_SIZE)
+    if model is Genre:
+        book_ids = list(Book.objects.filter(genre__in=updated.values()).values_list("pk", flat=True))
+        index_books(book_ids)
+        invalidate("book", book_ids)
+        invalidate_dashboard_stats()
+    return bulk_results(payload, errors, updated)
+
+@api.post("/genres/bulk", response={200: List[BulkResult], 409: Error}, auth=can("add", "genre"))
+@atomic_bulk
+def bulk_create_genres(request, payload: List[GenreIn]):
+    return bulk_create_named(Genre, payload)
+
+@api.put("/genres/bulk", response={200: List[BulkResult], 409: Error}, auth=can("change", "genre"))
+@atomic_bulk
+def bulk_update_genres(request, payload: List[GenreUpdateIn]):
+    return bulk_update_named(Genre, payload)
+
+@api.delete("/genres/bulk", response={200: List[BulkResult], 409: Error}, auth=can("delete", "genre"))
+@atomic_bulk
+def bulk_delete_genres(request, payload: BulkDeleteIn):
+    return bulk_delete(Genre, payload.ids)
+
+@api.post("/languages/bulk", response={200: List[BulkResult], 409: Error}, auth=can("add", "language"))
+@atomic_bulk
+def bulk_create_languages(request, payload: List[LanguageIn]):
+    return bulk_create_named(Language, payload)
+
+@api.put("/languages/bulk", response={200: List[BulkResult], 409: Error}, auth=can("change", "language"))
+@atomic_bulk
+def bulk_update_languages(request, payload: List[LanguageUpdateIn]):
+    return bulk_update_named(Language, payload)
+
+@api.delete("/languages/bulk", response={200: List[BulkResult], 409: Error}, auth=can("delete", "language"))
+@atomic_bulk
+def bulk_delete_languages(request, payload: BulkDeleteIn):
+    return bulk_delete(Language, payload.ids)
+
+# Books
+
+class BookUpdateIn(BookIn):
+    id: int
+
+def check_books(payload, errors):
+    """Validate author_id, genre_ids and ISBN uniqueness for a batch of BookIn items."""
+    author_ids = existing_ids(Author, [item.author_id for item in payload])
+    genre_ids = existing_ids(Genre, [genre_id for item in payload for genre_id in item.genre_ids])
+    holders = dict(Book.objects.filter(isbn__in={item.isbn for item in payload}).values_list("isbn", "pk"))
+    seen = set()
+    for i, item in enumerate(payload):
+        own_id = getattr(item, "id", None)
+        if item.author_id not in author_ids:
+            errors.setdefault(i, f"Author {item.author_id} not found")
+        missing = set(item.genre_ids) - genre_ids
+        if missing:
+            errors.setdefault(i, f"Genre {min(missing)} not found")
+        if holders.get(item.isbn, own_id) != own_id or item.isbn in seen:
+            errors.setdefault(i, "Book with this ISBN already exists")
+        seen.add(item.isbn)
+
+def set_book_genres(books, payload):
+    """Link the newly created books to their genre_ids with one bulk INSERT."""
+    Through = Book.genre.through
+    Through.objects.bulk_create(
+        [Through(book_id=books[i].pk, genre_id=genre_id)
+         for i in books for genre_id in set(payload[i].genre_ids)],
+        batch_size=BULK_BATCH_SIZE,
+    )
+
+@api.post("/books/bulk", response={200: List[BulkResult], 409: Error}, auth=can("add", "book"))
+@atomic_bulk
+def bulk_create_books(request, payload: List[BookIn]):
+    errors = {}
+    check_books(payload, errors)
+    created = {
+        i: Book(title=item.title, author_id=item.author_id, summary=item.summary, isbn=item.isbn)
+        for i, item in enumerate(payload) if i not in errors
+    }
+    Book.objects.bulk_create(created.values(), batch_size=BULK_BATCH_SIZE)
+    set_book_genres(created, payload)
+    index_books([book.pk for book in created.values()])
+    invalidate("book", [book.pk for book in created.values()])
+    invalidate("author", [book.author_id for book in created.values()])
+    invalidate_dashboard_stats()
+    return bulk_results(payload, errors, created)
+
+@api.put("/books/bulk", response={200: List[BulkResult], 409: Error}, auth=can("change", "book"))
+@atomic_bulk
+def bulk_update_books(request, payload: List[BookUpdateIn]):
+    errors = {}
+    rows = fetch_for_update(Book, payload, errors)
+    check_books(payload, errors)
+    updated = {}
+    now = timezone.now()
+    for i, item in enumerate(payload):
+        if i not in errors:
+            book = rows[item.id]
+            book.title = item.title
+            book.author_id = item.author_id
+            book.summary = item.summary
+            book.isbn = item.isbn
+            book.updated_at = now
+            updated[i] = book
+    Book.objects.bulk_update(
+        updated.values(), ["title", "author", "summary", "isbn", "updated_at"], batch_size=BULK_BATCH_SIZE
+    )
+    set_genres({book.pk: payload[i].genre_ids for i, book in updated.items()}, refresh=False)
+    index_books([book.pk for book in updated.values()])
+    invalidate_books(
+        [book.pk for book in updated.values()], [book._loaded_author_id for book in updated.values()]
+    )
+    invalidate_dashboard_stats()
+    return bulk_results(payload, errors, updated)
+
+@api.delete("/books/bulk", response={200: List[BulkResult], 409: Error}, auth=can("delete", "book"))
+@atomic_bulk
+def bulk_delete_books(request, payload: BulkDeleteIn):
+    return bulk_delete(Book, payload.ids)
+
+# Book instances
+
+class BookInstanceUpdateIn(BookInstanceIn):
+    id: UUID
+
+def check_book_instances(payload, errors):
+    """Validate book_id, borrower_id and status for a batch of BookInstanceIn items."""
+    book_ids = existing_ids(Book, [item.book_id for item in payload])
+    borrower_ids = existing_ids(get_user_model(), [item.borrower_id for item in payload if item.borrower_id])
+    statuses = {code for code, label in BookInstance.LOAN_STATUS} | {""}
+    for i, item in enumerate(payload):
+        if item.book_id not in book_ids:
+            errors.setdefault(i, f"Book {item.book_id} not found")
+        if item.borrower_id and item.borrower_id not in borrower_ids:
+            errors.setdefault(i, f"Borrower {item.borrower_id} not found")
+        if item.status not in statuses:
+            errors.setdefault(i, f"Invalid status {item.status!r}")
+
+@api.post("/book_instances/bulk", response={200: List[BulkResult], 409: Error}, auth=can("add", "bookinstance"))
+@atomic_bulk
+def bulk_create_book_instances(request, payload: List[BookInstanceIn]):
+    errors = {}
+    check_book_instances(payload, errors)
+    created = {
+        i: BookInstance(**dict(item.dict(), borrower_id=item.borrower_id or None))
+        for i, item in enumerate(payload) if i not in errors
+    }
+    BookInstance.objects.bulk_create(created.values(), batch_size=BULK_BATCH_SIZE)
+    book_ids = {copy.book_id for copy in created.values()}
+    Book.objects.filter(pk__in=book_ids).recount_copies()
+    invalidate_books(book_ids)
+    invalidate_dashboard_stats()
+    return bulk_results(payload, errors, created)
+
+@api.put("/book_instances/bulk", response={200: List[BulkResult], 409: Error}, auth=can("change", "bookinstance"))
+@atomic_bulk
+def bulk_update_book_instances(request, payload: List[BookInstanceUpdateIn]):
+    errors = {}
+    rows = fetch_for_update(BookInstance, payload, errors)
+    check_book_instances(payload, errors)
+    updated = {}
+    now = timezone.now()
+    book_ids = set()
+    for i, item in enumerate(payload):
+        if i not in errors:
+            book_instance = rows[item.id]
+            book_ids.update([book_instance.book_id, item.book_id])
+            for attr, value in item.dict(exclude={"id"}).items():
+                setattr(book_instance, attr, value)
+            book_instance.borrower_id = item.borrower_id or None
+            book_instance.updated_at = now
+            updated[i] = book_instance
+    BookInstance.objects.bulk_update(
+        updated.values(), ["book", "imprint", "due_back", "borrower", "status", "updated_at"],
+        batch_size=BULK_BATCH_SIZE,
+    )
+    Book.objects.filter(pk__in=book_ids).recount_copies()
+    invalidate_books(book_ids)
+    invalidate_dashboard_stats()
+    return bulk_results(payload, errors, updated)
+
+@api.delete("/book_instances/bulk", response={200: List[BulkResult], 409: Error}, auth=can("delete", "bookinstance"))
+@atomic_bulk
+def bulk_delete_book_instances(request, payload: BookInstanceBulkDeleteIn):
+    return bulk_delete(BookInstance, payload.ids)
+
+
+# Loan desk: checkout, return, renew and reserve (see catalog/loans.py).
+#
+# Every operation is a conditional UPDATE of the copy, so concurrent
+# requests for the same copy cannot both succeed; the loser gets a 409.
+# Only librarians (can_mark_returned) may change loans.
+from catalog.loans import CopyNotFound, LoanError, checkout, checkout_book, renew, reserve, return_copy, run_loan_actions
+
+class LoanIn(Schema):
+    borrower_id: Optional[int] = None
+    due_back: Optional[date] = None
+
+class LoanActionIn(LoanIn):
+    action: str
+    book_instance_id: UUID
+
+LOAN_RESPONSES = {200: BookInstanceOut, 404: Error, 409: Error}
+
+librarian = PermissionAuth("catalog.can_mark_returned")
+
+def loan(operation, *args, **kwargs):
+    """Run a loan operation and answer with the copy or the reason it was refused."""
+    try:
+        return operation(*args, **kwargs)
+    except CopyNotFound as e:
+        return 404, {"message": str(e)}
+    except LoanError as e:
+        return 409, {"message": str(e)}
+
+@api.post("/book_instance/{book_instance_id}/checkout", response=LOAN_RESPONSES, auth=librarian)
+def checkout_book_instance(request, book_instance_id: UUID, payload: LoanIn):
+    return loan(checkout, book_instance_id, payload.borrower_id, payload.due_back)
+
+@api.post("/book_instance/{book_instance_id}/return", response=LOAN_RESPONSES, auth=librarian)
+def return_book_instance(request, book_instance_id: UUID):
+    return loan(return_copy, book_instance_id)
+
+@api.post("/book_instance/{book_instance_id}/renew", response=LOAN_RESPONSES, auth=librarian)
+def renew_book_instance(request, book_instance_id: UUID, payload: LoanIn):
+    return loan(renew, book_instance_id, due_back=payload.due_back)
+
+@api.post("/book_instance/{book_instance_id}/reserve", response=LOAN_RESPONSES, auth=librarian)
+def reserve_book_instance(request, book_instance_id: UUID, payload: LoanIn):
+    return loan(reserve, book_instance_id, payload.borrower_id)
+
+@api.post("/book/{book_id}/checkout", response=LOAN_RESPONSES, auth=librarian)
+def checkout_any_copy(request, book_id: int, payload: LoanIn):
+    return loan(checkout_book, book_id, payload.borrower_id, payload.due_back)
+
+@api.post("/loans/batch", response=List[BulkResult], auth=librarian)
+def batch_loans(request, payload: List[LoanActionIn]):
+    """Apply many loan actions (e.g. barcodes scanned at the desk) in one transaction."""
+    results = run_loan_actions(
+        (item.action, item.book_instance_id, item.borrower_id, item.due_back) for item in payload
+    )
+    return [
+        {"index": i, "success": False, "id": item.book_instance_id, "message": str(result)}
+        if isinstance(result, LoanError)
+        else {"index": i, "success": True, "id": result.pk}
+        for i, (item, result) in enumerate(zip(payload, results))
+    ]
+
+
+# Genre assignment for many books at once (see catalog/genres.py).
+#
+# POST adds and removes genres on every listed book, PUT replaces their
+# genres. Only the links that change are written; books that do not exist
+# are skipped and listed in not_found.
+from catalog.genres import assign_genres
+
+class GenreAssignmentIn(Schema):
+    book_ids: List[int]
+    add: List[int] = []
+    remove: List[int] = []
+
+class GenreReplaceIn(Schema):
+    book_ids: List[int]
+    genre_ids: List[int]
+
+class GenreAssignmentOut(Schema):
+    added: int
+    removed: int
+    not_found: List[int]
+
+def check_genres(genre_ids):
+    """Return an error message if any of genre_ids does not exist."""
+    missing = set(genre_ids) - existing_ids(Genre, genre_ids)
+    if missing:
+        return f"Genre {min(missing)} not found"
+
+@api.post("/books/genres", response={200: GenreAssignmentOut, 400: Error}, auth=can("change", "book"))
+def assign_book_genres(request, payload: GenreAssignmentIn):
+    if message := check_genres(payload.add + payload.remove):
+        return 400, {"message": message}
+    found = existing_ids(Book, payload.book_ids)
+    try:
+        added, removed = assign_genres(found, payload.add, payload.remove)
+    except ValueError as e:
+        return 400, {"message": str(e)}
+    return {"added": added, "removed": removed, "not_found": sorted(set(payload.book_ids) - found)}
+
+@api.put("/books/genres", response={200: GenreAssignmentOut, 400: Error}, auth=can("change", "book"))
+def replace_book_genres(request, payload: GenreReplaceIn):
+    if message := check_genres(payload.genre_ids):
+        return 400, {"message": message}
+    found = existing_ids(Book, payload.book_ids)
+    added, removed = set_genres({book_id: payload.genre_ids for book_id in found})
+    return {"added": added, "removed": removed, "not_found": sorted(set(payload.book_ids) - found)}
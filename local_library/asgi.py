@@ -2,6 +2,7 @@
 ASGI config for local_library project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with uvicorn, e.g. ``uvicorn local_library.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -12,5 +13,10 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "local_library.settings")
+# Serve the read pages and API GET endpoints with their async versions
+os.environ.setdefault("CATALOG_ASYNC_VIEWS", "True")
+# Persistent connections outlive the per-request threads of async requests
+# and are not reused; use DATABASE_POOL on PostgreSQL instead
+os.environ.setdefault("DATABASE_CONN_MAX_AGE", "0")
 
 application = get_asgi_application()
@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "catalog.instrumentation.RequestInstrumentationMiddleware",
+    "catalog.replicas.ReplicaMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -94,6 +96,12 @@ DATABASES = {
 }
 
 
+# Authentication: ModelBackend with permission sets cached across requests
+AUTHENTICATION_BACKENDS = [
+    "catalog.permissions.CachedModelBackend",
+]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -139,6 +147,70 @@ LOGIN_REDIRECT_URL = '/'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Cache used for derived catalog data such as the home page record counts,
+# e.g. CACHE_URL=redis://127.0.0.1:6379/1 or memcache://127.0.0.1:11211.
+# The default LocMemCache is private to each server process, so entries
+# another process invalidates are only kept for CATALOG_LOCAL_CACHE_TIMEOUT
+CACHES = {
+    "default": env.cache_url("CACHE_URL", default="locmemcache://"),
+}
+
+# Seconds the home page record counts are cached for (see catalog/stats.py)
+CATALOG_STATS_CACHE_TIMEOUT = int(os.getenv("CATALOG_STATS_CACHE_TIMEOUT", "60"))
+
+# Lifetime of cached detail pages and fragments; they are also dropped as
+# soon as the objects shown change (catalog/pagecache.py)
+CATALOG_PAGE_CACHE_TIMEOUT = int(os.getenv("CATALOG_PAGE_CACHE_TIMEOUT", "3600"))
+
+# Lifetime of invalidated cache entries when the cache is not shared by the
+# server processes (catalog/pagecache.py)
+CATALOG_LOCAL_CACHE_TIMEOUT = int(os.getenv("CATALOG_LOCAL_CACHE_TIMEOUT", "10"))
+
+# Lifetime of cached permission sets; they are also dropped as soon as
+# permission or group assignments change (catalog/permissions.py)
+CATALOG_PERMISSION_CACHE_TIMEOUT = int(os.getenv("CATALOG_PERMISSION_CACHE_TIMEOUT", "3600"))
+
+# Request instrumentation (catalog/instrumentation.py): share of requests
+# measured, repeats of one statement flagged as N+1, Server-Timing header
+# (off by default as it exposes timings to every client; on with DEBUG)
+CATALOG_INSTRUMENTATION_SAMPLE_RATE = float(os.getenv("CATALOG_INSTRUMENTATION_SAMPLE_RATE", "0.1"))
+CATALOG_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = int(os.getenv("CATALOG_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD", "5"))
+CATALOG_SERVER_TIMING = os.getenv("CATALOG_SERVER_TIMING", "False") == "True"
+
+# Days between two overdue notices for the same loan (catalog/overdue.py)
+CATALOG_OVERDUE_NOTICE_INTERVAL_DAYS = int(os.getenv("CATALOG_OVERDUE_NOTICE_INTERVAL_DAYS", "7"))
+
+# Session storage. The signed_cookies and cache backends avoid a database
+# write per session change; see the benchmark_sessions command
+SESSION_ENGINE = os.getenv("SESSION_ENGINE", "django.contrib.sessions.backends.db")
+
+# Home page visit counter (catalog/visits.py): "session" saves the session
+# on every visit, "cache" counts in a shared cache and saves the count in
+# the session every CATALOG_VISIT_FLUSH_EVERY visits
+CATALOG_VISIT_COUNTER = os.getenv("CATALOG_VISIT_COUNTER", "session")
+CATALOG_VISIT_FLUSH_EVERY = int(os.getenv("CATALOG_VISIT_FLUSH_EVERY", "10"))
+
+# Serve the catalog read pages and API GET endpoints with their async
+# versions; local_library/asgi.py switches this on
+CATALOG_ASYNC_VIEWS = os.getenv("CATALOG_ASYNC_VIEWS", "False") == "True"
+
+# One JSON record per measured request is logged at INFO to catalog.requests,
+# requests with repeated queries at WARNING
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "catalog.requests": {
+            "handlers": ["console"],
+            "level": os.getenv("CATALOG_REQUEST_LOG_LEVEL", "WARNING"),
+            "propagate": False,
+        },
+    },
+}
+
 LOGIN_URL = 'login'
 
 LOGOUT_REDIRECT_URL = 'login'
@@ -151,11 +223,84 @@ DEBUG = os.getenv("DEBUG", "False") == "True"
 
 DEVELOPMENT_MODE = os.getenv("DEVELOPMENT_MODE", "False") == "True"
 
+# Database connection reuse. Connections are kept for DATABASE_CONN_MAX_AGE
+# seconds across requests (0 opens one per request) and, with health
+# checks, tested before being reused after an idle period. DATABASE_POOL
+# keeps a connection pool per process instead; it needs PostgreSQL with
+# psycopg[pool] (psycopg 3) installed and disables DATABASE_CONN_MAX_AGE.
+# The benchmark_connections command compares them.
+DATABASE_CONN_MAX_AGE = int(os.getenv("DATABASE_CONN_MAX_AGE", "60"))
+DATABASE_CONN_HEALTH_CHECKS = os.getenv("DATABASE_CONN_HEALTH_CHECKS", "True") == "True"
+DATABASE_POOL = os.getenv("DATABASE_POOL", "False") == "True"
+DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "2"))
+DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+# Seconds a request waits for a free pooled connection before failing
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "10"))
+
+
+# SQLite tuning profile, applied to every SQLite database on connection:
+# write-ahead logging (readers no longer block on the writer), fsync only
+# at checkpoints, memory-mapped reads, a larger page cache, a busy timeout
+# and BEGIN IMMEDIATE for transactions, so that a transaction that reads
+# before it writes waits for the write lock instead of failing with
+# "database is locked". The benchmark_sqlite command compares it with the
+# default settings.
+SQLITE_TUNING = os.getenv("SQLITE_TUNING", "True") == "True"
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Pages, or KiB when negative
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+# Seconds a connection waits for a lock before failing
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "10"))
+
+
+SQLITE_TUNED_OPTIONS = {
+    "init_command": ";".join([
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size={SQLITE_CACHE_SIZE}",
+    ]),
+    "transaction_mode": "IMMEDIATE",
+    "timeout": SQLITE_BUSY_TIMEOUT,
+}
+
+
+def sqlite_options():
+    """OPTIONS of the SQLite tuning profile (none when it is off)."""
+    return dict(SQLITE_TUNED_OPTIONS) if SQLITE_TUNING else {}
+
+
+def database_config(url):
+    """The DATABASES entry for url, with the connection reuse settings above."""
+    if url.startswith("sqlite:"):
+        config = dj_database_url.parse(
+            url, conn_max_age=DATABASE_CONN_MAX_AGE, conn_health_checks=DATABASE_CONN_HEALTH_CHECKS,
+        )
+        config["OPTIONS"] = {**sqlite_options(), **config.get("OPTIONS", {})}
+        return config
+    if not DATABASE_POOL:
+        return dj_database_url.parse(
+            url, conn_max_age=DATABASE_CONN_MAX_AGE, conn_health_checks=DATABASE_CONN_HEALTH_CHECKS,
+        )
+    from psycopg_pool import ConnectionPool
+
+    config = dj_database_url.parse(url)
+    config.setdefault("OPTIONS", {})["pool"] = {
+        "min_size": DATABASE_POOL_MIN_SIZE,
+        "max_size": DATABASE_POOL_MAX_SIZE,
+        "timeout": DATABASE_POOL_TIMEOUT,
+        # Health check of each connection as it leaves the pool
+        "check": ConnectionPool.check_connection,
+    }
+    return config
+
+
 if DEVELOPMENT_MODE is True:
     DATABASES = {
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
+            "OPTIONS": sqlite_options(),
         }
     }
 elif len(sys.argv) > 0 and sys.argv[1] != 'collectstatic':
@@ -166,13 +311,32 @@ elif len(sys.argv) > 0 and sys.argv[1] != 'collectstatic':
             "default": {
                 "ENGINE": "django.db.backends.sqlite3",
                 "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
+                "CONN_MAX_AGE": DATABASE_CONN_MAX_AGE,
+                "CONN_HEALTH_CHECKS": DATABASE_CONN_HEALTH_CHECKS,
+                "OPTIONS": sqlite_options(),
+                # Tests use a file: the shared-cache in-memory database locks
+                # whole tables, so concurrent writers fail instead of waiting
+                "TEST": {"NAME": os.path.join(BASE_DIR, "test_db.sqlite3")},
             }
         }
     else:
         DATABASES = {
-            "default": dj_database_url.parse(DATABASE_URL),
+            "default": database_config(DATABASE_URL),
         }
 
+# Read replicas of the default database, as space or comma separated URLs.
+# ReplicaRouter sends the catalog's reads during GET requests to them
+# (catalog/replicas.py). The test suite runs against the primary alone, as
+# its transactions are not visible on other connections.
+if sys.argv[1:2] != ["test"]:
+    for number, url in enumerate(os.getenv("DATABASE_REPLICA_URLS", "").replace(",", " ").split(), 1):
+        DATABASES[f"replica{number}"] = database_config(url)
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["catalog.replicas.ReplicaRouter"]
+
+# Seconds a browser keeps reading from the primary after changing the catalog
+DATABASE_REPLICA_STICKINESS = int(os.getenv("DATABASE_REPLICA_STICKINESS", "10"))
+
 STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 STATICFILES_DIRS = (os.path.join(BASE_DIR, "static"),)
@@ -34,6 +34,13 @@ urlpatterns += [
     path('accounts/', include('django.contrib.auth.urls')),
 ]
 
+# Mount the Ninja API defined in local_library/api.py
+from local_library.api import api
+
+urlpatterns += [
+    path('api/', api.urls),
+]
+
 # Add URL maps to redirect the base URL to our application
 from django.views.generic import RedirectView
 urlpatterns += [